@@ -1,9 +1,12 @@
 """ Module to register models to manage on django admin """
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import register
 
 from api.models import DataFile
 from api.models import GeneralData
+from api.models import HeaderLayout
+from api.models import CountryDailySummary
 
 
 @register(DataFile)
@@ -26,10 +29,12 @@ class DataFileAdmin(admin.ModelAdmin):
     )
 
     def re_process_file(self, request, queryset):
-        """ Method to sent to retry files """
-        from api.tasks import file_data_importer
-        for data_file in queryset.filter(processed=False):
-            file_data_importer.delay(data_file.id)
+        """ Method to sent to retry files, rows already imported from a file are replaced """
+        from api.tasks import enqueue_import
+        # Sent with high priority so they are not queued behind bulk sync imports
+        priority = getattr(settings, 'API_TASK_PRIORITY_INTERACTIVE', 9)
+        for data_file in queryset:
+            enqueue_import(data_file_id=data_file.id, priority=priority)
         self.message_user(request, 'File send to process successfully...')
 
     actions = [
@@ -39,3 +44,28 @@ class DataFileAdmin(admin.ModelAdmin):
 @register(GeneralData)
 class GeneralDataAdmin(admin.ModelAdmin):
     list_display = [f.name for f in GeneralData._meta.fields]
+
+
+@register(CountryDailySummary)
+class CountryDailySummaryAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in CountryDailySummary._meta.fields]
+    list_filter = (
+        'report_day',
+    )
+    search_fields = (
+        'country_region',
+    )
+
+
+@register(HeaderLayout)
+class HeaderLayoutAdmin(admin.ModelAdmin):
+    list_display = (
+        'fingerprint',
+        'columns',
+        'date_format',
+        'update_date',
+    )
+    readonly_fields = (
+        'fingerprint',
+        'columns',
+    )
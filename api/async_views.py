@@ -0,0 +1,105 @@
+"""
+Module to define async versions of read endpoints for ASGI deployments (API_ASYNC_READ_VIEWS).
+Django sync views under ASGI run one at time on a single thread by process, these views keep the event loop
+free and run database work (queries, cache, serialization) on a bounded pool of threads, so requests waiting
+on postgres do not block each other and open connections are limited to pool size by process.
+"""
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db import close_old_connections
+
+from api.metrics import REQUEST_QUERY_COUNTER
+from api.middleware import install_query_counter
+from api.views import GeneralDataViewSet
+from api.views import CountryDailySummaryViewSet
+
+
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'API_ASYNC_DB_WORKERS', 8),
+    thread_name_prefix='api-db',
+)
+
+
+def _run_with_connections(func, *args, **kwargs):
+    """
+    Inner function running a job on a pool thread, its connection is checked like on request start/end and
+    its queries are counted on profiled request (connection opened before profiling was enabled included).
+    """
+    close_old_connections()
+    if REQUEST_QUERY_COUNTER.get() is not None:
+        install_query_counter(connections['default'])
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Util to await a sync function run on DB_EXECUTOR, context vars (e.g. profiled request timer) are kept.
+    Args:
+        func: A callable doing database work.
+        *args: Positional arguments of func.
+        **kwargs: Keyword arguments of func.
+
+    Returns:
+        Value returned by func.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        DB_EXECUTOR,
+        functools.partial(context.run, _run_with_connections, func, *args, **kwargs),
+    )
+
+
+def _render(view, request, *args, **kwargs):
+    """ Inner function calling a sync view and rendering its (rest framework) response """
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    return response
+
+
+def as_async_view(view):
+    """
+    Util to get a coroutine view running a sync view on DB_EXECUTOR.
+    Args:
+        view: A sync view callable (e.g. ViewSet.as_view(...)).
+
+    Returns:
+        A coroutine function view.
+    """
+    async def async_view(request, *args, **kwargs):
+        return await run_in_db_thread(_render, view, request, *args, **kwargs)
+
+    functools.update_wrapper(async_view, view, assigned=('__module__', '__name__', '__qualname__', '__doc__'))
+    async_view.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return async_view
+
+
+def get_viewset_action(viewset, action, basename):
+    """
+    Util to get async view of a list route viewset action.
+    Args:
+        viewset: A rest_framework.viewsets.ViewSet class.
+        action: A str describing viewset method name, e.g. list.
+        basename: A str describing router basename of viewset, e.g. generaldata.
+
+    Returns:
+        A coroutine function view.
+    """
+    return as_async_view(viewset.as_view({'get': action}, basename=basename, detail=False))
+
+
+general_data_list = get_viewset_action(GeneralDataViewSet, 'list', 'generaldata')
+general_data_today = get_viewset_action(GeneralDataViewSet, 'today', 'generaldata')
+general_data_last = get_viewset_action(GeneralDataViewSet, 'last', 'generaldata')
+general_data_timeseries = get_viewset_action(GeneralDataViewSet, 'timeseries', 'generaldata')
+summary_list = get_viewset_action(CountryDailySummaryViewSet, 'list', 'countrydailysummary')
+summary_totals = get_viewset_action(CountryDailySummaryViewSet, 'totals', 'countrydailysummary')
@@ -0,0 +1,109 @@
+"""
+Module to manage api response cache versioned by dataset imports.
+Dataset version is bumped by the process running an import (celery worker), so cache backend must be shared
+by web and worker processes (e.g. memcached), with a per process backend as LocMemCache web processes keep
+serving old responses until API_RESPONSE_CACHE_TIMEOUT.
+"""
+import time
+import hashlib
+import functools
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http.response import HttpResponse
+from django.utils import timezone
+
+
+DATASET_VERSION_KEY = 'api:dataset_version'
+RESPONSE_CACHE_ALIAS = getattr(settings, 'API_RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_cache():
+    """ Util to get cache backend used by api """
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def get_dataset_version():
+    """
+    Util to get global dataset version, it change every time an import is committed.
+    Returns:
+        A int describing dataset version.
+    """
+    cache = get_cache()
+    version = cache.get(DATASET_VERSION_KEY)
+    if version is None:
+        # Seed with a timestamp, so a evicted version never collide with older cached entries
+        cache.add(DATASET_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(DATASET_VERSION_KEY)
+    return version
+
+
+def bump_dataset_version():
+    """
+    Util to invalidate all versioned responses after GeneralData changes.
+    Returns:
+        A int describing new dataset version.
+    """
+    cache = get_cache()
+    try:
+        return cache.incr(DATASET_VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(DATASET_VERSION_KEY, version, timeout=None)
+        return version
+
+
+def build_versioned_key(name, *parts):
+    """
+    Util to build a cache key attached to actual dataset version, parts are hashed so key length and chars
+    are valid on every backend (memcached refuses keys longer than 250 chars or with spaces).
+    Args:
+        name: A str describing cached resource.
+        *parts: Values making key unique for resource.
+
+    Returns:
+        A str describing cache key.
+    """
+    return 'api:{version}:{name}:{digest}'.format(
+        version=get_dataset_version(),
+        name=name,
+        digest=hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest(),
+    )
+
+
+def versioned_response_cache(vary_on_date=False):
+    """
+    Decorator to cache rendered bytes of a viewset action until dataset version change.
+    Args:
+        vary_on_date: A bool indicating if cache entry depends on current date.
+
+    Returns:
+        A decorator for viewset methods.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key_parts = [request.get_full_path(), request.accepted_media_type]
+            if vary_on_date:
+                key_parts.append(timezone.localdate())
+            cache_key = build_versioned_key(method.__name__, *key_parts)
+            cache = get_cache()
+            cached = cache.get(cache_key)
+            if cached is None:
+                response = method(view, request, *args, **kwargs)
+                renderer = request.accepted_renderer
+                content_type = renderer.media_type
+                if renderer.charset:
+                    content_type = '{0}; charset={1}'.format(content_type, renderer.charset)
+                content = renderer.render(
+                    response.data,
+                    request.accepted_media_type,
+                    view.get_renderer_context(),
+                )
+                cached = (response.status_code, content_type, content)
+                cache.set(cache_key, cached, timeout=RESPONSE_CACHE_TIMEOUT)
+            status_code, content_type, content = cached
+            return HttpResponse(content, status=status_code, content_type=content_type)
+        return wrapper
+    return decorator
@@ -11,3 +11,23 @@ class HeaderNotIdentifier(Exception):
 
 class DateFormatNotIdentifier(Exception):
     """ Exception describing that identify date format for string was not successfully """
+
+
+class RateLimitExceeded(Exception):
+    """ Exception describing that server rate limit was reached, retry_after give seconds to wait """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CopySlotUnavailable(Exception):
+    """ Exception describing that every slot of simultaneous COPY loads is taken """
+
+
+class NewerVersionProcessed(Exception):
+    """ Exception describing that a newer revision of the same source file was already imported """
+
+
+class LoadTestServerError(Exception):
+    """ Exception describing that server under load test could not be started """
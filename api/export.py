@@ -0,0 +1,144 @@
+""" Module to stream database exports without buffering them on memory """
+import queue
+import zlib
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+
+LOGGER = logging.getLogger(__file__)
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'API_EXPORT_CHUNK_SIZE', 64 * 1024)
+EXPORT_MAX_PENDING_CHUNKS = getattr(settings, 'API_EXPORT_MAX_PENDING_CHUNKS', 8)
+
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """ Exception raised inside COPY writer when client stop consuming the export """
+
+
+class _ChunkQueueWriter:
+    """
+    File-like object receiving COPY output, group it on chunk_size blocks and hand them over
+    a bounded queue, so COPY wait for the client instead of filling memory.
+    """
+
+    def __init__(self, chunks, cancelled, chunk_size):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def put(self, item):
+        """ Put item on queue waiting while the consumer is alive """
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise ExportCancelled
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise ExportCancelled
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def _copy_to_writer(sql, params, writer, using):
+    """
+    Thread target running COPY ... TO STDOUT over its own DB connection.
+    Args:
+        sql: A str describing query to export.
+        params: A tuple describing query params.
+        writer: A _ChunkQueueWriter object receiving COPY output.
+        using: A str describing database alias.
+    """
+    connection = connections[using]
+    try:
+        with connection.cursor() as cursor:
+            query = cursor.mogrify(sql, params).decode('utf-8')
+            cursor.copy_expert('COPY ({query}) TO STDOUT WITH CSV HEADER'.format(query=query), writer)
+        writer.flush()
+        writer.put(_DONE)
+    except ExportCancelled:
+        LOGGER.info(msg='Export cancelled by client.')
+    except Exception as err:  # Error is re-raised on consumer side
+        try:
+            writer.put(err)
+        except ExportCancelled:
+            pass
+    finally:
+        connection.close()
+
+
+def stream_queryset_csv(queryset, fields=None, compress=False, chunk_size=None):
+    """
+    Util to stream a queryset as csv through postgres COPY, memory keeps bounded to
+    chunk_size * API_EXPORT_MAX_PENDING_CHUNKS independently of rows exported.
+    Args:
+        queryset: A django.db.models.QuerySet object to export.
+        fields: A list describing model field names to export, all concrete fields by default.
+        compress: A bool indicating if output must be gzip compressed.
+        chunk_size: A int describing bytes per chunk yielded.
+
+    Returns:
+        A generator of bytes chunks.
+    """
+    if fields is None:
+        fields = [field.attname for field in queryset.model._meta.concrete_fields]
+    sql, params = queryset.values(*fields).query.sql_with_params()
+    chunks = queue.Queue(maxsize=EXPORT_MAX_PENDING_CHUNKS)
+    cancelled = threading.Event()
+    writer = _ChunkQueueWriter(
+        chunks=chunks,
+        cancelled=cancelled,
+        chunk_size=chunk_size or EXPORT_CHUNK_SIZE,
+    )
+    worker = threading.Thread(
+        target=_copy_to_writer,
+        kwargs={
+            'sql': sql,
+            'params': params,
+            'writer': writer,
+            'using': queryset.db,
+        },
+        daemon=True,
+    )
+
+    def generator():
+        # wbits=31 means gzip container instead of raw zlib stream
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        worker.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if compressor:
+                    item = compressor.compress(item)
+                    if not item:
+                        continue
+                yield item
+            if compressor:
+                yield compressor.flush()
+        finally:
+            cancelled.set()
+            worker.join(timeout=5)
+
+    return generator()
@@ -0,0 +1,17 @@
+""" Module to define api filter sets """
+from django_filters import rest_framework as filters
+
+from api.models import GeneralData
+
+
+class GeneralDataExportFilter(filters.FilterSet):
+    """ FilterSet used to narrow csv exports, report_day accept report_day_after/report_day_before params """
+    report_day = filters.DateFromToRangeFilter()
+    country_region = filters.CharFilter()
+
+    class Meta:
+        model = GeneralData
+        fields = [
+            'report_day',
+            'country_region',
+        ]
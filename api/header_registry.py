@@ -0,0 +1,83 @@
+"""
+Module to resolve csv header layouts through HeaderLayout registry with an in-process cache. Cached layouts
+expire after API_HEADER_LAYOUT_CACHE_TTL, so a mapping fixed on admin reaches every worker process shortly.
+"""
+import time
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.text import slugify
+
+from api.models import HeaderLayout
+from api.utils import csv_header2model_field_mapper
+
+
+LAYOUT_CACHE_TTL = getattr(settings, 'API_HEADER_LAYOUT_CACHE_TTL', 60)
+# Layout and its expiration (monotonic seconds) by fingerprint
+_LAYOUT_CACHE = {}
+
+
+def header_fingerprint(csv_header):
+    """
+    Util to identify a header layout independently of spaces, case and separators on column names.
+    Args:
+        csv_header: A list with str values of column names of csv file.
+
+    Returns:
+        A hex str describing layout fingerprint.
+    """
+    normalized = '\x1f'.join(slugify(column.strip()) for column in csv_header)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def get_header_layout(csv_header):
+    """
+    Util to get registered layout of a header, registering it with detected mapping if it is new.
+    Args:
+        csv_header: A list with str values of column names of csv file.
+
+    Returns:
+        A HeaderLayout object.
+    """
+    fingerprint = header_fingerprint(csv_header)
+    layout, expires = _LAYOUT_CACHE.get(fingerprint, (None, 0))
+    if layout is not None and time.monotonic() < expires:
+        return layout
+    try:
+        layout = HeaderLayout.objects.get(fingerprint=fingerprint)
+    except HeaderLayout.DoesNotExist:
+        try:
+            layout = HeaderLayout.objects.create(
+                fingerprint=fingerprint,
+                columns=[column.strip() for column in csv_header],
+                field_mapping=csv_header2model_field_mapper(csv_header=csv_header),
+            )
+        except IntegrityError:
+            # Registered at the same time by another worker
+            layout = HeaderLayout.objects.get(fingerprint=fingerprint)
+    _LAYOUT_CACHE[fingerprint] = (layout, time.monotonic() + LAYOUT_CACHE_TTL)
+    return layout
+
+
+def remember_date_format(layout, date_format):
+    """
+    Util to save date format working for a layout, so next files skip format trial.
+    Args:
+        layout: A HeaderLayout object.
+        date_format: A str describing last_update format.
+    """
+    if not date_format or layout.date_format == date_format:
+        return
+    layout.date_format = date_format
+    layout.save(update_fields=['date_format', 'update_date'])
+
+
+@receiver(post_save, sender=HeaderLayout)
+@receiver(post_delete, sender=HeaderLayout)
+def clear_layout_cache(sender, instance, **kwargs):
+    """ Receiver dropping cached layout changed on this process, other processes read it after its TTL """
+    _LAYOUT_CACHE.pop(instance.fingerprint, None)
@@ -0,0 +1,150 @@
+""" Module to define shared http client with connection pooling and retry system """
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from api.exceptions import RateLimitExceeded
+
+
+LOGGER = logging.getLogger(__file__)
+
+RETRY_STATUS_CODES = frozenset([500, 502, 503, 504])
+RATE_LIMIT_STATUS_CODES = frozenset([403, 429])
+
+
+class HttpClient:
+    """
+    Http client keeping a pooled requests.Session per thread (keep-alive between calls).
+    Timeouts, connection errors and 5xx responses are retried with exponential backoff and full jitter,
+    rate limit responses raise RateLimitExceeded so callers can reschedule instead of blocking.
+    """
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_cap=8.0, pool_size=10, timeout=60):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """ Session of actual thread, created on first use """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def get_backoff(self, attempt):
+        """
+        Method to get seconds to wait before retry an attempt.
+        Args:
+            attempt: A int describing number of failed attempts (starting on 0).
+
+        Returns:
+            A float describing seconds.
+        """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def check_rate_limit(response):
+        """
+        Method to raise RateLimitExceeded if response describe a rate limit (github X-RateLimit-* or Retry-After).
+        Args:
+            response: A requests.Response object.
+        """
+        if response.status_code not in RATE_LIMIT_STATUS_CODES:
+            return
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                retry_after = max(float(retry_after), 1.0)
+            except ValueError:
+                retry_after = None
+        if retry_after is None and response.headers.get('X-RateLimit-Remaining') == '0':
+            try:
+                reset = float(response.headers.get('X-RateLimit-Reset', 0))
+            except ValueError:
+                reset = 0
+            retry_after = max(reset - time.time(), 1.0)
+        if retry_after is not None:
+            response.close()
+            raise RateLimitExceeded(
+                'Rate limit reached on {url}.'.format(url=response.url),
+                retry_after=retry_after,
+            )
+
+    def request(self, method, url, **kwargs):
+        """
+        Method to perform a request retrying transient failures.
+        Args:
+            method: A str describing http method.
+            url: A str describing url.
+            **kwargs: Extra kwargs to pass on requests.Session.request method.
+
+        Returns:
+            A requests.Response object.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    raise err
+                LOGGER.info(msg='Request to {url} failed ({error}), retry {attempt}.'.format(
+                    url=url,
+                    error=err,
+                    attempt=attempt,
+                ))
+                time.sleep(self.get_backoff(attempt - 1))
+                continue
+
+            self.check_rate_limit(response)
+            if response.status_code in RETRY_STATUS_CODES and attempt + 1 < self.max_retries:
+                attempt += 1
+                LOGGER.info(msg='Request to {url} answer {status}, retry {attempt}.'.format(
+                    url=url,
+                    status=response.status_code,
+                    attempt=attempt,
+                ))
+                response.close()
+                time.sleep(self.get_backoff(attempt - 1))
+                continue
+            return response
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client():
+    """
+    Util to get http client shared by the process.
+    Returns:
+        A HttpClient object.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = HttpClient(
+                    max_retries=getattr(settings, 'API_HTTP_MAX_RETRIES', 3),
+                    backoff_base=getattr(settings, 'API_HTTP_BACKOFF_BASE', 0.5),
+                    backoff_cap=getattr(settings, 'API_HTTP_BACKOFF_CAP', 8.0),
+                    pool_size=getattr(settings, 'API_HTTP_POOL_SIZE', 10),
+                    timeout=getattr(settings, 'API_HTTP_TIMEOUT', 60),
+                )
+    return _CLIENT
@@ -0,0 +1,338 @@
+""" Module to bulk load normalized data on database through postgres COPY """
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db import DatabaseError
+from django.db import transaction
+
+from api.exceptions import CopySlotUnavailable
+
+
+# Advisory lock namespace ('copy') of COPY slots, second key is the slot number
+COPY_SLOT_LOCK_NAMESPACE = 0x636f7079
+COPY_SLOT_POLL_INTERVAL = 0.5
+# Advisory lock namespace ('srce') of loads of a same source file, second key is a hash of its path
+SOURCE_LOCK_NAMESPACE = 0x73726365
+
+
+def get_backfill_copy_slots():
+    """
+    Util to get COPY slots bulk backfill can take, at least one slot is kept for celery imports (admin
+    re-processes) whenever there are two or more.
+    Returns:
+        A int describing slots or None if COPY loads are not capped.
+    """
+    slots = getattr(settings, 'API_MAX_CONCURRENT_COPY', None)
+    if not slots:
+        return None
+    return max(min(getattr(settings, 'API_BACKFILL_COPY_SLOTS', slots - 1), slots - 1), 1)
+
+
+@contextmanager
+def copy_slot(using='default', slots=None, timeout=0, limit=None):
+    """
+    Context manager capping simultaneous COPY loads of every worker through postgres advisory locks, one
+    lock by slot. Locks are session level, so they are released too if worker dies and its connection closes.
+    Args:
+        using: A str describing database alias.
+        slots: A int describing available slots, API_MAX_CONCURRENT_COPY by default (None disables the cap).
+        timeout: A float describing seconds waiting for a free slot, None waits forever.
+        limit: A int describing slots caller can take (lowest numbers), the rest are kept for callers without
+            limit, e.g. bulk backfill leaves a slot to celery imports. All slots by default.
+
+    Returns:
+        A int describing slot taken (None without cap).
+
+    Raises:
+        CopySlotUnavailable: If every slot is taken after timeout.
+    """
+    slots = getattr(settings, 'API_MAX_CONCURRENT_COPY', None) if slots is None else slots
+    if not slots:
+        yield None
+        return
+    connection = connections[using]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    slot = None
+    with connection.cursor() as cursor:
+        while slot is None:
+            for number in range(min(slots, limit or slots)):
+                cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [COPY_SLOT_LOCK_NAMESPACE, number])
+                if cursor.fetchone()[0]:
+                    slot = number
+                    break
+            else:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise CopySlotUnavailable('Every one of {slots} COPY slots is taken.'.format(
+                        slots=min(slots, limit or slots),
+                    ))
+                time.sleep(COPY_SLOT_POLL_INTERVAL)
+    try:
+        yield slot
+    finally:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [COPY_SLOT_LOCK_NAMESPACE, slot])
+        except DatabaseError:
+            # Session is broken, lock is released with it
+            connection.close()
+
+
+def lock_source(source, using='default'):
+    """
+    Util to serialize loads of a same source file (its revisions) until actual transaction ends, it must be
+    called inside a transaction.
+    Args:
+        source: A str describing source file path, nothing is locked if it is empty.
+        using: A str describing database alias.
+    """
+    if not source:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', [SOURCE_LOCK_NAMESPACE, source])
+
+
+def copy_from_stream(model, stream, columns, using='default', table=None):
+    """
+    Util to COPY a csv stream (with header row) into a model table.
+    Args:
+        model: A django Model class.
+        stream: A binary file object giving csv data.
+        columns: A list of str describing model field names on csv column order.
+        using: A str describing database alias.
+        table: A str describing table to load, model table by default (e.g. a staging table).
+
+    Returns:
+        A int describing rows inserted.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    field_columns = [model._meta.get_field(name).column for name in columns]
+    sql = 'COPY {table} ({columns}) FROM STDIN WITH CSV HEADER'.format(
+        table=quote_name(table or model._meta.db_table),
+        columns=', '.join(quote_name(column) for column in field_columns),
+    )
+    with connection.cursor() as cursor:
+        try:
+            cursor.copy_expert(sql, stream)
+        except Exception:
+            if getattr(stream, 'error', None) is not None:
+                raise stream.error
+            raise
+        return cursor.rowcount
+
+
+class StagingTable:
+    """
+    Context manager creating an unlogged table with model columns to COPY data before touching
+    model table, table is dropped on exit.
+    """
+
+    def __init__(self, model, columns, using='default'):
+        """
+        Args:
+            model: A django Model class.
+            columns: A list of str describing model field names staged.
+            using: A str describing database alias.
+        """
+        self.model = model
+        self.columns = columns
+        self.using = using
+        self.connection = connections[using]
+        self.name = '{table}_stage_{suffix}'.format(table=model._meta.db_table, suffix=uuid.uuid4().hex[:12])
+
+    @property
+    def quoted_columns(self):
+        quote_name = self.connection.ops.quote_name
+        return ', '.join(quote_name(self.model._meta.get_field(name).column) for name in self.columns)
+
+    def __enter__(self):
+        quote_name = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE UNLOGGED TABLE {stage} AS SELECT {columns} FROM {table} WITH NO DATA'.format(
+                stage=quote_name(self.name),
+                columns=self.quoted_columns,
+                table=quote_name(self.model._meta.db_table),
+            ))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.connection.in_atomic_block:
+            # Transaction is broken, its rollback already discard staging table
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {stage}'.format(stage=self.connection.ops.quote_name(self.name)))
+
+    def load(self, stream):
+        """
+        Method to COPY csv stream on staging table.
+        Args:
+            stream: A binary file object giving csv data with columns on staging order.
+
+        Returns:
+            A int describing rows staged.
+        """
+        return copy_from_stream(
+            model=self.model,
+            stream=stream,
+            columns=self.columns,
+            using=self.using,
+            table=self.name,
+        )
+
+
+def swap_staged_rows(stage, data_file_ids):
+    """
+    Util to replace rows of DataFiles with rows of a loaded staging table on a single transaction.
+    Args:
+        stage: A StagingTable object already loaded, its model must have data_file_id field.
+        data_file_ids: A list of int describing DataFile ids whose rows are replaced.
+
+    Returns:
+        A tuple (rows inserted, rows deleted).
+    """
+    quote_name = stage.connection.ops.quote_name
+    table = quote_name(stage.model._meta.db_table)
+    with transaction.atomic(using=stage.using), stage.connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {table} WHERE {data_file_id} = ANY(%s)'.format(
+                table=table,
+                data_file_id=quote_name(stage.model._meta.get_field('data_file_id').column),
+            ),
+            [list(data_file_ids)],
+        )
+        deleted = cursor.rowcount
+        cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage}'.format(
+            table=table,
+            columns=stage.quoted_columns,
+            stage=quote_name(stage.name),
+        ))
+        inserted = cursor.rowcount
+    return inserted, deleted
+
+
+def replace_data_file_rows(model, stream, columns, data_file_ids, using='default'):
+    """
+    Util to load a DataFile replacing rows previously imported from it. Data is staged first and swapped
+    on a single transaction, so re-imports do not duplicate rows and readers never see a half loaded file.
+    Args:
+        model: A django Model class with data_file_id field.
+        stream: A binary file object giving csv data.
+        columns: A list of str describing model field names on csv column order.
+        data_file_ids: A list of int describing DataFile ids whose rows are replaced.
+        using: A str describing database alias.
+
+    Returns:
+        A tuple (rows inserted, rows deleted).
+    """
+    with StagingTable(model=model, columns=columns, using=using) as stage:
+        stage.load(stream)
+        return swap_staged_rows(stage=stage, data_file_ids=data_file_ids)
+
+
+def apply_data_file_delta(model, stream, columns, data_file_id, previous_ids, key_fields, using='default'):
+    """
+    Util to load a new version of a file applying only row differences against rows of its previous
+    versions, rows are matched by key_fields. If keys are not unique on any side rows are fully replaced.
+    Everything is applied on a single transaction after staging new rows.
+    Args:
+        model: A django Model class with data_file_id field.
+        stream: A binary file object giving csv data, data_file_id column must be included.
+        columns: A list of str describing model field names on csv column order.
+        data_file_id: A int describing DataFile id of new version.
+        previous_ids: A list of int describing DataFile ids of previous versions.
+        key_fields: A list of str describing text fields identifying a row inside a file.
+        using: A str describing database alias.
+
+    Returns:
+        A dict with mode ('delta' or 'replace') and inserted, updated, deleted and unchanged totals.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+
+    def column_of(name):
+        return quote_name(model._meta.get_field(name).column)
+
+    data_file_ids = sorted(set(previous_ids) | {data_file_id})
+    # Null and empty keys are the same location, plain equality keeps hash joins available
+    sql_params = {
+        'table': quote_name(model._meta.db_table),
+        'data_file_id': column_of('data_file_id'),
+        'key_match': ' AND '.join(
+            "COALESCE(target.{column}, '') = COALESCE(stage.{column}, '')".format(column=column_of(name))
+            for name in key_fields
+        ),
+        'keys': ', '.join("COALESCE({column}, '')".format(column=column_of(name)) for name in key_fields),
+    }
+    compared = [name for name in columns if name != 'data_file_id']
+
+    with StagingTable(model=model, columns=columns, using=using) as stage:
+        staged = stage.load(stream)
+        sql_params.update({
+            'stage': quote_name(stage.name),
+            'columns': stage.quoted_columns,
+        })
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*) FROM {table} WHERE {data_file_id} = ANY(%s)'.format(**sql_params),
+                [data_file_ids],
+            )
+            previous_rows = cursor.fetchone()[0]
+            cursor.execute(
+                'SELECT 1 FROM {stage} GROUP BY {keys} HAVING COUNT(*) > 1 LIMIT 1'.format(**sql_params)
+            )
+            duplicated_keys = cursor.fetchone() is not None
+            if not duplicated_keys and previous_rows:
+                cursor.execute(
+                    'SELECT 1 FROM {table} WHERE {data_file_id} = ANY(%s) '
+                    'GROUP BY {keys} HAVING COUNT(*) > 1 LIMIT 1'.format(**sql_params),
+                    [data_file_ids],
+                )
+                duplicated_keys = cursor.fetchone() is not None
+
+            if duplicated_keys or not previous_rows:
+                inserted, deleted = swap_staged_rows(stage=stage, data_file_ids=data_file_ids)
+                return {
+                    'mode': 'replace',
+                    'inserted': inserted,
+                    'updated': 0,
+                    'deleted': deleted,
+                    'unchanged': 0,
+                }
+
+            cursor.execute(
+                'DELETE FROM {table} AS target WHERE target.{data_file_id} = ANY(%s) '
+                'AND NOT EXISTS (SELECT 1 FROM {stage} AS stage WHERE {key_match})'.format(**sql_params),
+                [data_file_ids],
+            )
+            deleted = cursor.rowcount
+            cursor.execute(
+                'UPDATE {table} AS target SET {assignments} FROM {stage} AS stage '
+                'WHERE target.{data_file_id} = ANY(%s) AND {key_match} '
+                'AND ({target_values}) IS DISTINCT FROM ({stage_values})'.format(
+                    assignments=', '.join(
+                        '{column} = stage.{column}'.format(column=column_of(name)) for name in columns
+                    ),
+                    target_values=', '.join('target.{0}'.format(column_of(name)) for name in compared),
+                    stage_values=', '.join('stage.{0}'.format(column_of(name)) for name in compared),
+                    **sql_params
+                ),
+                [data_file_ids],
+            )
+            updated = cursor.rowcount
+            cursor.execute(
+                'INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} AS stage '
+                'WHERE NOT EXISTS (SELECT 1 FROM {table} AS target '
+                'WHERE target.{data_file_id} = ANY(%s) AND {key_match})'.format(**sql_params),
+                [data_file_ids],
+            )
+            inserted = cursor.rowcount
+    return {
+        'mode': 'delta',
+        'inserted': inserted,
+        'updated': updated,
+        'deleted': deleted,
+        'unchanged': staged - inserted - updated,
+    }
@@ -0,0 +1,311 @@
+""" Module to drive http traffic against a running api server and summarize latency by endpoint """
+import os
+import sys
+import math
+import time
+import random
+import shutil
+import socket
+import threading
+import tempfile
+import subprocess
+
+import requests
+
+from api.exceptions import LoadTestServerError
+
+
+# Relative weight of every endpoint on each traffic profile
+TRAFFIC_PROFILES = {
+    'mixed': {'list': 4, 'today': 3, 'last': 3, 'csv': 1, 'data_file': 1},
+    'polling': {'today': 5, 'last': 5},
+    'browse': {'list': 8, 'last': 2},
+    'export': {'csv': 1, 'data_file': 1},
+    'dashboard': {'timeseries': 4, 'summary': 3, 'last': 3},
+}
+PERCENTILES = (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def percentile(values, fraction):
+    """
+    Util to get a nearest rank percentile.
+    Args:
+        values: A sorted list of float.
+        fraction: A float between 0 and 1, e.g. 0.95.
+
+    Returns:
+        A float or None if there are not values.
+    """
+    if not values:
+        return None
+    index = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class LoadResult:
+    """ Thread safe record of request latencies and errors by endpoint """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = {}
+
+    def record(self, endpoint, seconds, error=False, size=0):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + int(error)
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+
+    def summary(self, duration):
+        """
+        Method to summarize recorded requests.
+        Args:
+            duration: A float describing seconds measured.
+
+        Returns:
+            A dict describing endpoint = {requests, errors, error_rate, rps, bytes, p50, p95, p99}, every endpoint
+            together is under 'total' key.
+        """
+        with self.lock:
+            groups = {endpoint: list(latencies) for endpoint, latencies in self.latencies.items()}
+            errors = dict(self.errors)
+            sizes = dict(self.bytes)
+        groups['total'] = [seconds for latencies in groups.values() for seconds in latencies]
+        errors['total'] = sum(errors.values())
+        sizes['total'] = sum(sizes.values())
+        summary = {}
+        for endpoint, latencies in groups.items():
+            latencies.sort()
+            requests_ = len(latencies)
+            summary[endpoint] = {
+                'requests': requests_,
+                'errors': errors[endpoint],
+                'error_rate': errors[endpoint] / requests_ if requests_ else 0.0,
+                'rps': requests_ / duration if duration else 0.0,
+                'bytes': sizes[endpoint],
+            }
+            for name, fraction in PERCENTILES:
+                summary[endpoint][name] = percentile(latencies, fraction)
+        return summary
+
+
+def check_thresholds(summary, thresholds):
+    """
+    Util to compare a run summary with thresholds.
+    Args:
+        summary: A dict describing LoadResult.summary output.
+        thresholds: A dict describing endpoint = {metric: max value}, e.g. {'today': {'p95': 0.2}}, metrics are
+            p50, p95, p99 (seconds) and error_rate, '*' applies to every endpoint not listed.
+
+    Returns:
+        A list of str describing thresholds exceeded.
+    """
+    violations = []
+    for endpoint in sorted(summary):
+        limits = dict(thresholds.get('*', {}) if endpoint != 'total' else {}, **thresholds.get(endpoint, {}))
+        for metric, limit in sorted(limits.items()):
+            value = summary[endpoint].get(metric)
+            if value is not None and value > limit:
+                violations.append('{endpoint} {metric} {value:.4f} > {limit}'.format(
+                    endpoint=endpoint,
+                    metric=metric,
+                    value=value,
+                    limit=limit,
+                ))
+    return violations
+
+
+def parse_threshold(value):
+    """
+    Util to parse a threshold option.
+    Args:
+        value: A str formatted as endpoint.metric=limit, e.g. today.p95=0.2.
+
+    Returns:
+        A tuple (endpoint, metric, float limit).
+    """
+    try:
+        key, limit = value.split('=', 1)
+        endpoint, metric = key.split('.', 1)
+        return endpoint, metric, float(limit)
+    except ValueError:
+        raise ValueError('Threshold must be endpoint.metric=limit, e.g. today.p95=0.2')
+
+
+def _drive(session, base_url, urls, endpoints, weights, deadline, warmup_until, result, timeout, randomizer):
+    """ Inner loop of a virtual client sending requests until deadline """
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        endpoint = randomizer.choices(endpoints, weights=weights)[0]
+        size = 0
+        error = False
+        started = time.perf_counter()
+        try:
+            with session.get(base_url + urls[endpoint], timeout=timeout, stream=True) as response:
+                # Time is measured until last byte, streamed csv and files included
+                for chunk in response.iter_content(READ_CHUNK_SIZE):
+                    size += len(chunk)
+                error = response.status_code >= 400
+        except requests.RequestException:
+            error = True
+        if started >= warmup_until:
+            result.record(endpoint, time.perf_counter() - started, error=error, size=size)
+
+
+def run_load(base_url, urls, weights, concurrency=10, duration=30.0, warmup=0.0, timeout=60, seed=0):
+    """
+    Util to send weighted random requests from concurrent clients with keep-alive connections.
+    Args:
+        base_url: A str describing server url, e.g. http://127.0.0.1:8000.
+        urls: A dict describing endpoint = path with query string.
+        weights: A dict describing endpoint = relative weight, endpoints without url are skipped.
+        concurrency: A int describing simultaneous clients.
+        duration: A float describing seconds measured.
+        warmup: A float describing seconds of requests sent before measuring.
+        timeout: A float describing seconds to wait a response.
+        seed: A int describing random seed of endpoint choices.
+
+    Returns:
+        A dict describing LoadResult.summary output.
+    """
+    endpoints = sorted(endpoint for endpoint in weights if endpoint in urls)
+    if not endpoints:
+        raise ValueError('There are not urls for endpoints of traffic profile.')
+    endpoint_weights = [weights[endpoint] for endpoint in endpoints]
+    result = LoadResult()
+    warmup_until = time.perf_counter() + warmup
+    deadline = warmup_until + duration
+    sessions = [requests.Session() for _ in range(concurrency)]
+    threads = [
+        threading.Thread(
+            target=_drive,
+            args=(
+                session, base_url.rstrip('/'), urls, endpoints, endpoint_weights, deadline, warmup_until, result,
+                timeout, random.Random('{0}-{1}'.format(seed, index)),
+            ),
+            daemon=True,
+        ) for index, session in enumerate(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in sessions:
+        session.close()
+    return result.summary(duration)
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_server_command(server, directory, port, processes, threads):
+    """
+    Util to build command line starting project under a production server.
+    Args:
+        server: A str describing server, uwsgi (covid_19.wsgi) or uvicorn (covid_19.asgi).
+        directory: A str describing project directory.
+        port: A int describing port on 127.0.0.1.
+        processes: A int describing worker processes.
+        threads: A int describing threads by process (uwsgi only).
+
+    Returns:
+        A list of str describing command arguments.
+    """
+    if server == 'uwsgi':
+        return [
+            'uwsgi',
+            '--http', '127.0.0.1:{port}'.format(port=port),
+            '--module', 'covid_19.wsgi:application',
+            '--chdir', directory,
+            '--master',
+            '--processes', str(processes),
+            '--threads', str(threads),
+            '--die-on-term',
+            '--disable-logging',
+        ]
+    if server == 'uvicorn':
+        return [
+            sys.executable, '-m', 'uvicorn', 'covid_19.asgi:application',
+            '--app-dir', directory,
+            '--host', '127.0.0.1',
+            '--port', str(port),
+            '--workers', str(processes),
+            '--no-access-log',
+            '--log-level', 'warning',
+        ]
+    raise ValueError('Unknown server {server}'.format(server=server))
+
+
+class ServerProcess:
+    """ Context manager running api under a server subprocess until it is exited """
+
+    def __init__(self, server, directory, processes=4, threads=1, environment=None, ready_path='/api/v1/',
+                 ready_timeout=60):
+        self.server = server
+        self.directory = directory
+        self.processes = processes
+        self.threads = threads
+        self.environment = environment or {}
+        self.ready_path = ready_path
+        self.ready_timeout = ready_timeout
+        self.port = get_free_port()
+        self.process = None
+        self.log = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{port}'.format(port=self.port)
+
+    def __enter__(self):
+        command = get_server_command(self.server, self.directory, self.port, self.processes, self.threads)
+        if self.server == 'uwsgi' and not shutil.which(command[0]):
+            raise LoadTestServerError('uwsgi executable was not found, install production requirements.')
+        # Server output goes to a file, a pipe not read would block it once full
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command,
+            cwd=self.directory,
+            env=dict(os.environ, **self.environment),
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                output = self.log.read().decode('utf-8', 'replace')[-2000:]
+                self.log.close()
+                raise LoadTestServerError('{server} exited with code {code}: {output}'.format(
+                    server=self.server,
+                    code=self.process.returncode,
+                    output=output,
+                ))
+            try:
+                requests.get(self.base_url + self.ready_path, timeout=1)
+            except requests.RequestException:
+                time.sleep(0.2)
+            else:
+                return self
+        self.__exit__(None, None, None)
+        raise LoadTestServerError('{server} was not ready after {seconds}s'.format(
+            server=self.server,
+            seconds=self.ready_timeout,
+        ))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not None:
+            self.log.close()
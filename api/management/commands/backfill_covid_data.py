@@ -0,0 +1,349 @@
+""" Command to import a local copy of jh university daily reports without celery """
+import os
+import time
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import File
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import connections
+from django.db import transaction
+from django.db import DataError
+from django.db import IntegrityError
+
+from api.cache import bump_dataset_version
+from api.exceptions import AlreadyProcessedFile
+from api.exceptions import HeaderNotIdentifier
+from api.exceptions import DateFormatNotIdentifier
+from api.exceptions import NewerVersionProcessed
+from api.header_registry import remember_date_format
+from api.loader import copy_slot
+from api.loader import get_backfill_copy_slots
+from api.mirror import get_mirror
+from api.models import DataFile
+from api.models import LatestReport
+from api.models import CountryDailySummary
+from api.tasks import NEWER_VERSION_DETAIL
+from api.tasks import build_import_stats
+from api.tasks import describe_delta
+from api.tasks import get_report_day
+from api.tasks import load_revision
+from api.utils import StageTimer
+from api.utils import JHCsvNormalizer
+from api.utils import clean_jh_csv_file
+from api.utils import hash_local_file
+
+
+def normalize_to_file(source, field_mapping, delimiter, date_format, static_columns, chunk_size=None):
+    """
+    Util run on worker processes writing a file normalized on a temporary csv ready to COPY.
+    Args:
+        source: A str describing local path of original file.
+        field_mapping: A dict describing csv column = GeneralData field.
+        delimiter: A str describing csv delimiter.
+        date_format: A str describing last_update format.
+        static_columns: A dict describing field = value added to every row.
+        chunk_size: A int describing rows normalized by chunk.
+
+    Returns:
+        A tuple (temporary file path, rows normalized, date format used, seconds by stage).
+    """
+    normalizer = JHCsvNormalizer(
+        source=source,
+        field_mapping=field_mapping,
+        delimiter=delimiter,
+        date_format=date_format,
+        chunk_size=chunk_size,
+    )
+    descriptor, path = tempfile.mkstemp(prefix='backfill_', suffix='.csv')
+    try:
+        with os.fdopen(descriptor, 'wb') as file_:
+            for chunk in normalizer.iter_csv(static_columns=static_columns):
+                file_.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, normalizer.rows, normalizer.date_format, normalizer.timer.timings
+
+
+class Stage:
+    """ Counter of files and rows done by a pipeline stage since it started """
+
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.rows = 0
+        self.started = time.monotonic()
+        self.finished = self.started
+
+    def done(self, rows=0):
+        self.files += 1
+        self.rows += rows
+        self.finished = time.monotonic()
+
+    def __str__(self):
+        seconds = max(self.finished - self.started, 1e-6)
+        return '{name}: {files} files, {rows} rows in {seconds:.2f}s ({fps:.2f} files/s, {rps:.0f} rows/s)'.format(
+            name=self.name,
+            files=self.files,
+            rows=self.rows,
+            seconds=seconds,
+            fps=self.files / seconds,
+            rps=self.rows / seconds,
+        )
+
+
+class Command(BaseCommand):
+    help = 'Import a local directory of jh university daily reports normalizing files on parallel processes ' \
+           'and loading them through parallel COPY connections, DataFile bookkeeping is the same of celery tasks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help='Directory with csv files, paths relative to it are kept as source path (use a repo clone root).',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Processes normalizing files.',
+        )
+        parser.add_argument(
+            '--db-workers',
+            type=int,
+            default=getattr(settings, 'API_BACKFILL_DB_WORKERS', 4),
+            help='Simultaneous COPY connections, capped to COPY slots backfill can take (API_BACKFILL_COPY_SLOTS).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Csv rows normalized by chunk.',
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError('{directory} is not a directory.'.format(directory=directory))
+
+        register_stage = Stage('register')
+        jobs = []
+        for path in self.find_csv_files(directory):
+            data_file = self.register_file(path=path, source_path=os.path.relpath(path, directory))
+            register_stage.done()
+            if data_file is None:
+                continue
+            job = self.prepare_job(data_file=data_file, path=path, chunk_size=options['chunk_size'])
+            if job is not None:
+                jobs.append(job)
+        self.stdout.write(str(register_stage))
+        if not jobs:
+            self.stdout.write('Nothing to import.')
+            return
+
+        db_workers = options['db_workers']
+        copy_slots = get_backfill_copy_slots()
+        if copy_slots is not None and db_workers > copy_slots:
+            # Loader threads over slot budget would only wait a free slot
+            self.stdout.write('--db-workers {workers} capped to {slots} COPY slots available to backfill.'.format(
+                workers=db_workers,
+                slots=copy_slots,
+            ))
+            db_workers = copy_slots
+        # Forked workers must not share parent connections
+        connections.close_all()
+        normalize_stage = Stage('normalize')
+        load_stage = Stage('load')
+        report_days = set()
+        changed = False
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as processes, \
+                ThreadPoolExecutor(max_workers=db_workers) as threads:
+            normalizing = {
+                processes.submit(normalize_to_file, **job['normalize']): job for job in jobs
+            }
+            loading = []
+            for future in as_completed(normalizing):
+                job = normalizing[future]
+                try:
+                    path, rows, date_format, timings = future.result()
+                except (DateFormatNotIdentifier, ValueError) as err:
+                    self.fail(
+                        data_file=job['data_file'],
+                        detail='Some Date column format was not identify, details: {error}.'.format(error=err),
+                    )
+                    continue
+                normalize_stage.done(rows=rows)
+                job['timings'].update(timings)
+                job['rows'] = rows
+                loading.append(threads.submit(self.load_file, job=job, path=path, date_format=date_format))
+
+            for future in as_completed(loading):
+                job, rows, changes = future.result()
+                if rows is None:
+                    continue
+                load_stage.done(rows=rows)
+                if changes:
+                    changed = True
+                    if job['report_day']:
+                        report_days.add(job['report_day'])
+
+        self.stdout.write(str(normalize_stage))
+        self.stdout.write(str(load_stage))
+        if report_days:
+            CountryDailySummary.objects.refresh_days(sorted(report_days))
+        if changed:
+            transaction.on_commit(bump_dataset_version)
+        self.stdout.write(self.style.SUCCESS('Imported {done} of {total} files.'.format(
+            done=load_stage.files,
+            total=len(jobs),
+        )))
+
+    @staticmethod
+    def find_csv_files(directory):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if name.split('.')[-1] == 'csv':
+                    yield os.path.join(root, name)
+
+    @staticmethod
+    def register_file(path, source_path):
+        """
+        Method to get DataFile of a local file (signature is git blob sha as github one), storing it if it is new.
+        Args:
+            path: A str describing local file path.
+            source_path: A str describing file path on upstream repo.
+
+        Returns:
+            A DataFile object or None if file was already imported.
+        """
+        signature, md5_checksum = hash_local_file(path)
+        mirror = get_mirror()
+        if mirror:
+            mirror.put_file(signature, path)
+        try:
+            data_file = DataFile.objects.get(signature=signature)
+        except DataFile.DoesNotExist:
+            data_file = DataFile(
+                signature=signature,
+                source_path=source_path,
+                md5_checksum=md5_checksum,
+                process_id='backfill',
+            )
+            with open(path, 'rb') as file_:
+                data_file.origin_file.save(os.path.basename(path), File(file_), save=False)
+            try:
+                data_file.save()
+            except AlreadyProcessedFile:
+                data_file.origin_file.delete(save=False)
+                return None
+            return data_file
+        return None if data_file.processed else data_file
+
+    def prepare_job(self, data_file, path, chunk_size=None):
+        """
+        Method to identify header and date format of a DataFile as file_data_importer does.
+        Returns:
+            A dict describing job or None if file can not be imported.
+        """
+        if data_file.has_newer_version():
+            self.fail(data_file, NEWER_VERSION_DETAIL.format(source_path=data_file.source_path))
+            return None
+        timer = StageTimer()
+        try:
+            with timer.stage('header'):
+                normalizer = clean_jh_csv_file(data_file_id=data_file.id)
+        except HeaderNotIdentifier as err:
+            self.fail(data_file, 'Some column was not map with field, details: {error}.'.format(error=err))
+            return None
+        except DateFormatNotIdentifier as err:
+            self.fail(data_file, 'Some Date column format was not identify, details: {error}.'.format(error=err))
+            return None
+        data_file.header = normalizer.field_mapping
+        data_file.save(update_fields=['header'])
+        report_day = get_report_day(file_name=path)
+        static_columns = {
+            'report_day': report_day,
+            'data_file_id': data_file.id,
+        }
+        return {
+            'data_file': data_file,
+            'report_day': report_day,
+            'layout': normalizer.layout,
+            'timings': {
+                'header': max(timer.get('header') - normalizer.timer.get('date_detection'), 0.0),
+                'date_detection': normalizer.timer.get('date_detection'),
+            },
+            'columns': normalizer.columns + list(static_columns.keys()),
+            'normalize': {
+                'source': path,
+                'field_mapping': normalizer.field_mapping,
+                'delimiter': normalizer.delimiter,
+                'date_format': normalizer.date_format,
+                'static_columns': static_columns,
+                'chunk_size': chunk_size,
+            },
+        }
+
+    def load_file(self, job, path, date_format):
+        """
+        Method run on loader threads to COPY a normalized file and close DataFile as file_data_importer does.
+        Returns:
+            A tuple (job, rows loaded, rows changed), rows are None if load failed.
+        """
+        try:
+            return self.apply_file(job=job, path=path, date_format=date_format)
+        finally:
+            os.remove(path)
+            # Every loader thread has its own connection
+            connection.close()
+
+    def apply_file(self, job, path, date_format):
+        data_file = job['data_file']
+        process_detail = '[DETAILS]'
+        if not job['report_day']:
+            process_detail += '\nFilename date was not parsed.'
+        timer = StageTimer()
+        try:
+            with ExitStack() as stack:
+                # Backfill waits its turn on COPY slots shared with celery imports
+                with timer.stage('copy_slot_wait'):
+                    stack.enter_context(copy_slot(timeout=None, limit=get_backfill_copy_slots()))
+                with timer.stage('copy'), open(path, 'rb') as stream:
+                    delta, previous_ids = load_revision(data_file=data_file, stream=stream, columns=job['columns'])
+        except NewerVersionProcessed as err:
+            self.fail(data_file, process_detail + '\n{error}'.format(error=err))
+            return job, None, None
+        except (IntegrityError, DataError) as err:
+            self.fail(data_file, process_detail + '\nError doing bulk_insert, details\n: {details}.'.format(
+                details=err,
+            ))
+            return job, None, None
+        data_file.processed = True
+        data_file.process_detail = process_detail + describe_delta(delta=delta, previous_ids=previous_ids)
+        data_file.process_stats = dict(data_file.process_stats or {}, **{
+            'import': build_import_stats(
+                stages=dict(job['timings'], **timer.timings),
+                rows=job['rows'],
+                load_seconds=timer.get('copy'),
+                delta=delta,
+            ),
+        })
+        data_file.save(update_fields=['processed', 'process_detail', 'process_stats'])
+        remember_date_format(layout=job['layout'], date_format=date_format)
+        LatestReport.register_data_file(data_file_id=data_file.id, recompute=bool(delta['updated'] or delta['deleted']))
+        loaded = delta['inserted'] + delta['updated'] + delta['unchanged']
+        return job, loaded, delta['inserted'] + delta['updated'] + delta['deleted']
+
+    def fail(self, data_file, detail):
+        data_file.processed = False
+        data_file.process_detail = detail
+        data_file.save(update_fields=['processed', 'process_detail'])
+        self.stderr.write('{name}: {detail}'.format(name=data_file, detail=detail))
@@ -0,0 +1,45 @@
+""" Command to write synthetic jh university daily reports """
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.synthetic import HEADER_LAYOUTS
+from api.synthetic import write_dataset
+
+
+class Command(BaseCommand):
+    help = 'Write synthetic daily reports with upstream repo paths rotating every historical header and date ' \
+           'layout, output can be imported with backfill_covid_data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Root directory of generated files.')
+        parser.add_argument('--days', type=int, default=30, help='Daily reports written.')
+        parser.add_argument('--rows', type=int, default=1000, help='Rows by daily report.')
+        parser.add_argument(
+            '--start-day',
+            type=datetime.date.fromisoformat,
+            default=None,
+            help='First report day (YYYY-MM-DD), 2020-01-22 by default.',
+        )
+        parser.add_argument(
+            '--layout',
+            action='append',
+            choices=sorted(HEADER_LAYOUTS.keys()),
+            help='Layout to use, can be repeated (all by default).',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, same options give same files.')
+
+    def handle(self, *args, **options):
+        paths = write_dataset(
+            directory=options['directory'],
+            days=options['days'],
+            rows=options['rows'],
+            start_day=options['start_day'],
+            layouts=options['layout'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS('{files} files with {rows} rows written on {directory}.'.format(
+            files=len(paths),
+            rows=len(paths) * options['rows'],
+            directory=options['directory'],
+        )))
@@ -0,0 +1,257 @@
+""" Command to load test read endpoints under a production server over a seeded database """
+import os
+import json
+import shutil
+import datetime
+import tempfile
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from api.exceptions import LoadTestServerError
+from api.loadtest import TRAFFIC_PROFILES
+from api.loadtest import ServerProcess
+from api.loadtest import run_load
+from api.loadtest import check_thresholds
+from api.loadtest import parse_threshold
+from api.models import DataFile
+from api.models import GeneralData
+from api.synthetic import write_dataset
+
+
+# Server name = (server process, extra environment), uvicorn-async serves read endpoints with async views
+SERVERS = {
+    'uwsgi': ('uwsgi', {}),
+    'uvicorn': ('uvicorn', {}),
+    'uvicorn-async': ('uvicorn', {'LOADTEST_ASYNC_VIEWS': '1'}),
+}
+
+
+def format_seconds(value):
+    return '-' if value is None else '{0:.1f}'.format(value * 1000)
+
+
+class Command(BaseCommand):
+    help = 'Seed a test database with synthetic daily reports, serve it with uwsgi (wsgi), uvicorn (asgi) or ' \
+           'uvicorn with async read views and drive traffic profiles reporting latency percentiles, throughput ' \
+           'and error rate by endpoint. Fails if API_LOADTEST_THRESHOLDS (or --threshold) are exceeded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server',
+            action='append',
+            choices=sorted(SERVERS.keys()),
+            help='Server running the project, can be repeated to compare them on same data (uwsgi by default).',
+        )
+        parser.add_argument(
+            '--url',
+            default=None,
+            help='Base url of a running server, database is not seeded and no server is started.',
+        )
+        parser.add_argument(
+            '--profile',
+            action='append',
+            choices=sorted(TRAFFIC_PROFILES.keys()),
+            help='Traffic profile run, can be repeated (mixed by default).',
+        )
+        parser.add_argument('--concurrency', type=int, default=20, help='Simultaneous clients.')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds measured by profile.')
+        parser.add_argument('--warmup', type=float, default=5.0, help='Seconds of not measured requests.')
+        parser.add_argument('--processes', type=int, default=4, help='Server worker processes.')
+        parser.add_argument('--threads', type=int, default=2, help='Threads by uwsgi process.')
+        parser.add_argument('--seed-days', type=int, default=14, help='Daily reports seeded, last one is today.')
+        parser.add_argument('--seed-rows', type=int, default=5000, help='Rows by seeded daily report.')
+        parser.add_argument('--page-size', type=int, default=500, help='page_size of list requests.')
+        parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) seeded test database.')
+        parser.add_argument(
+            '--threshold',
+            action='append',
+            default=[],
+            help='Max value as endpoint.metric=limit (metric p50, p95, p99 or error_rate), e.g. today.p95=0.2, '
+                 'overrides API_LOADTEST_THRESHOLDS.',
+        )
+        parser.add_argument('--json-output', default=None, help='File where results are written as json.')
+
+    def get_thresholds(self, options):
+        thresholds = {
+            endpoint: dict(limits)
+            for endpoint, limits in getattr(settings, 'API_LOADTEST_THRESHOLDS', {}).items()
+        }
+        for value in options['threshold']:
+            try:
+                endpoint, metric, limit = parse_threshold(value)
+            except ValueError as e:
+                raise CommandError(str(e))
+            thresholds.setdefault(endpoint, {})[metric] = limit
+        return thresholds
+
+    def seed(self, days, rows, media_root):
+        """ Method to import synthetic daily reports on actual database if it is empty """
+        if GeneralData.objects.exists():
+            self.stdout.write('Database already seeded.')
+            return
+        directory = tempfile.mkdtemp(prefix='covid_loadtest_')
+        try:
+            write_dataset(
+                directory=directory,
+                days=days,
+                rows=rows,
+                start_day=timezone.localdate() - datetime.timedelta(days=days - 1),
+            )
+            with override_settings(MEDIA_ROOT=media_root, API_MIRROR_ROOT=None):
+                call_command('backfill_covid_data', directory, stdout=self.stdout, stderr=self.stderr)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def get_urls(self, page_size):
+        urls = {
+            'list': '{path}?page_size={size}'.format(path=reverse('api:generaldata-list'), size=page_size),
+            'today': reverse('api:generaldata-today'),
+            'last': reverse('api:generaldata-last'),
+            'csv': reverse('api:generaldata-csv'),
+        }
+        data_file_id = DataFile.objects.filter(processed=True).values_list('id', flat=True).order_by('id').first()
+        if data_file_id:
+            urls['data_file'] = reverse('api:data_file_download', kwargs={'data_file_id': data_file_id})
+        urls['summary'] = '{path}?page_size={size}'.format(
+            path=reverse('api:countrydailysummary-list'),
+            size=page_size,
+        )
+        country_region = GeneralData.objects.values_list('country_region', flat=True).order_by('id').first()
+        if country_region:
+            urls['timeseries'] = '{path}?{query}'.format(
+                path=reverse('api:generaldata-timeseries'),
+                query=urlencode({'country_region': country_region}),
+            )
+        return urls
+
+    def run_profiles(self, base_url, urls, options):
+        results = {}
+        for profile in options['profile'] or ['mixed']:
+            self.stdout.write('Running {profile} profile on {url} ({clients} clients, {seconds}s)'.format(
+                profile=profile,
+                url=base_url,
+                clients=options['concurrency'],
+                seconds=options['duration'],
+            ))
+            results[profile] = run_load(
+                base_url=base_url,
+                urls=urls,
+                weights=TRAFFIC_PROFILES[profile],
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                warmup=options['warmup'],
+            )
+            self.write_summary(results[profile])
+        return results
+
+    def write_summary(self, summary):
+        self.stdout.write('{0:<10} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>8}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors',
+        ))
+        for endpoint in sorted(summary, key=lambda name: (name == 'total', name)):
+            stats = summary[endpoint]
+            self.stdout.write('{0:<10} {1:>9} {2:>9.1f} {3:>9} {4:>9} {5:>9} {6:>7.2f}%'.format(
+                endpoint,
+                stats['requests'],
+                stats['rps'],
+                format_seconds(stats['p50']),
+                format_seconds(stats['p95']),
+                format_seconds(stats['p99']),
+                stats['error_rate'] * 100,
+            ))
+
+    def write_comparison(self, results):
+        """ Method to write total values of every server and profile run """
+        self.stdout.write('{0:<24} {1:>9} {2:>9} {3:>9} {4:>9} {5:>8}'.format(
+            'server/profile', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors',
+        ))
+        for target, profiles in results.items():
+            for profile, summary in profiles.items():
+                stats = summary['total']
+                self.stdout.write('{0:<24} {1:>9.1f} {2:>9} {3:>9} {4:>9} {5:>7.2f}%'.format(
+                    '{0}/{1}'.format(target, profile),
+                    stats['rps'],
+                    format_seconds(stats['p50']),
+                    format_seconds(stats['p95']),
+                    format_seconds(stats['p99']),
+                    stats['error_rate'] * 100,
+                ))
+
+    def handle(self, *args, **options):
+        thresholds = self.get_thresholds(options)
+        if options['url']:
+            results = {options['url']: self.run_profiles(options['url'], self.get_urls(options['page_size']), options)}
+        else:
+            results = self.run_local(options)
+        if len(results) > 1:
+            self.write_comparison(results)
+
+        violations = {
+            target: {profile: check_thresholds(summary, thresholds) for profile, summary in profiles.items()}
+            for target, profiles in results.items()
+        }
+        if options['json_output']:
+            with open(options['json_output'], 'w') as file_:
+                json.dump({
+                    'url': options['url'],
+                    'concurrency': options['concurrency'],
+                    'duration': options['duration'],
+                    'results': results,
+                    'violations': violations,
+                }, file_, indent=2)
+        failed = [
+            '{target}/{profile}: {violation}'.format(target=target, profile=profile, violation=violation)
+            for target, profiles in violations.items() for profile, items in profiles.items() for violation in items
+        ]
+        if failed:
+            raise CommandError('Thresholds exceeded:\n{0}'.format('\n'.join(failed)))
+        self.stdout.write(self.style.SUCCESS('Every threshold was met.'))
+
+    def run_local(self, options):
+        """ Method to seed a test database and run profiles against a server subprocess using it """
+        media_root = os.path.join(tempfile.gettempdir(), 'covid_loadtest_media')
+        old_name = connection.settings_dict['NAME']
+        test_name = connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False,
+            keepdb=options['keepdb'],
+        )
+        try:
+            self.seed(days=options['seed_days'], rows=options['seed_rows'], media_root=media_root)
+            urls = self.get_urls(options['page_size'])
+            # Server connections would block test database drop
+            connection.close()
+            results = {}
+            for name in options['server'] or ['uwsgi']:
+                process_name, environment = SERVERS[name]
+                server = ServerProcess(
+                    server=process_name,
+                    directory=settings.BASE_DIR,
+                    processes=options['processes'],
+                    threads=options['threads'],
+                    environment=dict(
+                        environment,
+                        DJANGO_SETTINGS_MODULE='covid_19.settings_loadtest',
+                        LOADTEST_DATABASE_NAME=test_name,
+                        LOADTEST_MEDIA_ROOT=media_root,
+                    ),
+                )
+                try:
+                    with server:
+                        results[name] = self.run_profiles(server.base_url, urls, options)
+                except LoadTestServerError as e:
+                    raise CommandError(str(e))
+            return results
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            if not options['keepdb']:
+                shutil.rmtree(media_root, ignore_errors=True)
@@ -0,0 +1,275 @@
+""" Module to render api metrics on prometheus text exposition format """
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from api.models import DataFile
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+IMPORT_STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DOWNLOAD_BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2)
+IMPORT_ROWS_PER_SECOND_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+REQUEST_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_QUERIES_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+RESPONSE_BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+# StageTimer of request being profiled, stages are recorded only when it is set
+REQUEST_TIMER = contextvars.ContextVar('request_timer', default=None)
+# QueryCounter of request being profiled, views running queries on other threads (async views) wrap them with it
+REQUEST_QUERY_COUNTER = contextvars.ContextVar('request_query_counter', default=None)
+
+
+class Histogram:
+    """ Prometheus like histogram, counts are cumulated when rendered """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+
+class RequestMetrics:
+    """ Thread safe registry of request histograms by view and method (values of actual process) """
+    HISTOGRAMS = {
+        'seconds': REQUEST_SECONDS_BUCKETS,
+        'queries': REQUEST_QUERIES_BUCKETS,
+        'query_seconds': REQUEST_SECONDS_BUCKETS,
+        'serializer_seconds': REQUEST_SECONDS_BUCKETS,
+        'response_bytes': RESPONSE_BYTES_BUCKETS,
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, method, **values):
+        """
+        Method to record values of a request.
+        Args:
+            view: A str describing view name.
+            method: A str describing http method.
+            **values: Values by histogram name (see HISTOGRAMS), None values are skipped.
+        """
+        with self.lock:
+            histograms = self.histograms.get((view, method))
+            if histograms is None:
+                histograms = self.histograms[(view, method)] = {
+                    name: Histogram(buckets) for name, buckets in self.HISTOGRAMS.items()
+                }
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].observe(value)
+
+    def render(self):
+        with self.lock:
+            keys = sorted(self.histograms)
+            lines = []
+            for name, help_text in (
+                ('seconds', 'Seconds answering requests.'),
+                ('queries', 'Database queries by request.'),
+                ('query_seconds', 'Seconds spent on database queries by request.'),
+                ('serializer_seconds', 'Seconds spent serializing data by request.'),
+                ('response_bytes', 'Bytes of response content (streamed responses are not measured).'),
+            ):
+                lines += render_histogram(
+                    'covid_request_{name}'.format(name=name),
+                    help_text,
+                    [({'view': view, 'method': method}, self.histograms[(view, method)][name]) for view, method in keys],
+                )
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+@contextmanager
+def request_stage(name):
+    """
+    Context manager adding seconds of a block to stage of request being profiled, it does nothing otherwise.
+    Args:
+        name: A str describing stage name.
+    """
+    timer = REQUEST_TIMER.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def format_labels(labels):
+    """
+    Util to format sample labels.
+    Args:
+        labels: A dict describing label = value.
+
+    Returns:
+        A str describing labels, e.g. {stage="copy"}.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{name}="{value}"'.format(
+            name=name,
+            value=str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+        ) for name, value in labels.items()
+    ) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metric(name, metric_type, help_text, samples):
+    """
+    Util to render a counter or gauge metric.
+    Args:
+        name: A str describing metric name.
+        metric_type: A str describing metric type (counter or gauge).
+        help_text: A str describing metric.
+        samples: A list of tuples (labels dict, value).
+
+    Returns:
+        A list of str describing lines.
+    """
+    lines = [
+        '# HELP {name} {help}'.format(name=name, help=help_text),
+        '# TYPE {name} {type}'.format(name=name, type=metric_type),
+    ]
+    for labels, value in samples:
+        lines.append('{name}{labels} {value}'.format(name=name, labels=format_labels(labels), value=format_value(value)))
+    return lines
+
+
+def render_histogram(name, help_text, histograms):
+    """
+    Util to render a histogram metric.
+    Args:
+        name: A str describing metric name.
+        help_text: A str describing metric.
+        histograms: A list of tuples (labels dict, Histogram object).
+
+    Returns:
+        A list of str describing lines.
+    """
+    lines = [
+        '# HELP {name} {help}'.format(name=name, help=help_text),
+        '# TYPE {name} histogram'.format(name=name),
+    ]
+    for labels, histogram in histograms:
+        cumulative = 0
+        for bucket, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append('{name}_bucket{labels} {value}'.format(
+                name=name,
+                labels=format_labels(dict(labels, le=format_value(float(bucket)))),
+                value=cumulative,
+            ))
+        lines.append('{name}_bucket{labels} {value}'.format(
+            name=name,
+            labels=format_labels(dict(labels, le='+Inf')),
+            value=histogram.count,
+        ))
+        lines.append('{name}_sum{labels} {value}'.format(
+            name=name,
+            labels=format_labels(labels),
+            value=format_value(histogram.sum),
+        ))
+        lines.append('{name}_count{labels} {value}'.format(
+            name=name,
+            labels=format_labels(labels),
+            value=histogram.count,
+        ))
+    return lines
+
+
+def render_import_metrics():
+    """
+    Util to aggregate per stage stats saved by download and import tasks on DataFile.process_stats.
+    Returns:
+        A list of str describing lines.
+    """
+    files = {True: 0, False: 0}
+    download_seconds = {}
+    download_bytes = {}
+    stage_seconds = {}
+    rows_per_second = Histogram(IMPORT_ROWS_PER_SECOND_BUCKETS)
+    rows_total = 0
+    changes_total = 0
+    for processed, stats in DataFile.objects.values_list('processed', 'process_stats').iterator():
+        files[processed] += 1
+        stats = stats or {}
+        download = stats.get('download')
+        if download:
+            source = download.get('source', 'github')
+            download_seconds.setdefault(source, Histogram(IMPORT_STAGE_BUCKETS)).observe(download['seconds'])
+            download_bytes.setdefault(source, Histogram(DOWNLOAD_BYTES_BUCKETS)).observe(download['bytes'])
+        import_ = stats.get('import')
+        if import_:
+            for stage, seconds in import_.get('stages', {}).items():
+                stage_seconds.setdefault(stage, Histogram(IMPORT_STAGE_BUCKETS)).observe(seconds)
+            if import_.get('rows_per_second'):
+                rows_per_second.observe(import_['rows_per_second'])
+            rows_total += import_.get('rows', 0)
+            changes_total += import_.get('changes', 0)
+
+    lines = []
+    lines += render_metric(
+        'covid_import_files',
+        'gauge',
+        'DataFile records by processed state.',
+        [({'processed': str(state).lower()}, total) for state, total in sorted(files.items())],
+    )
+    lines += render_histogram(
+        'covid_download_seconds',
+        'Seconds downloading a file into storage by source.',
+        [({'source': source}, download_seconds[source]) for source in sorted(download_seconds)],
+    )
+    lines += render_histogram(
+        'covid_download_bytes',
+        'Bytes of downloaded files by source.',
+        [({'source': source}, download_bytes[source]) for source in sorted(download_bytes)],
+    )
+    lines += render_histogram(
+        'covid_import_stage_seconds',
+        'Seconds spent by import stages.',
+        [({'stage': stage}, stage_seconds[stage]) for stage in sorted(stage_seconds)],
+    )
+    lines += render_histogram(
+        'covid_import_rows_per_second',
+        'Rows loaded by second on file imports.',
+        [({}, rows_per_second)],
+    )
+    lines += render_metric('covid_import_rows_total', 'counter', 'Rows normalized by imports.', [({}, rows_total)])
+    lines += render_metric(
+        'covid_import_row_changes_total',
+        'counter',
+        'Rows inserted, updated or deleted by imports.',
+        [({}, changes_total)],
+    )
+    return lines
+
+
+def render_metrics():
+    """
+    Util to render every api metric.
+    Returns:
+        A str describing metrics on prometheus text format.
+    """
+    return '\n'.join(render_import_metrics() + REQUEST_METRICS.render()) + '\n'
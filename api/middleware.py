@@ -0,0 +1,234 @@
+""" Module to define api middlewares """
+import io
+import os
+import asyncio
+import time
+import heapq
+import pstats
+import random
+import cProfile
+import threading
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.core.signals import request_started
+
+from api.metrics import REQUEST_TIMER
+from api.metrics import REQUEST_QUERY_COUNTER
+from api.metrics import REQUEST_METRICS
+from api.utils import StageTimer
+
+
+class QueryCounter:
+    """ Database execute wrapper counting queries and its seconds """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def count_request_query(execute, sql, params, many, context):
+    """ Database execute wrapper forwarding queries to QueryCounter of request being profiled, if any """
+    counter = REQUEST_QUERY_COUNTER.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection):
+    """
+    Util to add count_request_query to a connection once, it is kept while the connection object lives on its
+    thread (reconnections included).
+    Args:
+        connection: A django database connection object.
+    """
+    if count_request_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_request_query)
+
+
+def install_request_query_counter(sender, **kwargs):
+    """ Receiver of request_started adding count_request_query to connection of thread handling the request """
+    install_query_counter(connections['default'])
+
+
+class ProfileSampler:
+    """
+    Keeper of cProfile stats of the slowest sampled requests. Only one request is profiled at time (python
+    allows a single active profiler), requests arriving meanwhile are not sampled.
+    """
+
+    def __init__(self, keep=10, directory=None, top_functions=30):
+        self.keep = keep
+        self.directory = directory
+        self.top_functions = top_functions
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()
+        self.slowest = []
+        self.sequence = 0
+
+    def start(self):
+        """
+        Method to start profiling current request if no other request is profiled.
+        Returns:
+            A cProfile.Profile object or None.
+        """
+        if not self.profiling.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool is active
+            self.profiling.release()
+            return None
+        return profiler
+
+    def stop(self, profiler, seconds, label):
+        profiler.disable()
+        self.profiling.release()
+        with self.lock:
+            if len(self.slowest) >= self.keep and seconds <= self.slowest[0][0]:
+                return
+            self.sequence += 1
+            output = io.StringIO()
+            stats = pstats.Stats(profiler, stream=output)
+            stats.sort_stats('cumulative').print_stats(self.top_functions)
+            path = None
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, '{sequence}.prof'.format(sequence=self.sequence))
+                stats.dump_stats(path)
+            entry = (seconds, self.sequence, label, output.getvalue(), path)
+            if len(self.slowest) >= self.keep:
+                removed = heapq.heappushpop(self.slowest, entry)
+                if removed[4]:
+                    os.remove(removed[4])
+            else:
+                heapq.heappush(self.slowest, entry)
+
+    def render(self):
+        """
+        Method to render profiles kept, slowest first.
+        Returns:
+            A str describing pstats output of every profile.
+        """
+        with self.lock:
+            entries = sorted(self.slowest, reverse=True)
+        return '\n'.join(
+            '=== {label} {seconds:.4f}s{path}\n{stats}'.format(
+                label=label,
+                seconds=seconds,
+                path=' ({0})'.format(path) if path else '',
+                stats=stats,
+            ) for seconds, sequence, label, stats, path in entries
+        )
+
+
+PROFILE_SAMPLER = ProfileSampler(
+    keep=getattr(settings, 'API_PROFILING_KEEP_SLOWEST', 10),
+    directory=getattr(settings, 'API_PROFILING_DIR', None),
+)
+
+
+class RequestProfilingMiddleware:
+    """
+    Opt-in middleware (API_REQUEST_PROFILING) recording by view latency, database queries and its time, response
+    size and serializer time on api.metrics.REQUEST_METRICS. A fraction of requests (API_PROFILING_SAMPLE_RATE)
+    runs under cProfile, stats of the slowest ones are kept by PROFILE_SAMPLER. It runs sync or async as the rest
+    of the chain, under ASGI a profile covers every coroutine run by the event loop while the request is awaited.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'API_REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'API_PROFILING_SAMPLE_RATE', 0.0)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Handler awaits the middleware when it looks like a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        # Handlers send request_started on the thread running sync views (under ASGI too), pool threads of async
+        # views install it by themselves
+        request_started.connect(install_request_query_counter, dispatch_uid='api_request_query_counter')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            seconds = self.stop(request, profile)
+        self.observe(request, response, profile, seconds)
+        return response
+
+    async def __acall__(self, request):
+        profile = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            seconds = self.stop(request, profile)
+        self.observe(request, response, profile, seconds)
+        return response
+
+    def start(self):
+        """
+        Method to start measuring a request, query counter and timer are given to views through context vars.
+        Returns:
+            A dict describing request measurement state.
+        """
+        counter = QueryCounter()
+        timer = StageTimer()
+        return {
+            'counter': counter,
+            'timer': timer,
+            'tokens': (REQUEST_TIMER.set(timer), REQUEST_QUERY_COUNTER.set(counter)),
+            'profiler': PROFILE_SAMPLER.start() if self.sample_rate and random.random() < self.sample_rate else None,
+            'started': time.perf_counter(),
+        }
+
+    def stop(self, request, profile):
+        """
+        Method to stop measuring a request.
+        Args:
+            request: A django.http.HttpRequest object.
+            profile: A dict given by start.
+
+        Returns:
+            A float describing request seconds.
+        """
+        seconds = time.perf_counter() - profile['started']
+        timer_token, counter_token = profile['tokens']
+        REQUEST_TIMER.reset(timer_token)
+        REQUEST_QUERY_COUNTER.reset(counter_token)
+        if profile['profiler'] is not None:
+            PROFILE_SAMPLER.stop(
+                profiler=profile['profiler'],
+                seconds=seconds,
+                label='{method} {path}'.format(method=request.method, path=request.get_full_path()),
+            )
+        return seconds
+
+    @staticmethod
+    def observe(request, response, profile, seconds):
+        resolver_match = getattr(request, 'resolver_match', None)
+        REQUEST_METRICS.observe(
+            view=resolver_match.view_name if resolver_match else 'unresolved',
+            method=request.method,
+            seconds=seconds,
+            queries=profile['counter'].queries,
+            query_seconds=profile['counter'].seconds,
+            serializer_seconds=profile['timer'].timings.get('serializer'),
+            response_bytes=None if response.streaming else len(response.content),
+        )
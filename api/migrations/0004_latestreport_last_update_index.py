@@ -0,0 +1,26 @@
+# Generated by Django 3.1.12 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_datafile_header'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_update', models.DateTimeField(verbose_name='Last Update')),
+                ('data_file_id', models.IntegerField(blank=True, null=True)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='generaldata',
+            index=models.Index(fields=['last_update'], name='generaldata_last_update_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.12 on 2026-10-18 10:03
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently to not lock GeneralData writes on big tables
+    atomic = False
+
+    dependencies = [
+        ('api', '0004_latestreport_last_update_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='generaldata',
+            index=models.Index(fields=['last_update', 'id'], name='generaldata_last_update_id_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='generaldata',
+            name='generaldata_last_update_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='generaldata',
+            index=models.Index(fields=['country_region', 'province_state', 'report_day'], name='generaldata_location_day_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='generaldata',
+            index=models.Index(fields=['province_state', 'report_day'], name='generaldata_province_day_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='generaldata',
+            index=models.Index(fields=['report_day'], name='generaldata_report_day_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='generaldata',
+            index=models.Index(fields=['data_file_id'], name='generaldata_data_file_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.12 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+POPULATE_SUMMARY_SQL = """
+INSERT INTO api_countrydailysummary (country_region, report_day, confirmed, deaths, recovered, locations, update_date)
+SELECT country_region, report_day, SUM(confirmed), SUM(deaths), SUM(recovered), COUNT(id), NOW()
+FROM api_generaldata
+WHERE report_day IS NOT NULL
+GROUP BY country_region, report_day
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_generaldata_access_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country_region', models.CharField(max_length=200, verbose_name='Country/Region')),
+                ('report_day', models.DateField()),
+                ('confirmed', models.FloatField(blank=True, null=True)),
+                ('deaths', models.FloatField(blank=True, null=True)),
+                ('recovered', models.FloatField(blank=True, null=True)),
+                ('locations', models.IntegerField(default=0)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='countrydailysummary',
+            index=models.Index(fields=['report_day', 'id'], name='summary_report_day_id_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='countrydailysummary',
+            unique_together={('country_region', 'report_day')},
+        ),
+        migrations.RunSQL(
+            sql=POPULATE_SUMMARY_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_countrydailysummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datafile',
+            name='md5_checksum',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
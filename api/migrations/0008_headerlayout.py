@@ -0,0 +1,26 @@
+# Generated by Django 3.1.12 on 2026-10-18 14:02
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_datafile_md5_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeaderLayout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('columns', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('field_mapping', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('date_format', models.CharField(blank=True, max_length=50, null=True)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
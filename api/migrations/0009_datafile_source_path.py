@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_headerlayout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datafile',
+            name='source_path',
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+    ]
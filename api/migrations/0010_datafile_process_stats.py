@@ -0,0 +1,19 @@
+# Generated by Django 3.1.12 on 2026-10-18 15:20
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_datafile_source_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datafile',
+            name='process_stats',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+    ]
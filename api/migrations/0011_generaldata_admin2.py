@@ -0,0 +1,29 @@
+# Generated by Django 3.1.12 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def map_admin2_column(apps, schema_editor):
+    """ Registered layouts keep Admin2 column unmapped, map it to new field """
+    HeaderLayout = apps.get_model('api', 'HeaderLayout')
+    for layout in HeaderLayout.objects.all():
+        columns = [column for column, field in layout.field_mapping.items() if column.lower() == 'admin2' and not field]
+        if columns:
+            layout.field_mapping.update({column: 'admin2' for column in columns})
+            layout.save(update_fields=['field_mapping'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_datafile_process_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generaldata',
+            name='admin2',
+            field=models.CharField(blank=True, max_length=200, null=True, verbose_name='Admin2'),
+        ),
+        migrations.RunPython(map_admin2_column, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,193 @@
+""" Module to keep a local content addressed copy of upstream files (keyed by git blob sha) """
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+LOGGER = logging.getLogger(__file__)
+
+
+class FileMirror:
+    """
+    Directory storing raw upstream files on <root>/<sha[:2]>/<sha>. Files are written atomically, never modified
+    and evicted by least recent use when directory exceed max_size bytes (every hit refresh file mtime).
+    Mirror size is walked from disk once and then counted on every publish, directory is only walked again when
+    count goes over max_size (files published by other processes are counted then).
+    """
+
+    def __init__(self, root, max_size=None):
+        """
+        Args:
+            root: A str describing mirror directory.
+            max_size: A int describing max bytes stored, unbounded if it is None.
+        """
+        self.root = root
+        self.max_size = max_size
+        self._evict_lock = threading.Lock()
+        self._size = None
+
+    def get_path(self, sha):
+        return os.path.join(self.root, sha[:2], sha)
+
+    def get(self, sha):
+        """
+        Method to get path of a mirrored file marking it as recently used.
+        Args:
+            sha: A str describing git blob sha of file.
+
+        Returns:
+            A str describing file path or None if file is not mirrored.
+        """
+        if not sha:
+            return None
+        path = self.get_path(sha)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def discard(self, sha):
+        path = self.get_path(sha)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.add_size(-size)
+
+    @contextmanager
+    def writer(self, sha):
+        """
+        Context manager giving a binary file to write a new file, it is published only if commit method is called
+        (e.g. once caller verified sha), otherwise it is discarded.
+        Args:
+            sha: A str describing git blob sha of file.
+
+        Returns:
+            A MirrorWriter object.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=self.root, prefix='.incoming_')
+        writer = MirrorWriter(os.fdopen(descriptor, 'wb'), temp_path)
+        try:
+            yield writer
+        finally:
+            writer.file.close()
+            if writer.committed:
+                self.publish(temp_path, sha)
+            else:
+                os.remove(temp_path)
+
+    def put_file(self, sha, file_path):
+        """
+        Method to mirror a local file already verified.
+        Args:
+            sha: A str describing git blob sha of file.
+            file_path: A str describing local file path.
+        """
+        if self.get(sha):
+            return
+        with self.writer(sha) as writer, open(file_path, 'rb') as file_:
+            shutil.copyfileobj(file_, writer.file)
+            writer.commit()
+
+    def publish(self, temp_path, sha):
+        path = self.get_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(temp_path, 0o444)
+        size = os.path.getsize(temp_path)
+        replaced = os.path.exists(path)
+        os.replace(temp_path, path)
+        if not replaced:
+            self.add_size(size)
+        self.evict()
+
+    def add_size(self, size):
+        with self._evict_lock:
+            if self._size is not None:
+                self._size += size
+
+    def evict(self):
+        """ Method removing least recently used files while mirror size is over max_size """
+        if self.max_size is None:
+            return
+        with self._evict_lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+            files = []
+            total = 0
+            for root, dirs, names in os.walk(self.root):
+                for name in names:
+                    if name.startswith('.incoming_'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            for mtime, size, path in sorted(files):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                LOGGER.info(msg='Mirror file evicted => {path}'.format(path=path))
+            self._size = total
+
+
+class MirrorWriter:
+    """ Temporary file of a FileMirror.writer """
+
+    def __init__(self, file_, path):
+        self.file = file_
+        self.path = path
+        self.committed = False
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def commit(self):
+        self.committed = True
+
+
+def tee_chunks(chunks, writer):
+    """
+    Util to copy chunks on a writer while they are consumed.
+    Args:
+        chunks: A iterable of bytes.
+        writer: A object with write method.
+
+    Returns:
+        A generator of bytes.
+    """
+    for chunk in chunks:
+        writer.write(chunk)
+        yield chunk
+
+
+_MIRROR = None
+
+
+def get_mirror():
+    """
+    Util to get mirror configured on settings.
+    Returns:
+        A FileMirror object or None if API_MIRROR_ROOT is not set.
+    """
+    global _MIRROR
+    root = getattr(settings, 'API_MIRROR_ROOT', None)
+    if not root:
+        return None
+    if _MIRROR is None or _MIRROR.root != root:
+        _MIRROR = FileMirror(root=root, max_size=getattr(settings, 'API_MIRROR_MAX_SIZE', None))
+    return _MIRROR
@@ -1,13 +1,20 @@
 """ Module to define API DB Models """
 import hashlib
 
+import datetime
+
 from django.db import models
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Sum
+from django.db.models import Count
 from django.core.exceptions import ObjectDoesNotExist
 
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 
-from postgres_copy import CopyManager
+from postgres_copy import CopyQuerySet
 
 from django.contrib.postgres.fields import JSONField
 
@@ -18,12 +25,15 @@ class DataFile(models.Model):
     """ DB Table to track imported files """
     origin_file = models.FileField(upload_to='covid_data')
     signature = models.TextField(unique=True)
+    source_path = models.TextField(null=True, blank=True, db_index=True)
+    md5_checksum = models.CharField(max_length=32, null=True, blank=True)
     create_date = models.DateTimeField(auto_now_add=True)
     process_id = models.CharField(max_length=200, null=True, blank=True)
     processed = models.BooleanField(default=False)
     normalized = models.BooleanField(default=False)
     header = JSONField(default=dict)
     process_detail = models.TextField(null=True, blank=True)
+    process_stats = JSONField(default=dict, blank=True)
     update_date = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -38,6 +48,36 @@ class DataFile(models.Model):
 
     download_file.allow_tags = True
 
+    def get_previous_version_ids(self):
+        """
+        Function to get processed older versions of same source file (revisions published with another sha),
+        revisions are registered in publication order so older ones have a lower id.
+        Returns:
+            A list of int describing DataFile ids.
+        """
+        if not self.source_path:
+            return []
+        return list(DataFile.objects.filter(
+            source_path=self.source_path,
+            processed=True,
+            id__lt=self.id,
+        ).values_list('id', flat=True))
+
+    def has_newer_version(self):
+        """
+        Function to check if a newer revision of same source file was already processed, loading this one
+        would replace its rows with outdated ones.
+        Returns:
+            A bool.
+        """
+        if not self.source_path:
+            return False
+        return DataFile.objects.filter(
+            source_path=self.source_path,
+            processed=True,
+            id__gt=self.id,
+        ).exists()
+
     def generate_checksum(self):
         """
         Function to generate file checksum.
@@ -72,9 +112,43 @@ class DataFile(models.Model):
             raise AlreadyProcessedFile
 
 
+class HeaderLayout(models.Model):
+    """ DB Table to register csv header layouts with its field mapping and date format identified """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    columns = JSONField(default=list)
+    field_mapping = JSONField(default=dict)
+    date_format = models.CharField(max_length=50, null=True, blank=True)
+    create_date = models.DateTimeField(auto_now_add=True)
+    update_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return ', '.join(self.columns)
+
+
+class GeneralDataQuerySet(CopyQuerySet):
+    """ QuerySet adding index friendly lookups to GeneralData """
+
+    def last_update_on(self, day):
+        """
+        Method to filter rows updated on a day using a half-open range, so last_update index can be used
+        instead of extracting year/month/day on every row.
+        Args:
+            day: A datetime.date object.
+
+        Returns:
+            A GeneralDataQuerySet object.
+        """
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+        return self.filter(
+            last_update__gte=start,
+            last_update__lt=start + datetime.timedelta(days=1),
+        )
+
+
 class GeneralData(models.Model):
     """ Model to save COVID data completely """
     province_state = models.CharField(max_length=200, null=True, blank=True, verbose_name='Province/State')
+    admin2 = models.CharField(max_length=200, null=True, blank=True, verbose_name='Admin2')
     country_region = models.CharField(max_length=200, verbose_name='Country/Region')
     last_update = models.DateTimeField(verbose_name='Last Update')
     confirmed = models.FloatField(null=True, blank=True)
@@ -87,7 +161,164 @@ class GeneralData(models.Model):
     report_day = models.DateField(null=True, blank=True)
     data_file_id = models.IntegerField(null=True, blank=True)
 
-    objects = CopyManager()
+    objects = GeneralDataQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_update', 'id'], name='generaldata_last_update_id_idx'),
+            models.Index(fields=['country_region', 'province_state', 'report_day'], name='generaldata_location_day_idx'),
+            models.Index(fields=['province_state', 'report_day'], name='generaldata_province_day_idx'),
+            models.Index(fields=['report_day'], name='generaldata_report_day_idx'),
+            models.Index(fields=['data_file_id'], name='generaldata_data_file_idx'),
+        ]
 
     def __str__(self):
         return '{0} - {1}'.format(self.country_region, self.province_state)
+
+
+class LatestReport(models.Model):
+    """ Single row table pointing to most recent last_update imported, maintained by importer """
+    SINGLETON_ID = 1
+
+    last_update = models.DateTimeField(verbose_name='Last Update')
+    data_file_id = models.IntegerField(null=True, blank=True)
+    update_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.last_update)
+
+    @classmethod
+    def register(cls, last_update, data_file_id=None):
+        """
+        Method to move pointer forward if last_update is newer than the registered one.
+        Args:
+            last_update: A datetime.datetime object.
+            data_file_id: A int describing DataFile id which contains last_update.
+        """
+        updated = cls.objects.filter(
+            id=cls.SINGLETON_ID,
+            last_update__lt=last_update,
+        ).update(
+            last_update=last_update,
+            data_file_id=data_file_id,
+            update_date=timezone.now(),
+        )
+        if not updated:
+            cls.objects.get_or_create(
+                id=cls.SINGLETON_ID,
+                defaults={
+                    'last_update': last_update,
+                    'data_file_id': data_file_id,
+                }
+            )
+
+    @classmethod
+    def refresh(cls):
+        """
+        Method to rebuild pointer from the newest GeneralData row, so it can move backward too (e.g. the
+        newest rows were updated or deleted by a file revision). Pointer is removed if there are not data.
+        """
+        latest = GeneralData.objects.order_by('-last_update').values('last_update', 'data_file_id').first()
+        if latest is None:
+            cls.objects.filter(id=cls.SINGLETON_ID).delete()
+            return
+        cls.objects.update_or_create(id=cls.SINGLETON_ID, defaults=latest)
+
+    @classmethod
+    def register_data_file(cls, data_file_id, recompute=False):
+        """
+        Method to update pointer with rows imported from a DataFile.
+        Args:
+            data_file_id: A int describing DataFile id.
+            recompute: A bool indicating that rows already imported were updated or deleted, pointer is
+                rebuilt from every row instead of only moving forward.
+        """
+        if recompute:
+            cls.refresh()
+            return
+        last_update = GeneralData.objects.filter(
+            data_file_id=data_file_id,
+        ).aggregate(last=Max('last_update'))['last']
+        if last_update:
+            cls.register(last_update=last_update, data_file_id=data_file_id)
+
+    @classmethod
+    def get_last_update(cls):
+        """
+        Method to get most recent last_update, pointer is built from GeneralData if it does not exist yet.
+        Returns:
+            A datetime.datetime object or None if there are not data.
+        """
+        try:
+            return cls.objects.get(id=cls.SINGLETON_ID).last_update
+        except ObjectDoesNotExist:
+            last_update = GeneralData.objects.aggregate(last=Max('last_update'))['last']
+            if last_update:
+                cls.register(last_update=last_update)
+            return last_update
+
+
+class CountryDailySummaryManager(models.Manager):
+    """ Manager to maintain country rollup from GeneralData """
+
+    def refresh_days(self, report_days):
+        """
+        Method to rebuild rollup rows only for given days.
+        Args:
+            report_days: A iterable of datetime.date objects.
+
+        Returns:
+            A int describing rollup rows created.
+        """
+        report_days = [day for day in set(report_days) if day]
+        if not report_days:
+            return 0
+        aggregated = GeneralData.objects.filter(
+            report_day__in=report_days,
+        ).values(
+            'country_region',
+            'report_day',
+        ).annotate(
+            total_confirmed=Sum('confirmed'),
+            total_deaths=Sum('deaths'),
+            total_recovered=Sum('recovered'),
+            total_locations=Count('id'),
+        ).order_by()
+        rows = [
+            self.model(
+                country_region=row['country_region'],
+                report_day=row['report_day'],
+                confirmed=row['total_confirmed'],
+                deaths=row['total_deaths'],
+                recovered=row['total_recovered'],
+                locations=row['total_locations'],
+            ) for row in aggregated
+        ]
+        with transaction.atomic():
+            self.filter(report_day__in=report_days).delete()
+            self.bulk_create(rows)
+        return len(rows)
+
+
+class CountryDailySummary(models.Model):
+    """ Rollup of GeneralData by country and report day, maintained incrementally by importer """
+    country_region = models.CharField(max_length=200, verbose_name='Country/Region')
+    report_day = models.DateField()
+    confirmed = models.FloatField(null=True, blank=True)
+    deaths = models.FloatField(null=True, blank=True)
+    recovered = models.FloatField(null=True, blank=True)
+    locations = models.IntegerField(default=0)
+    update_date = models.DateTimeField(auto_now=True)
+
+    objects = CountryDailySummaryManager()
+
+    class Meta:
+        unique_together = [
+            ('country_region', 'report_day'),
+        ]
+        indexes = [
+            models.Index(fields=['report_day', 'id'], name='summary_report_day_id_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.country_region, self.report_day)
@@ -0,0 +1,185 @@
+""" Module to define api pagination classes """
+import json
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination seeking on (last_update, id) instead of OFFSET, so any page cost the same
+    index range scan. Cursors are opaque base64 tokens describing last seen position and direction.
+    Subclasses can seek on other (date/datetime field, unique field) pair changing ordering.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = getattr(settings, 'API_PAGE_SIZE', 500)
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('last_update', 'id')
+
+    def __init__(self):
+        self.base_url = None
+        self.page = []
+        self.has_next = False
+        self.has_previous = False
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, position, reverse):
+        """
+        Method to build opaque cursor value.
+        Args:
+            position: A tuple describing ordering values of boundary row.
+            reverse: A bool indicating if cursor walk backward.
+
+        Returns:
+            A str describing cursor url safe.
+        """
+        value, id_ = position
+        payload = json.dumps({'p': [value.isoformat(), id_], 'r': int(reverse)})
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        Method to parse cursor query param.
+        Returns:
+            None if no cursor was sent else a tuple ((value, id), reverse).
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            value = parse_datetime(payload['p'][0]) or parse_date(payload['p'][0])
+            id_ = int(payload['p'][1])
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, IndexError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (value, id_), reverse
+
+    def get_position(self, item):
+        """ Method to get ordering values of model instance or values() dict """
+        if isinstance(item, dict):
+            return tuple(item[field] for field in self.ordering)
+        return tuple(getattr(item, field) for field in self.ordering)
+
+    def seek(self, queryset, position, lookup):
+        """
+        Method to filter rows after (or before) a position with a row comparison, e.g.
+        (last_update, id) > (x, y), postgres resolves it as a range condition of (last_update, id) index, an
+        equivalent OR of two predicates is only applied as filter reading index from the start.
+        Args:
+            queryset: A QuerySet object.
+            position: A tuple describing ordering values of boundary row.
+            lookup: A str describing direction, gt or lt.
+
+        Returns:
+            A QuerySet object.
+        """
+        connection = connections[queryset.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(queryset.model._meta.db_table)
+        fields = [queryset.model._meta.get_field(field) for field in self.ordering]
+        columns = ', '.join('{table}.{column}'.format(table=table, column=quote_name(field.column)) for field in fields)
+        return queryset.extra(
+            where=['({columns}) {operator} (%s, %s)'.format(columns=columns, operator='>' if lookup == 'gt' else '<')],
+            # Raw params are not adapted by fields (e.g. datetimes on sqlite)
+            params=[field.get_db_prep_value(value, connection) for field, value in zip(fields, position)],
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        first_field, second_field = self.ordering
+
+        if cursor is None:
+            position, reverse = None, False
+        else:
+            position, reverse = cursor
+
+        if reverse:
+            queryset = queryset.order_by('-' + first_field, '-' + second_field)
+            lookup = 'lt'
+        else:
+            queryset = queryset.order_by(first_field, second_field)
+            lookup = 'gt'
+        if position is not None:
+            queryset = self.seek(queryset, position, lookup)
+
+        # Fetch one extra row to know if there are more pages on walking direction
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_previous = has_more
+            self.has_next = position is not None
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        cursor = self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+class SummaryKeysetPagination(KeysetPagination):
+    """ Keyset pagination for country rollup seeking on (report_day, id) """
+    ordering = ('report_day', 'id')
@@ -0,0 +1,76 @@
+""" Module to define api renderers """
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# DRF encoder handles what orjson does not (lazy strings, decimals, querysets) and every datetime, so
+# timezone suffix is the same as JSONRenderer ('Z' for UTC offsets)
+DRF_ENCODER = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed, output bytes are the same of JSONRenderer for
+    compact unicode settings. Indented responses (browsable api, indent media type param), ascii or long
+    separators settings and data orjson refuses (e.g. non str keys) fall back to JSONRenderer.
+    Unlike json module, NaN/Infinity are rendered as null and floats written with exponent (< 1e-4 or
+    >= 1e16) have not '+' sign and leading exponent zeros.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=DRF_ENCODER.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escape of JSONRenderer, so output is a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def to_columns(rows):
+    """
+    Util to turn a list of objects into a dict of column arrays.
+    Args:
+        rows: A list of dicts with same keys.
+
+    Returns:
+        A dict describing key = list of values, keys of first row are used.
+    """
+    if not rows:
+        return {}
+    return {name: [row[name] for row in rows] for name in rows[0]}
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    Renderer selected with format=columnar query param, lists of objects given as response or under results
+    (paginated lists) or data (last endpoint) keys are rendered as a dict of column arrays, so keys are not
+    repeated by row. Empty lists are rendered as an empty dict.
+    """
+    format = 'columnar'
+    columnar_keys = ('results', 'data')
+
+    @staticmethod
+    def is_rows(value):
+        return isinstance(value, list) and bool(value) and isinstance(value[0], dict)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list) and (not data or self.is_rows(data)):
+            data = to_columns(data)
+        elif isinstance(data, dict):
+            columnar_keys = [key for key in self.columnar_keys if isinstance(data.get(key), list)]
+            if columnar_keys:
+                data = data.copy()
+                for key in columnar_keys:
+                    if not data[key] or self.is_rows(data[key]):
+                        data[key] = to_columns(data[key])
+        return super().render(data, accepted_media_type, renderer_context)
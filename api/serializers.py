@@ -1,9 +1,153 @@
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework import ISO_8601
+from rest_framework.fields import CharField
+from rest_framework.fields import DateField
+from rest_framework.fields import DateTimeField
+from rest_framework.fields import FloatField
+from rest_framework.fields import BooleanField
+from rest_framework.fields import IntegerField
+from rest_framework.serializers import ListSerializer
 from rest_framework.serializers import ModelSerializer
+from rest_framework.settings import api_settings
 
+from api.metrics import request_stage
 from api.models import GeneralData
+from api.models import CountryDailySummary
+
+
+class TimedListSerializer(ListSerializer):
+    """ ListSerializer adding its time to serializer stage of profiled requests """
+
+    def to_representation(self, data):
+        with request_stage('serializer'):
+            return super().to_representation(data)
+
+
+def get_iso_converter(field):
+    """
+    Util to get a converter giving same output of to_representation for date and datetime fields on iso format,
+    current timezone is read once instead of on every value.
+    Args:
+        field: A rest_framework.fields.Field object.
+
+    Returns:
+        A callable receiving a not None value or None if field has not a fast converter.
+    """
+    if type(field) is DateField:
+        output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+        if isinstance(output_format, str) and output_format.lower() == ISO_8601:
+            return datetime.date.isoformat
+    elif type(field) is DateTimeField and settings.USE_TZ and not hasattr(field, 'timezone'):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if isinstance(output_format, str) and output_format.lower() == ISO_8601:
+            current_timezone = timezone.get_current_timezone()
+
+            def convert(value):
+                value = timezone.make_aware(value, current_timezone) if timezone.is_naive(value) else \
+                    value.astimezone(current_timezone)
+                value = value.isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return convert
+    return None
+
+
+class ValuesSerializer:
+    """
+    Read only fast path of a ModelSerializer for bulk reads. Rows are read as values() dicts on serializer
+    field order and only fields needing a conversion (dates, datetimes) are transformed, output is the same
+    of serializer_class(many=True).data without a to_representation call by field and row.
+    """
+    # Fields whose representation is the value read from database
+    passthrough_fields = (CharField, FloatField, BooleanField, IntegerField)
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._field_names = None
+        self._converted_fields = None
+
+    def _build(self):
+        fields = self.serializer_class().fields
+        self._field_names = [name for name, field in fields.items() if not field.write_only]
+        self._converted_fields = [
+            (name, field) for name, field in fields.items()
+            if not field.write_only and type(field) not in self.passthrough_fields
+        ]
+
+    @property
+    def field_names(self):
+        if self._field_names is None:
+            self._build()
+        return self._field_names
+
+    def get_converters(self):
+        """
+        Method to get converters of fields whose value is not its representation.
+        Returns:
+            A list of tuples (field name, callable).
+        """
+        if self._converted_fields is None:
+            self._build()
+        return [
+            (name, get_iso_converter(field) or field.to_representation) for name, field in self._converted_fields
+        ]
+
+    def get_queryset(self, queryset, fields=None, required_fields=()):
+        """
+        Method to read only serialized fields as dicts.
+        Args:
+            queryset: A QuerySet object of serializer model.
+            fields: A list of str describing fields read, every field by default.
+            required_fields: A iterable of str describing extra model fields read (e.g. cursor of pagination).
+
+        Returns:
+            A QuerySet object yielding dicts.
+        """
+        names = list(self.field_names if fields is None else fields)
+        names += [name for name in required_fields if name not in names]
+        return queryset.values(*names)
+
+    def to_representation(self, rows, fields=None):
+        """
+        Method to get serialized data of rows read by get_queryset.
+        Args:
+            rows: A iterable of dicts, they are not modified (pagination reads cursor from them).
+            fields: A list of str describing fields given on output, every field by default.
+
+        Returns:
+            A list of dicts.
+        """
+        converters = self.get_converters()
+        if fields is not None:
+            converters = [(name, convert) for name, convert in converters if name in fields]
+        data = []
+        with request_stage('serializer'):
+            for row in rows:
+                item = dict(row) if fields is None else {name: row[name] for name in fields}
+                for name, convert in converters:
+                    value = item[name]
+                    if value is not None:
+                        item[name] = convert(value)
+                data.append(item)
+        return data
 
 
 class GeneralDataSerializer(ModelSerializer):
     class Meta:
         model = GeneralData
         fields = '__all__'
+        list_serializer_class = TimedListSerializer
+
+
+class CountryDailySummarySerializer(ModelSerializer):
+    class Meta:
+        model = CountryDailySummary
+        exclude = ['update_date']
+        list_serializer_class = TimedListSerializer
+
+
+GENERAL_DATA_VALUES_SERIALIZER = ValuesSerializer(GeneralDataSerializer)
+COUNTRY_DAILY_SUMMARY_VALUES_SERIALIZER = ValuesSerializer(CountryDailySummarySerializer)
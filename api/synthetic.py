@@ -0,0 +1,165 @@
+""" Module to generate synthetic jh university daily reports, used by benchmarks and load tests """
+import os
+import csv
+import random
+import datetime
+
+
+DAILY_REPORTS_PATH = os.path.join('csse_covid_19_data', 'csse_covid_19_daily_reports')
+
+# Historical layouts of daily reports, date_formats are the ones found on files of each period
+HEADER_LAYOUTS = {
+    'archived': {
+        'columns': ['Province/State', 'Country/Region', 'Last Update', 'Confirmed', 'Suspected', 'Recovered', 'Deaths'],
+        'date_formats': ['%m/%d/%Y %I%p'],
+    },
+    'early': {
+        'columns': ['Province/State', 'Country/Region', 'Last Update', 'Confirmed', 'Deaths', 'Recovered'],
+        'date_formats': ['%m/%d/%Y %H:%M', '%m/%d/%y %H:%M', '%Y-%m-%dT%H:%M:%S'],
+    },
+    'coordinates': {
+        'columns': [
+            'Province/State', 'Country/Region', 'Last Update', 'Confirmed', 'Deaths', 'Recovered', 'Latitude',
+            'Longitude',
+        ],
+        'date_formats': ['%Y-%m-%dT%H:%M:%S'],
+    },
+    'counties': {
+        'columns': [
+            'FIPS', 'Admin2', 'Province_State', 'Country_Region', 'Last_Update', 'Lat', 'Long_', 'Confirmed',
+            'Deaths', 'Recovered', 'Active', 'Combined_Key',
+        ],
+        'date_formats': ['%m/%d/%y %H:%M', '%Y-%m-%d %H:%M:%S'],
+    },
+}
+
+COUNTRIES = [
+    ('China', ['Hubei', 'Guangdong', 'Henan', 'Zhejiang', 'Hunan', 'Anhui', 'Jiangxi', 'Shandong']),
+    ('US', ['New York', 'Washington', 'California', 'New Jersey', 'Florida', 'Texas', 'Illinois', 'Louisiana']),
+    ('Italy', ['']),
+    ('Spain', ['']),
+    ('Germany', ['']),
+    ('France', ['', 'French Guiana', 'Reunion']),
+    ('Australia', ['New South Wales', 'Victoria', 'Queensland']),
+    ('Canada', ['Ontario', 'Quebec', 'British Columbia', 'Alberta']),
+    ('United Kingdom', ['', 'Gibraltar', 'Channel Islands']),
+    ('Peru', ['']),
+    ('Brazil', ['']),
+    ('India', ['']),
+]
+
+
+def get_locations(rows, layout):
+    """
+    Util to get as many distinct locations as rows, extra locations are made as numbered counties/provinces.
+    Args:
+        rows: A int describing rows on file.
+        layout: A str describing layout name.
+
+    Returns:
+        A list of tuples (admin2, province_state, country_region).
+    """
+    base = [(country, province) for country, provinces in COUNTRIES for province in provinces]
+    locations = []
+    for index in range(rows):
+        country, province = base[index % len(base)]
+        repeat = index // len(base)
+        if layout == 'counties':
+            locations.append(('County {0}'.format(repeat) if repeat else '', province, country))
+        else:
+            locations.append(('', '{0} {1}'.format(province or country, repeat) if repeat else province, country))
+    return locations
+
+
+def write_daily_report(file_, report_day, rows, layout='early', date_format=None, delimiter=',', seed=0):
+    """
+    Util to write a synthetic daily report.
+    Args:
+        file_: A text file object.
+        report_day: A datetime.date object describing report day.
+        rows: A int describing number of rows.
+        layout: A str describing a HEADER_LAYOUTS key.
+        date_format: A str describing Last Update format, first format of layout by default.
+        delimiter: A str describing csv delimiter.
+        seed: A int describing random seed, same arguments give same file.
+
+    Returns:
+        A int describing rows written.
+    """
+    randomizer = random.Random('{0}-{1}-{2}'.format(seed, layout, report_day.isoformat()))
+    definition = HEADER_LAYOUTS[layout]
+    date_format = date_format or definition['date_formats'][0]
+    # Cumulative numbers grow with days since first report
+    day_number = (report_day - datetime.date(2020, 1, 22)).days + 1
+    writer = csv.writer(file_, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(definition['columns'])
+    for index, (admin2, province, country) in enumerate(get_locations(rows=rows, layout=layout)):
+        last_update = datetime.datetime.combine(report_day, datetime.time(randomizer.randint(0, 23), 0))
+        confirmed = randomizer.randint(0, 50) * day_number
+        deaths = confirmed // randomizer.randint(10, 50)
+        recovered = confirmed // randomizer.randint(2, 5)
+        latitude = round(randomizer.uniform(-60, 70), 4)
+        longitude = round(randomizer.uniform(-180, 180), 4)
+        values = {
+            'FIPS': 1000 + index if admin2 else '',
+            'Admin2': admin2,
+            'Province/State': province,
+            'Province_State': province,
+            'Country/Region': country,
+            'Country_Region': country,
+            'Last Update': last_update.strftime(date_format),
+            'Last_Update': last_update.strftime(date_format),
+            'Confirmed': confirmed,
+            'Deaths': deaths if randomizer.random() > 0.05 else '',
+            'Recovered': recovered if randomizer.random() > 0.05 else '',
+            'Suspected': randomizer.randint(0, 10) if randomizer.random() > 0.5 else '',
+            'Active': confirmed - deaths - recovered,
+            'Latitude': latitude,
+            'Longitude': longitude,
+            'Lat': latitude,
+            'Long_': longitude,
+            'Combined_Key': ', '.join(value for value in (admin2, province, country) if value),
+        }
+        writer.writerow([values[column] for column in definition['columns']])
+    return rows
+
+
+def write_dataset(directory, days, rows, start_day=None, layouts=None, seed=0):
+    """
+    Util to write a directory of daily reports with upstream repo paths, layouts and date formats rotate by day
+    so every historical combination is present.
+    Args:
+        directory: A str describing root directory.
+        days: A int describing number of daily reports.
+        rows: A int describing rows by report.
+        start_day: A datetime.date object describing first report day, 2020-01-22 by default.
+        layouts: A list of str describing layouts used, all by default.
+        seed: A int describing random seed.
+
+    Returns:
+        A list of str describing file paths written.
+    """
+    start_day = start_day or datetime.date(2020, 1, 22)
+    combinations = [
+        (layout, date_format)
+        for layout in layouts or list(HEADER_LAYOUTS.keys())
+        for date_format in HEADER_LAYOUTS[layout]['date_formats']
+    ]
+    reports_directory = os.path.join(directory, DAILY_REPORTS_PATH)
+    os.makedirs(reports_directory, exist_ok=True)
+    paths = []
+    for day in range(days):
+        report_day = start_day + datetime.timedelta(days=day)
+        layout, date_format = combinations[day % len(combinations)]
+        path = os.path.join(reports_directory, report_day.strftime('%m-%d-%Y.csv'))
+        with open(path, 'w', newline='', encoding='utf-8') as file_:
+            write_daily_report(
+                file_=file_,
+                report_day=report_day,
+                rows=rows,
+                layout=layout,
+                date_format=date_format,
+                seed=seed,
+            )
+        paths.append(path)
+    return paths
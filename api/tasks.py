@@ -1,34 +1,161 @@
 # -*- coding: utf-8 -*-
 """ Module to create tasks of project """
 import os
+import random
 import logging
-import tempfile
 import datetime
+from contextlib import ExitStack
+from contextlib import nullcontext
 
-import pandas as pd
+import requests
 
+from django.conf import settings
+from django.db import transaction
+from django.db import DataError
 from django.db import IntegrityError
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.utils import timezone
 
+from api.exceptions import AlreadyProcessedFile
+from api.exceptions import CopySlotUnavailable
 from api.exceptions import HeaderNotIdentifier
 from api.exceptions import DateFormatNotIdentifier
+from api.exceptions import RateLimitExceeded
+from api.exceptions import NewerVersionProcessed
 from covid_19 import celery_app as app
 
+from api.cache import get_cache
+from api.cache import bump_dataset_version
+from api.loader import apply_data_file_delta
+from api.loader import copy_slot
+from api.loader import lock_source
+from api.mirror import get_mirror
+from api.mirror import tee_chunks
+from api.header_registry import remember_date_format
 from api.utils import clean_jh_csv_file
 from api.utils import github_api_request
+from api.utils import HashingChunkStream
+from api.utils import StageTimer
 
 from api.models import DataFile
 from api.models import GeneralData
+from api.models import LatestReport
+from api.models import CountryDailySummary
 
 
 LOGGER = logging.getLogger(__file__)
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Errors raised by requests while a response body is read, http errors are raised before streaming
+DOWNLOAD_STREAM_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+GITHUB_LISTING_CACHE_KEY = 'api:github_listing:{url}'
+GITHUB_LISTING_KEYS = ['name', 'path', 'sha', 'size', 'download_url', 'type']
+COPY_SLOT_RETRY_DELAY = getattr(settings, 'API_COPY_SLOT_RETRY_DELAY', 30)
+TASK_PRIORITY_BULK = getattr(settings, 'API_TASK_PRIORITY_BULK', 3)
+DOWNLOAD_RETRY_BASE = getattr(settings, 'API_DOWNLOAD_RETRY_BASE', 60)
+DOWNLOAD_RETRY_CAP = getattr(settings, 'API_DOWNLOAD_RETRY_CAP', 30 * 60)
+DOWNLOAD_RETRY_MIN_DELAY = getattr(settings, 'API_DOWNLOAD_RETRY_MIN_DELAY', 30)
+IMPORT_PENDING_TIMEOUT = getattr(settings, 'API_IMPORT_PENDING_TIMEOUT', 6 * 60 * 60)
+# Celery states of an import queued, running or waiting to be retried
+UNFINISHED_TASK_STATES = ('PENDING', 'STARTED', 'RETRY')
+# JHCsvNormalizer stages running while its stream is consumed
+NORMALIZE_STAGES = ('read', 'date_parsing', 'serialize')
+# Fields identifying a location row inside a daily report, only the ones given by file layout are used
+DELTA_KEY_FIELDS = ['country_region', 'province_state', 'admin2']
+NEWER_VERSION_DETAIL = 'A newer revision of {source_path} was already processed, file was not loaded.'
 
-@app.task(bind=True)
+REPORT_DAY_FORMATS = [
+    '%m-%d-%Y',
+]
+
+
+def get_report_day(file_name):
+    """
+    Util to get report day from a daily report file name (e.g. 03-21-2020.csv).
+    Args:
+        file_name: A str describing file name or path.
+
+    Returns:
+        A datetime.date object or None if name has not a known format.
+    """
+    name = os.path.basename(file_name).split('.')[0].split('_')[0]
+    for date_format in REPORT_DAY_FORMATS:
+        try:
+            return datetime.datetime.strptime(name, date_format).date()
+        except ValueError:
+            logging.debug(msg='File name: {name} no with format: {ft}'.format(
+                name=name,
+                ft=date_format,
+            ))
+    return None
+
+
+def describe_delta(delta, previous_ids):
+    """
+    Util to describe result of apply_data_file_delta on DataFile process detail.
+    Args:
+        delta: A dict given by api.loader.apply_data_file_delta.
+        previous_ids: A list of int describing DataFile ids of previous versions.
+
+    Returns:
+        A str describing changes.
+    """
+    if delta['mode'] == 'delta':
+        return (
+            '\nDelta against previous versions {ids}: inserted {inserted}, updated {updated}, '
+            'deleted {deleted}, unchanged {unchanged}.'
+        ).format(ids=previous_ids, **delta)
+    detail = '\nTotal inserted: {total}.'.format(total=delta['inserted'])
+    if delta['deleted']:
+        detail += '\nPrevious rows replaced: {total}.'.format(total=delta['deleted'])
+    return detail
+
+
+def load_revision(data_file, stream, columns):
+    """
+    Util to load a DataFile as a revision of its source file, applied as a row diff against rows of previous
+    versions. Loads of a same source_path are serialized by a transaction advisory lock, previous versions are
+    read inside it and DataFile is marked as processed on the same transaction, so concurrent revisions always
+    diff against committed rows.
+    Args:
+        data_file: A DataFile object.
+        stream: A binary file object giving normalized csv data.
+        columns: A list of str describing model field names on csv column order.
+
+    Returns:
+        A tuple (dict given by api.loader.apply_data_file_delta, list of previous DataFile ids).
+
+    Raises:
+        NewerVersionProcessed: If a newer revision was processed meanwhile.
+    """
+    with transaction.atomic():
+        lock_source(data_file.source_path)
+        if data_file.has_newer_version():
+            raise NewerVersionProcessed(NEWER_VERSION_DETAIL.format(source_path=data_file.source_path))
+        previous_ids = data_file.get_previous_version_ids()
+        delta = apply_data_file_delta(
+            model=GeneralData,
+            stream=stream,
+            columns=columns,
+            data_file_id=data_file.id,
+            previous_ids=previous_ids,
+            key_fields=[name for name in DELTA_KEY_FIELDS if name in columns],
+        )
+        DataFile.objects.filter(id=data_file.id).update(processed=True)
+    return delta, previous_ids
+
+
+@app.task(bind=True, max_retries=None)
 def file_data_importer(self, data_file_id):
     """
     Tasks to update covid information from file on DataFile instance to GeneralData Model.
+    Load waits on a COPY slot (API_MAX_CONCURRENT_COPY), task is retried later if every slot is taken.
     Args:
         self: A celery.Task object.
         data_file_id: A int describing DataFile instance id.
@@ -40,8 +167,15 @@ def file_data_importer(self, data_file_id):
     data_file.process_id = self.request.id
     data_file.save(update_fields=['process_id'])
     processed = False
+    if data_file.has_newer_version():
+        data_file.processed = processed
+        data_file.process_detail = NEWER_VERSION_DETAIL.format(source_path=data_file.source_path)
+        data_file.save(update_fields=['processed', 'process_detail'])
+        return False
+    timer = StageTimer()
     try:
-        df = clean_jh_csv_file(data_file_id=data_file_id)
+        with timer.stage('header'):
+            normalizer = clean_jh_csv_file(data_file_id=data_file_id)
     except HeaderNotIdentifier as err:
         data_file.processed = processed
         data_file.process_detail = 'Some column was not map with field, details: {error}.'.format(error=err)
@@ -53,56 +187,174 @@ def file_data_importer(self, data_file_id):
         data_file.save(update_fields=['processed', 'process_detail'])
         return False
 
-    data_file.header = {name: name for name in df.columns}
+    data_file.header = normalizer.field_mapping
     data_file.save(update_fields=['header'])
     process_detail = '[DETAILS]'
 
-    report_day_formats = [
-        '%m-%d-%Y',
-    ]
-    filename = os.path.basename(data_file.origin_file.path).split('.')[0].split('_')[0]
-    report_day = None
-    for date_format in report_day_formats:
-        try:
-            report_day = datetime.datetime.strptime(filename, date_format)
-            break
-        except ValueError:
-            logging.debug(msg='File name: {name} no with format: {ft}'.format(
-                name=filename,
-                ft=date_format,
-            ))
-
+    report_day = get_report_day(file_name=data_file.origin_file.name)
     if not report_day:
         process_detail += '\nFilename date was not parsed.'
+    static_columns = {
+        'report_day': report_day,
+        'data_file_id': data_file_id,
+    }
+    previous_ids = []
+    delta = None
     try:
-        total_inserted = GeneralData.objects.from_csv(
-            csv_path=data_file.origin_file.path,
-            delimiter=';',
-            static_mapping={
-                'report_day': report_day,
-                'data_file_id': data_file_id,
-            }
-        )
-    except IntegrityError as err:
+        with ExitStack() as stack:
+            with timer.stage('copy_slot_wait'):
+                stack.enter_context(copy_slot())
+            with timer.stage('load'):
+                delta, previous_ids = load_revision(
+                    data_file=data_file,
+                    stream=normalizer.as_stream(static_columns=static_columns),
+                    columns=normalizer.columns + list(static_columns.keys()),
+                )
+    except CopySlotUnavailable as err:
+        raise self.retry(exc=err, countdown=random.uniform(1, COPY_SLOT_RETRY_DELAY))
+    except NewerVersionProcessed as err:
+        processed = False
+        process_detail += '\n{error}'.format(error=err)
+    except DateFormatNotIdentifier as err:
+        processed = False
+        process_detail += '\nSome Date column format was not identify, details: {error}.'.format(error=err)
+    except (IntegrityError, DataError) as err:
         processed = False
         process_detail += '\nError doing bulk_insert, details\n: {details}.'.format(
             details=err
         )
     else:
         processed = True
-        process_detail += '\nTotal inserted: {total}.'.format(total=total_inserted)
+        process_detail += describe_delta(delta=delta, previous_ids=previous_ids)
+        remember_date_format(layout=normalizer.layout, date_format=normalizer.date_format)
 
+    if processed:
+        LatestReport.register_data_file(data_file_id=data_file_id, recompute=bool(delta['updated'] or delta['deleted']))
+        if delta['inserted'] + delta['updated'] + delta['deleted']:
+            if report_day:
+                with timer.stage('rollup'):
+                    CountryDailySummary.objects.refresh_days([report_day])
+            transaction.on_commit(bump_dataset_version)
+    stages = dict(normalizer.timer.timings, **timer.timings)
+    # Date detection runs while header is resolved and normalization while COPY consumes it
+    stages['header'] = max(timer.get('header') - normalizer.timer.get('date_detection'), 0.0)
+    stages['copy'] = max(timer.get('load') - sum(normalizer.timer.get(name) for name in NORMALIZE_STAGES), 0.0)
+    stages.pop('load', None)
     data_file.processed = processed
     data_file.process_detail = process_detail
-    data_file.save(update_fields=['processed', 'process_detail'])
+    data_file.process_stats = dict(data_file.process_stats or {}, **{
+        'import': build_import_stats(
+            stages=stages,
+            rows=normalizer.rows,
+            load_seconds=timer.get('load'),
+            delta=delta,
+        ),
+    })
+    data_file.save(update_fields=['processed', 'process_detail', 'process_stats'])
     return processed
 
 
-@app.task
-def file_data_downloader(file_server_data):
+def build_import_stats(stages, rows, load_seconds, delta=None):
+    """
+    Util to build stats of an import saved on DataFile.process_stats['import'].
+    Args:
+        stages: A dict describing seconds by stage.
+        rows: A int describing rows normalized.
+        load_seconds: A float describing seconds loading rows on database.
+        delta: A dict given by api.loader.apply_data_file_delta, None if load failed.
+
+    Returns:
+        A dict describing seconds by stage, rows and rows by second.
+    """
+    return {
+        'stages': {name: round(seconds, 6) for name, seconds in stages.items()},
+        'rows': rows,
+        'rows_per_second': round(rows / load_seconds, 2) if load_seconds else None,
+        'changes': delta['inserted'] + delta['updated'] + delta['deleted'] if delta else 0,
+    }
+
+
+def get_retry_countdown(retries):
+    """
+    Util to get seconds a failed download waits to be retried, exponential backoff with full jitter from
+    API_DOWNLOAD_RETRY_BASE up to API_DOWNLOAD_RETRY_CAP.
+    Args:
+        retries: A int describing task retries done.
+
+    Returns:
+        A float describing seconds, never less than API_DOWNLOAD_RETRY_MIN_DELAY.
+    """
+    backoff = random.uniform(0, min(DOWNLOAD_RETRY_CAP, DOWNLOAD_RETRY_BASE * (2 ** retries)))
+    return max(backoff, DOWNLOAD_RETRY_MIN_DELAY)
+
+
+def save_origin_file(data_file, chunks, file_server_data, stream_errors=()):
+    """
+    Util to stream a server file into DataFile storage checking it against github size and sha.
+    Args:
+        data_file: A DataFile object not saved yet.
+        chunks: A iterable of bytes with file content.
+        file_server_data: A dict describing server file data.
+        stream_errors: A tuple of exception classes chunks can raise while streaming (e.g. a dropped
+            connection), partially stored file is removed before error is raised.
+
+    Returns:
+        A bool indicating if content match signature, otherwise stored file is removed.
+    """
+    stream = HashingChunkStream(chunks=chunks, size=file_server_data['size'], stop_on=stream_errors)
+    content = File(stream, name=file_server_data['name'])
+    content.size = file_server_data['size']
+    data_file.origin_file.save(file_server_data['name'], content, save=False)
+    if stream.error is not None:
+        data_file.origin_file.delete(save=False)
+        raise stream.error
+    if stream.position != file_server_data['size'] or stream.git_sha.hexdigest() != file_server_data['sha']:
+        data_file.origin_file.delete(save=False)
+        return False
+    data_file.md5_checksum = stream.md5.hexdigest()
+    return True
+
+
+def enqueue_import(data_file_id, priority=TASK_PRIORITY_BULK):
+    """
+    Util to send a DataFile to import recording task id on process_id, so it is known as enqueued.
+    Args:
+        data_file_id: A int describing DataFile instance id.
+        priority: A int describing task priority.
+
+    Returns:
+        A celery.result.AsyncResult object.
+    """
+    result = file_data_importer.apply_async(kwargs={'data_file_id': data_file_id}, priority=priority)
+    DataFile.objects.filter(id=data_file_id).update(process_id=result.id, update_date=timezone.now())
+    return result
+
+
+def is_import_pending(process_id, update_date):
+    """
+    Util to know if an import task is queued, running or waiting to be retried. Unknown task ids are PENDING
+    too, so a lost task is considered pending only until API_IMPORT_PENDING_TIMEOUT since it was enqueued.
+    Args:
+        process_id: A str describing import task id.
+        update_date: A datetime.datetime object describing last DataFile update.
+
+    Returns:
+        A bool.
+    """
+    if not process_id:
+        return False
+    state = file_data_importer.AsyncResult(process_id).state
+    if state == 'PENDING':
+        return update_date > timezone.now() - datetime.timedelta(seconds=IMPORT_PENDING_TIMEOUT)
+    return state in UNFINISHED_TASK_STATES
+
+
+@app.task(bind=True, max_retries=5)
+def file_data_downloader(self, file_server_data):
     """
     Task to download covid.csv file from server and upload on database.
     Args:
+        self: A celery.Task object.
         file_server_data: A dict describing server file data (github api give the follow structure):
         {
             'name': '<string>',
@@ -124,7 +376,6 @@ def file_data_downloader(file_server_data):
     Returns:
         A bool indicating if file was imported or not.
     """
-    temp_path = os.path.join(tempfile.gettempdir(), file_server_data['name'])
     try:
         data_file = DataFile.objects.get(signature=file_server_data['sha'])
     except ObjectDoesNotExist:
@@ -134,27 +385,142 @@ def file_data_downloader(file_server_data):
             LOGGER.info(msg='Already file found not processed')
             return False
         else:
-            file_data_importer.delay(data_file_id=data_file.id)
+            enqueue_import(data_file_id=data_file.id)
             return True
 
-    api_response = github_api_request(request_kwargs={
-        'method': 'GET',
-        'url': file_server_data['download_url'],
-    })
-    with open(temp_path, 'wb') as file_:
-        file_.write(api_response.content)
     data_file = DataFile(
         signature=file_server_data['sha'],
+        source_path=file_server_data['path'],
     )
-    data_file.origin_file.save(file_server_data['name'], ContentFile(open(temp_path, 'rb').read()), save=True)
-    file_data_importer.delay(data_file_id=data_file.id)
+    verified = False
+    timer = StageTimer()
+    mirror = get_mirror()
+    mirror_path = mirror.get(file_server_data['sha']) if mirror else None
+    if mirror_path:
+        LOGGER.info(msg='File taken from mirror => {github_path}'.format(github_path=file_server_data['path']))
+        with timer.stage('mirror'), open(mirror_path, 'rb') as file_:
+            verified = save_origin_file(
+                data_file=data_file,
+                chunks=iter(lambda: file_.read(DOWNLOAD_CHUNK_SIZE), b''),
+                file_server_data=file_server_data,
+            )
+        if not verified:
+            LOGGER.warning(msg='Mirror file does not match signature => {path}'.format(path=mirror_path))
+            mirror.discard(file_server_data['sha'])
+
+    if not verified:
+        with timer.stage('github'):
+            try:
+                api_response = github_api_request(request_kwargs={
+                    'method': 'GET',
+                    'url': file_server_data['download_url'],
+                    'stream': True,
+                })
+            except RateLimitExceeded as err:
+                raise self.retry(exc=err, countdown=err.retry_after)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+                raise self.retry(exc=err, countdown=get_retry_countdown(self.request.retries))
+            try:
+                api_response.raise_for_status()
+            except requests.exceptions.HTTPError as err:
+                api_response.close()
+                if api_response.status_code < 500:
+                    raise
+                # Client already retried it, so it is retried later as connection errors
+                raise self.retry(exc=err, countdown=get_retry_countdown(self.request.retries))
+
+            # Response is streamed straight into storage and mirror, hashes are computed on the same pass
+            try:
+                with api_response, \
+                        (mirror.writer(file_server_data['sha']) if mirror else nullcontext()) as mirror_writer:
+                    chunks = api_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                    if mirror_writer is not None:
+                        chunks = tee_chunks(chunks=chunks, writer=mirror_writer)
+                    verified = save_origin_file(
+                        data_file=data_file,
+                        chunks=chunks,
+                        file_server_data=file_server_data,
+                        stream_errors=DOWNLOAD_STREAM_ERRORS,
+                    )
+                    if verified and mirror_writer is not None:
+                        mirror_writer.commit()
+            except DOWNLOAD_STREAM_ERRORS as err:
+                LOGGER.warning(msg='Download interrupted => {github_path}: {error}'.format(
+                    github_path=file_server_data['path'],
+                    error=err,
+                ))
+                raise self.retry(exc=err, countdown=get_retry_countdown(self.request.retries))
+
+    if not verified:
+        LOGGER.error(msg='Downloaded file does not match signature => {github_path}'.format(
+            github_path=file_server_data['path'],
+        ))
+        return False
+    source = 'github' if 'github' in timer.timings else 'mirror'
+    data_file.process_stats = {
+        'download': {
+            'source': source,
+            'seconds': round(timer.get(source), 6),
+            'bytes': file_server_data['size'],
+        },
+    }
+    try:
+        data_file.save()
+    except AlreadyProcessedFile:
+        LOGGER.info(msg='File already saved by another task => {github_path}'.format(
+            github_path=file_server_data['path'],
+        ))
+        data_file.origin_file.delete(save=False)
+        return False
+    enqueue_import(data_file_id=data_file.id)
     return True
 
 
-@app.task
-def covid_data_getter():
+def get_github_listing(repo_url):
+    """
+    Util to list a github repo path sending If-None-Match with last ETag, unchanged listings are read
+    from cache (304 responses does not count on github rate limit).
+    Args:
+        repo_url: A str describing github contents api url.
+
+    Returns:
+        A list of dicts describing server files.
+    """
+    cache = get_cache()
+    cache_key = GITHUB_LISTING_CACHE_KEY.format(url=repo_url)
+    cached = cache.get(cache_key)
+    headers = {}
+    if cached:
+        headers['If-None-Match'] = cached['etag']
+    api_response = github_api_request(request_kwargs={
+        'method': 'GET',
+        'url': repo_url,
+        'headers': headers,
+    })
+    if api_response.status_code == 304 and cached:
+        LOGGER.info(msg='Listing not modified => {url}'.format(url=repo_url))
+        return cached['files']
+    api_response.raise_for_status()
+    files = [
+        {key: file_.get(key) for key in GITHUB_LISTING_KEYS} for file_ in api_response.json()
+    ]
+    etag = api_response.headers.get('ETag')
+    if etag:
+        cache.set(cache_key, {'etag': etag, 'files': files}, timeout=None)
+    return files
+
+
+@app.task(bind=True, max_retries=3)
+def covid_data_getter(self):
     """
     Tasks to Getting Covid daily information from https://github.com/CSSEGISandData/COVID-19 thanks.
+    Only new files are sent to download and already downloaded files never imported are sent to import
+    unless its import is still queued, running or retrying (e.g. only when its import task was lost), files
+    whose import failed keep its details until they are sent again from admin. All listed files are checked
+    against DataFile on a single query.
+    Args:
+        self: A celery.Task object.
+
     Returns:
         A int describing number of files detected.
     """
@@ -164,21 +530,38 @@ def covid_data_getter():
         '/csse_covid_19_data/csse_covid_19_daily_reports/',
     ]
     files = []
-    for repo_path in data_source_repo_path:
-        repo_url = github_base + repo_path
-        api_response = github_api_request(request_kwargs={
-            'method': 'GET',
-            'url': repo_url,
-        })
-        files.extend(api_response.json())
-    good_files = 0
-    for file_ in files:
-        extension = file_['name'].split('.')[-1]
-        if extension == 'csv' and file_['type'] == 'file':
-            file_data_downloader.apply_async(
-                kwargs={
-                    'file_server_data': file_,
-                }
-            )
-            good_files += 1
-    return good_files
+    try:
+        for repo_path in data_source_repo_path:
+            files.extend(get_github_listing(repo_url=github_base + repo_path))
+    except RateLimitExceeded as err:
+        raise self.retry(exc=err, countdown=err.retry_after)
+
+    csv_files = {
+        file_['sha']: file_ for file_ in files
+        if file_['name'].split('.')[-1] == 'csv' and file_['type'] == 'file'
+    }
+    known_files = DataFile.objects.filter(
+        signature__in=list(csv_files.keys()),
+    ).values_list('signature', 'id', 'processed', 'process_detail', 'process_id', 'update_date')
+    known_signatures = set()
+    for signature, data_file_id, processed, process_detail, process_id, update_date in known_files:
+        known_signatures.add(signature)
+        if not processed and not process_detail and not is_import_pending(process_id, update_date):
+            enqueue_import(data_file_id=data_file_id)
+
+    new_files = 0
+    for signature, file_ in csv_files.items():
+        if signature in known_signatures:
+            continue
+        file_data_downloader.apply_async(
+            kwargs={
+                'file_server_data': file_,
+            },
+            priority=TASK_PRIORITY_BULK,
+        )
+        new_files += 1
+    LOGGER.info(msg='Files detected: {total}, sent to download: {new}.'.format(
+        total=len(csv_files),
+        new=new_files,
+    ))
+    return len(csv_files)
@@ -1,4 +1,1559 @@
+import io
+import os
+import asyncio
+import csv
+import gzip
+import time
+import hashlib
+import datetime
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from asgiref.sync import async_to_sync
+
+from django.core.files.base import File
+from django.core.management import call_command
+from django.db import DataError
+from django.db import connection
+from django.db import transaction
+from django.http import HttpResponse
 from django.test import TestCase
+from django.test import RequestFactory
+from django.test import TransactionTestCase
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from django.urls import reverse
+from django.utils import timezone
+
+from api import async_views
+from api import header_registry
+from api.cache import get_cache
+from api.cache import build_versioned_key
+from api.cache import bump_dataset_version
+from api.exceptions import CopySlotUnavailable
+from api.export import stream_queryset_csv
+from api.exceptions import HeaderNotIdentifier
+from api.exceptions import NewerVersionProcessed
+from api.exceptions import RateLimitExceeded
+from api.header_registry import get_header_layout
+from api.header_registry import header_fingerprint
+from api.header_registry import remember_date_format
+from api.http_client import HttpClient
+from api.loadtest import LoadResult
+from api.loadtest import check_thresholds
+from api.loadtest import parse_threshold
+from api.loadtest import run_load
+from api.loader import apply_data_file_delta
+from api.loader import copy_slot
+from api.loader import get_backfill_copy_slots
+from api.mirror import FileMirror
+from api.loader import replace_data_file_rows
+from api.metrics import REQUEST_METRICS
+from api.metrics import REQUEST_QUERY_COUNTER
+from api.middleware import PROFILE_SAMPLER
+from api.middleware import QueryCounter
+from api.middleware import RequestProfilingMiddleware
+from api.pagination import KeysetPagination
+from api import renderers
+from api.renderers import FastJSONRenderer
+from api.models import DataFile
+from api.models import CountryDailySummary
+from api.models import GeneralData
+from api.models import LatestReport
+from api.models import HeaderLayout
+from api.tasks import get_report_day
+from api.tasks import file_data_importer
+from api.tasks import get_retry_countdown
+from api.tasks import load_revision
+from api.tasks import file_data_downloader
+from api.tasks import covid_data_getter
+from api.tasks import get_github_listing
+from api.synthetic import write_dataset
+from api.serializers import GeneralDataSerializer
+from api.serializers import GENERAL_DATA_VALUES_SERIALIZER
+from api.timeseries import build_timeseries
+from api.utils import ChunkStream
+from api.utils import HashingChunkStream
+from api.utils import JHCsvNormalizer
+from api.utils import read_csv_header
+from api.utils import clean_jh_csv_file
+from api.utils import csv_header2model_field_mapper
+
+
+def explain_uses_seq_scan(queryset, table='api_generaldata'):
+    """
+    Util to check if postgres would scan whole table to resolve a queryset.
+    Sequential scans are disabled on planner, so they only appear when there is not usable index.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    plan = queryset.explain()
+    return 'Seq Scan on {table}'.format(table=table) in plan
+
+
+class LastUpdateLookupTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.last_day = datetime.date(2020, 3, 22)
+        rows = []
+        for day_delta in range(3):
+            day = cls.last_day - datetime.timedelta(days=day_delta)
+            last_update = timezone.make_aware(datetime.datetime.combine(day, datetime.time(23, 30)))
+            for country in ('Colombia', 'Italy', 'Spain'):
+                rows.append(GeneralData(
+                    country_region=country,
+                    last_update=last_update,
+                    report_day=day,
+                    data_file_id=day_delta,
+                ))
+        GeneralData.objects.bulk_create(rows)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_last_update_on_is_half_open_range(self):
+        queryset = GeneralData.objects.last_update_on(self.last_day)
+        self.assertEqual(queryset.count(), 3)
+        self.assertTrue(all(timezone.localdate(row.last_update) == self.last_day for row in queryset))
+
+    def test_register_only_moves_pointer_forward(self):
+        newest = GeneralData.objects.filter(data_file_id=0).first().last_update
+        LatestReport.register_data_file(data_file_id=0)
+        LatestReport.register_data_file(data_file_id=2)
+        self.assertEqual(LatestReport.get_last_update(), newest)
+
+    def test_recompute_moves_pointer_backward(self):
+        LatestReport.register_data_file(data_file_id=0)
+        GeneralData.objects.filter(data_file_id=0).delete()
+        LatestReport.register_data_file(data_file_id=1, recompute=True)
+        self.assertEqual(
+            LatestReport.get_last_update(),
+            GeneralData.objects.filter(data_file_id=1).first().last_update,
+        )
+        self.assertEqual(LatestReport.objects.get().data_file_id, 1)
+        GeneralData.objects.all().delete()
+        LatestReport.refresh()
+        self.assertFalse(LatestReport.objects.exists())
+
+    def test_last_endpoint_reads_pointer(self):
+        LatestReport.register_data_file(data_file_id=0)
+        # One query reading pointer and one query reading rows of the day
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api:generaldata-last'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['date'], str(self.last_day))
+        self.assertEqual(len(response.json()['data']), 3)
+
+    def test_last_endpoint_without_data(self):
+        GeneralData.objects.all().delete()
+        response = self.client.get(reverse('api:generaldata-last'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_day_lookup_does_not_scan_table(self):
+        self.assertFalse(explain_uses_seq_scan(GeneralData.objects.last_update_on(self.last_day)))
+
+
+class QueryPlanTestCase(TestCase):
+    """ Regression suite checking every endpoint query can be resolved through an index """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.report_day = datetime.date(2020, 4, 1)
+        rows = []
+        for day_delta in range(10):
+            day = cls.report_day - datetime.timedelta(days=day_delta)
+            last_update = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+            for country in ('Colombia', 'Italy', 'Spain', 'US'):
+                for province in ('North', 'South', None):
+                    rows.append(GeneralData(
+                        country_region=country,
+                        province_state=province,
+                        last_update=last_update,
+                        report_day=day,
+                        confirmed=day_delta,
+                        data_file_id=day_delta,
+                    ))
+        GeneralData.objects.bulk_create(rows)
+        CountryDailySummary.objects.refresh_days(GeneralData.objects.values_list('report_day', flat=True).distinct())
+        LatestReport.register_data_file(data_file_id=0)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_generaldata')
+            cursor.execute('ANALYZE api_countrydailysummary')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def assertIndexScan(self, queryset):
+        self.assertFalse(explain_uses_seq_scan(queryset), msg=queryset.explain())
+
+    def assertEndpointIndexScan(self, name, params=None, table='api_generaldata'):
+        """ Assert every query run by an endpoint on table (pagination, filters, values() reads) uses an index """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200, msg=response.content)
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and '"{table}"'.format(table=table) in query['sql']
+        ]
+        self.assertTrue(statements, msg='{name} does not read {table}'.format(name=name, table=table))
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for sql in statements:
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                self.assertNotIn('Seq Scan on {table}'.format(table=table), plan, msg='{0}\n{1}'.format(sql, plan))
+
+    def test_list_first_page(self):
+        self.assertEndpointIndexScan('api:generaldata-list')
+        self.assertEndpointIndexScan('api:generaldata-list', {'fields': 'country_region,confirmed'})
+
+    def test_list_cursor_page(self):
+        last_update = timezone.make_aware(datetime.datetime.combine(self.report_day, datetime.time(12)))
+        queryset = KeysetPagination().seek(
+            GeneralData.objects.order_by('last_update', 'id'),
+            position=(last_update, 10),
+            lookup='gt',
+        )[:501]
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        lines = [line.strip() for line in plan.splitlines()]
+        # Seek must be a range of the index, a full index scan filtering rows does not count
+        self.assertTrue(
+            any(line.startswith('Index Cond:') and 'last_update' in line for line in lines),
+            msg=plan,
+        )
+        self.assertFalse(any(line.startswith('Filter:') and 'last_update' in line for line in lines), msg=plan)
+
+    def test_list_filters(self):
+        for params in (
+            {'report_day': str(self.report_day)},
+            {'country_region': 'Italy'},
+            {'province_state': 'North'},
+            {'country_region': 'Italy', 'province_state': 'North', 'report_day': str(self.report_day)},
+        ):
+            with self.subTest(params=params):
+                self.assertEndpointIndexScan('api:generaldata-list', params)
+
+    def test_today_and_last(self):
+        self.assertIndexScan(GeneralData.objects.last_update_on(self.report_day).order_by('last_update', 'id'))
+        self.assertEndpointIndexScan('api:generaldata-last')
+
+    def test_timeseries(self):
+        self.assertEndpointIndexScan(
+            'api:generaldata-timeseries',
+            {'country_region': 'Italy', 'province_state': 'North'},
+        )
+        self.assertEndpointIndexScan(
+            'api:generaldata-timeseries',
+            {'country_region': 'Italy'},
+            table='api_countrydailysummary',
+        )
+
+    def test_summary_list_and_totals(self):
+        for name in ('api:countrydailysummary-list', 'api:countrydailysummary-totals'):
+            for params in ({}, {'country_region': 'Italy'}, {'report_day': str(self.report_day)}):
+                with self.subTest(name=name, params=params):
+                    self.assertEndpointIndexScan(name, params, table='api_countrydailysummary')
+
+    def test_csv_export_filters(self):
+        queryset = GeneralData.objects.filter(
+            report_day__gte=self.report_day - datetime.timedelta(days=3),
+            report_day__lte=self.report_day,
+            country_region='Spain',
+        )
+        self.assertIndexScan(queryset)
+
+    def test_data_file_rows(self):
+        self.assertIndexScan(GeneralData.objects.filter(data_file_id=3))
+
+
+class BuildTimeseriesTestCase(SimpleTestCase):
+
+    def test_derived_series(self):
+        start = datetime.date(2020, 3, 1)
+        # Confirmed doubles every 7 days, 2020-03-05 is missing and must keep previous value
+        rows = [
+            (start + datetime.timedelta(days=day), 2 ** (day / 7), day, None)
+            for day in range(15) if day != 4
+        ]
+        data = build_timeseries(rows)
+        self.assertEqual(len(data['dates']), 15)
+        self.assertEqual(data['dates'][4], '2020-03-05')
+        self.assertEqual(data['confirmed']['cumulative'][4], data['confirmed']['cumulative'][3])
+        self.assertIsNone(data['confirmed']['daily'][0])
+        self.assertEqual(data['deaths']['daily'][1:4], [1.0, 1.0, 1.0])
+        self.assertEqual(data['confirmed']['doubling_days'][14], 7.0)
+        # Growth from zero has not doubling time
+        self.assertIsNone(data['deaths']['doubling_days'][7])
+        self.assertTrue(all(value is None for value in data['recovered']['rolling_7d']))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Handler answering scripted responses, each item is a tuple (status, headers) """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        status, headers = self.server.responses.pop(0)
+        self.server.client_ports.add(self.client_address[1])
+        body = b'{}'
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.responses = []
+        self.server.client_ports = set()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{port}/'.format(port=self.server.server_address[1])
+        self.client = HttpClient(max_retries=3, backoff_base=0.001, backoff_cap=0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_server_errors_reusing_connection(self):
+        self.server.responses = [(503, {}), (502, {}), (200, {})]
+        response = self.client.request('GET', self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.responses, [])
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_return_last_server_error(self):
+        self.server.responses = [(500, {}), (500, {}), (500, {})]
+        self.assertEqual(self.client.request('GET', self.url).status_code, 500)
+
+    def test_github_rate_limit(self):
+        reset = int(time.time()) + 120
+        self.server.responses = [(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(reset)})]
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.client.request('GET', self.url)
+        self.assertTrue(100 < context.exception.retry_after <= 120)
+
+    def test_retry_after_header(self):
+        self.server.responses = [(429, {'Retry-After': '30'})]
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.client.request('GET', self.url)
+        self.assertEqual(context.exception.retry_after, 30)
+
+    def test_forbidden_without_rate_limit(self):
+        self.server.responses = [(403, {'X-RateLimit-Remaining': '10'})]
+        self.assertEqual(self.client.request('GET', self.url).status_code, 403)
+
+
+class HashingChunkStreamTestCase(SimpleTestCase):
+
+    def test_git_blob_sha_and_md5(self):
+        stream = HashingChunkStream(chunks=[b'hel', b'lo\n'], size=6)
+        self.assertEqual(stream.read(), b'hello\n')
+        # Same value of git hash-object
+        self.assertEqual(stream.git_sha.hexdigest(), 'ce013625030ba8dba906f756967f9e9ca394464a')
+        self.assertEqual(stream.md5.hexdigest(), 'b1946ac92492d2347c6235b4d2611184')
+        self.assertEqual(stream.position, 6)
+
+    def test_stop_on_errors_end_stream(self):
+        def chunks():
+            yield b'hel'
+            raise requests.exceptions.ChunkedEncodingError('dropped')
+
+        stream = HashingChunkStream(chunks=chunks(), size=6, stop_on=(requests.exceptions.ConnectionError,))
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            stream.read()
+        stream = HashingChunkStream(chunks=chunks(), size=6, stop_on=(requests.exceptions.ChunkedEncodingError,))
+        self.assertEqual(stream.read(), b'hel')
+        self.assertIsInstance(stream.error, requests.exceptions.ChunkedEncodingError)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """ Handler answering server body with chunked encoding, connection is dropped after cut bytes if set """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if self.server.cut is not None:
+            self.wfile.write(b'%x\r\n%s' % (len(body), body[:self.server.cut]))
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadInterrupted(Exception):
+    pass
+
+
+class FileDataDownloaderTestCase(TestCase):
+    body = b'Province/State,Country/Region,Last Update,Confirmed\n,Italy,2020-03-21 10:00:00,10\n'
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.body = self.body
+        self.server.cut = None
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name, API_MIRROR_ROOT=None)
+        self.settings_override.enable()
+        self.importer = mock.patch.object(file_data_importer, 'apply_async', return_value=mock.Mock(id='import-task'))
+        self.importer.start()
+
+    def tearDown(self):
+        self.importer.stop()
+        self.settings_override.disable()
+        self.media.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_file_server_data(self, sha):
+        return {
+            'name': '03-21-2020.csv',
+            'path': 'csse_covid_19_daily_reports/03-21-2020.csv',
+            'sha': sha,
+            'size': len(self.body),
+            'download_url': 'http://127.0.0.1:{port}/03-21-2020.csv'.format(port=self.server.server_address[1]),
+        }
+
+    def stored_files(self):
+        return [name for _, _, files in os.walk(self.media.name) for name in files]
+
+    def test_verified_download_is_saved(self):
+        sha = hashlib.sha1(b'blob %d\0' % len(self.body) + self.body).hexdigest()
+        self.assertTrue(file_data_downloader(self.get_file_server_data(sha)))
+        data_file = DataFile.objects.get(signature=sha)
+        self.assertEqual(data_file.md5_checksum, hashlib.md5(self.body).hexdigest())
+        self.assertEqual(data_file.process_id, 'import-task')
+        with data_file.origin_file.open('rb') as file_:
+            self.assertEqual(file_.read(), self.body)
+        file_data_importer.apply_async.assert_called_once()
+
+    def test_sha_mismatch_is_discarded(self):
+        self.assertFalse(file_data_downloader(self.get_file_server_data('0' * 40)))
+        self.assertFalse(DataFile.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_server_error_is_retried(self):
+        response = mock.Mock(status_code=503)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError('503 Server Error', response=response)
+        with mock.patch('api.tasks.github_api_request', return_value=response), \
+                mock.patch('api.tasks.random.uniform', return_value=0.0), \
+                mock.patch.object(file_data_downloader, 'retry', return_value=DownloadInterrupted()) as retry:
+            with self.assertRaises(DownloadInterrupted):
+                file_data_downloader(self.get_file_server_data('0' * 40))
+            # Full jitter backoff can be 0, countdown keeps a minimum
+            self.assertEqual(retry.call_args[1]['countdown'], 30)
+            response.status_code = 404
+            with self.assertRaises(requests.exceptions.HTTPError):
+                file_data_downloader(self.get_file_server_data('0' * 40))
+        self.assertEqual(retry.call_count, 1)
+
+    def test_retry_countdown_is_capped(self):
+        with mock.patch('api.tasks.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual(get_retry_countdown(1), 120)
+            self.assertEqual(get_retry_countdown(10), 30 * 60)
+
+    def test_interrupted_download_is_retried(self):
+        self.server.cut = 10
+        with mock.patch.object(file_data_downloader, 'retry', return_value=DownloadInterrupted()) as retry:
+            with self.assertRaises(DownloadInterrupted):
+                file_data_downloader(self.get_file_server_data('0' * 40))
+        self.assertIsInstance(retry.call_args[1]['exc'], requests.exceptions.ChunkedEncodingError)
+        self.assertFalse(DataFile.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class CovidDataGetterTestCase(TestCase):
+    repo_url = 'https://api.github.com/repos/CSSEGISandData/COVID-19/contents/test/'
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_unchanged_listing_is_read_from_cache(self):
+        listing = [{'name': '03-21-2020.csv', 'path': 'a/03-21-2020.csv', 'sha': 'a' * 40, 'size': 10,
+                    'download_url': 'https://example.com/03-21-2020.csv', 'type': 'file', 'url': 'x'}]
+        first = mock.Mock(status_code=200, headers={'ETag': '"v1"'})
+        first.json.return_value = listing
+        with mock.patch('api.tasks.github_api_request', side_effect=[first, mock.Mock(status_code=304)]) as request:
+            files = get_github_listing(self.repo_url)
+            self.assertEqual(get_github_listing(self.repo_url), files)
+        self.assertNotIn('url', files[0])
+        self.assertEqual(request.call_args_list[0][1]['request_kwargs']['headers'], {})
+        self.assertEqual(request.call_args_list[1][1]['request_kwargs']['headers'], {'If-None-Match': '"v1"'})
+
+    def test_known_files_are_checked_on_one_query(self):
+        def server_file(name, sha, type_='file'):
+            return {'name': name, 'path': 'a/' + name, 'sha': sha, 'size': 10, 'download_url': None, 'type': type_}
+
+        files = [
+            server_file('03-21-2020.csv', 'a' * 40),
+            server_file('03-22-2020.csv', 'b' * 40),
+            server_file('03-23-2020.csv', 'c' * 40),
+            server_file('03-24-2020.csv', 'd' * 40),
+            server_file('README.md', 'e' * 40),
+            server_file('old', 'f' * 40, type_='dir'),
+        ]
+        DataFile.objects.create(origin_file='covid_data/03-21-2020.csv', signature='a' * 40, processed=True)
+        DataFile.objects.create(origin_file='covid_data/03-23-2020.csv', signature='c' * 40, process_detail='Failed')
+        pending = DataFile.objects.create(origin_file='covid_data/03-24-2020.csv', signature='d' * 40)
+        with mock.patch('api.tasks.get_github_listing', return_value=files), \
+                mock.patch.object(file_data_importer, 'apply_async', return_value=mock.Mock(id='a')) as importer, \
+                mock.patch.object(file_data_downloader, 'apply_async') as downloader, \
+                self.assertNumQueries(2):
+            # Listed files are checked on one query, second one marks the import sent
+            self.assertEqual(covid_data_getter(), 4)
+        # Failed files are not retried on every run, only never imported ones
+        importer.assert_called_once_with(kwargs={'data_file_id': pending.id}, priority=mock.ANY)
+        downloader.assert_called_once_with(kwargs={'file_server_data': files[1]}, priority=mock.ANY)
+        self.assertEqual(DataFile.objects.get(id=pending.id).process_id, 'a')
+
+    def test_unfinished_imports_are_not_sent_again(self):
+        files = [
+            {'name': name, 'path': 'a/' + name, 'sha': sha * 40, 'size': 10, 'download_url': None, 'type': 'file'}
+            for name, sha in (('03-21-2020.csv', 'a'), ('03-22-2020.csv', 'b'), ('03-23-2020.csv', 'c'))
+        ]
+        states = {'queued': 'PENDING', 'retrying': 'RETRY', 'lost': 'PENDING'}
+        for file_, process_id in zip(files, states):
+            DataFile.objects.create(origin_file='covid_data/' + file_['name'], signature=file_['sha'],
+                                    process_id=process_id)
+        lost = DataFile.objects.get(process_id='lost')
+        DataFile.objects.filter(id=lost.id).update(update_date=timezone.now() - datetime.timedelta(days=1))
+
+        def get_result(task_id):
+            return mock.Mock(state=states[task_id])
+
+        with mock.patch('api.tasks.get_github_listing', return_value=files), \
+                mock.patch.object(file_data_importer, 'AsyncResult', side_effect=get_result), \
+                mock.patch.object(file_data_importer, 'apply_async', return_value=mock.Mock(id='a')) as importer:
+            covid_data_getter()
+        # Unknown task ids are PENDING too, lost ones are sent again after API_IMPORT_PENDING_TIMEOUT
+        importer.assert_called_once_with(kwargs={'data_file_id': lost.id}, priority=mock.ANY)
+        self.assertEqual(DataFile.objects.get(id=lost.id).process_id, 'a')
+
+
+class JHCsvNormalizerTestCase(SimpleTestCase):
+
+    def write_csv(self, content):
+        file_ = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+        file_.write(content.encode('utf-8'))
+        file_.close()
+        self.addCleanup(os.remove, file_.name)
+        return file_.name
+
+    def get_normalizer(self, path, chunk_size=2):
+        with open(path, 'rb') as file_:
+            header, delimiter = read_csv_header(file_)
+        return JHCsvNormalizer(
+            source=path,
+            field_mapping=csv_header2model_field_mapper(csv_header=header),
+            delimiter=delimiter,
+            chunk_size=chunk_size,
+        )
+
+    def test_early_layout(self):
+        path = self.write_csv(
+            '﻿Province/State,Country/Region,Last Update,Confirmed,Deaths,Recovered\n'
+            'Anhui,Mainland China,1/22/2020 17:00,1,,\n'
+            ',Japan,1/22/2020 17:00,2,0,0\n'
+            '"Washington, DC",US,1/22/2020 17:00,3,1,\n'
+        )
+        normalizer = self.get_normalizer(path)
+        self.assertEqual(normalizer.date_format, '%m/%d/%Y %H:%M')
+        rows = list(csv.reader(io.TextIOWrapper(normalizer.as_stream({'data_file_id': 1}), encoding='utf-8')))
+        self.assertEqual(rows[0], normalizer.columns + ['data_file_id'])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[3][:3], ['Washington, DC', 'US', '2020-01-22 17:00:00'])
+
+    def test_late_layout_ignore_extra_columns(self):
+        path = self.write_csv(
+            'FIPS,Admin2,Province_State,Country_Region,Last_Update,Lat,Long_,Confirmed,Deaths,Recovered,Active\n'
+            '45001,Abbeville,South Carolina,US,2020-12-01 05:26:27,34.22,-82.46,1234,20,0,1214\n'
+        )
+        normalizer = self.get_normalizer(path)
+        self.assertNotIn('FIPS', normalizer.field_mapping)
+        self.assertEqual(normalizer.field_mapping['Admin2'], 'admin2')
+        self.assertIn('latitude', normalizer.columns)
+
+    def test_date_format_changing_between_chunks(self):
+        path = self.write_csv(
+            'Country/Region,Last Update\n'
+            'Italy,3/1/20 10:00\n'
+            'Spain,3/1/20 10:00\n'
+            'Italy,2020-03-02T10:00:00\n'
+        )
+        with mock.patch('api.utils.DATE_SNIFF_SAMPLE_SIZE', 2):
+            chunks = list(self.get_normalizer(path).iter_chunks())
+        self.assertEqual(chunks[1]['last_update'].iloc[0], datetime.datetime(2020, 3, 2, 10))
+
+    def test_missing_required_columns(self):
+        path = self.write_csv('Province/State,Confirmed\nAnhui,1\n')
+        with self.assertRaises(HeaderNotIdentifier):
+            self.get_normalizer(path)
+
+
+class HeaderRegistryTestCase(TestCase):
+
+    def setUp(self):
+        header_registry._LAYOUT_CACHE.clear()
+
+    def test_fingerprint_ignores_spaces_and_case(self):
+        self.assertEqual(
+            header_fingerprint(['Province/State', 'Country/Region', 'Last Update']),
+            header_fingerprint([' province/state', 'COUNTRY/REGION', 'Last Update\n']),
+        )
+
+    def test_layout_registered_once(self):
+        header = ['Province_State', 'Country_Region', 'Last_Update', 'FIPS']
+        layout = get_header_layout(csv_header=header)
+        self.assertEqual(layout.field_mapping['Country_Region'], 'country_region')
+        self.assertIsNone(layout.field_mapping['FIPS'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_header_layout(csv_header=header).id, layout.id)
+        self.assertEqual(HeaderLayout.objects.count(), 1)
+
+    def test_layout_changed_by_other_process_is_read_after_ttl(self):
+        header = ['Country/Region', 'Last Update', 'Cases']
+        get_header_layout(csv_header=header)
+        # Saved by another process, this one does not receive the signal
+        HeaderLayout.objects.filter(fingerprint=header_fingerprint(header)).update(
+            field_mapping={'Country/Region': 'country_region', 'Last Update': 'last_update', 'Cases': 'confirmed'},
+        )
+        self.assertIsNone(get_header_layout(csv_header=header).field_mapping['Cases'])
+        with mock.patch('api.header_registry.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(get_header_layout(csv_header=header).field_mapping['Cases'], 'confirmed')
+
+    def test_changed_layout_is_used(self):
+        layout = get_header_layout(csv_header=['Country/Region', 'Last Update'])
+        remember_date_format(layout=layout, date_format='%m/%d/%Y %H:%M')
+        self.assertEqual(
+            get_header_layout(csv_header=['Country/Region', 'Last Update']).date_format,
+            '%m/%d/%Y %H:%M',
+        )
+
+    def test_layout_mapping_has_priority_over_data_file_header(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, '03-21-2020.csv'), 'w') as file_:
+            file_.write('Country/Region,Last Update,Cases\nItaly,2020-03-21 10:00:00,1\n')
+        data_file = DataFile.objects.create(
+            origin_file='03-21-2020.csv',
+            signature='a' * 40,
+            header={'Country/Region': 'country_region', 'Last Update': 'last_update', 'Cases': None},
+        )
+        layout = get_header_layout(csv_header=['Country/Region', 'Last Update', 'Cases'])
+        # Mapping fixed on admin after a first import
+        layout.field_mapping['Cases'] = 'confirmed'
+        layout.save()
+        with self.settings(MEDIA_ROOT=directory.name, API_MIRROR_ROOT=None):
+            normalizer = clean_jh_csv_file(data_file_id=data_file.id)
+        self.assertEqual(normalizer.field_mapping['Cases'], 'confirmed')
+
+
+class ReplaceDataFileRowsTestCase(TestCase):
+    columns = ['country_region', 'last_update', 'confirmed', 'data_file_id']
+
+    def load(self, rows, data_file_id=1):
+        content = 'country_region,last_update,confirmed,data_file_id\n' + ''.join(
+            '{0},2020-03-01 10:00:00,{1},{2}\n'.format(country, confirmed, data_file_id) for country, confirmed in rows
+        )
+        return replace_data_file_rows(
+            model=GeneralData,
+            stream=ChunkStream([content.encode('utf-8')]),
+            columns=self.columns,
+            data_file_ids=[data_file_id],
+        )
+
+    def test_reimport_replace_rows(self):
+        self.assertEqual(self.load([('Italy', 1), ('Spain', 2)]), (2, 0))
+        self.load([('Peru', 5)], data_file_id=2)
+        self.assertEqual(self.load([('Italy', 3), ('Spain', 4)]), (2, 2))
+        self.assertEqual(
+            list(GeneralData.objects.filter(data_file_id=1).order_by('country_region').values_list('confirmed', flat=True)),
+            [3, 4],
+        )
+        self.assertEqual(GeneralData.objects.filter(data_file_id=2).count(), 1)
+
+    def test_failed_load_keep_previous_rows(self):
+        self.load([('Italy', 1)])
+        with self.assertRaises(DataError):
+            with transaction.atomic():
+                self.load([('Italy', 'not a number')])
+        self.assertEqual(GeneralData.objects.filter(data_file_id=1).count(), 1)
+
+
+class ApplyDataFileDeltaTestCase(TestCase):
+    columns = ['province_state', 'country_region', 'last_update', 'confirmed', 'data_file_id']
+
+    def load(self, rows, data_file_id, previous_ids):
+        content = 'province_state,country_region,last_update,confirmed,data_file_id\n' + ''.join(
+            '{0},{1},2020-03-01 10:00:00,{2},{3}\n'.format(province, country, confirmed, data_file_id)
+            for province, country, confirmed in rows
+        )
+        return apply_data_file_delta(
+            model=GeneralData,
+            stream=ChunkStream([content.encode('utf-8')]),
+            columns=self.columns,
+            data_file_id=data_file_id,
+            previous_ids=previous_ids,
+            key_fields=['country_region', 'province_state'],
+        )
+
+    def test_revision_apply_only_changes(self):
+        self.assertEqual(self.load([('', 'Italy', 1), ('', 'Spain', 2), ('Hubei', 'China', 3)], 1, [])['mode'], 'replace')
+        delta = self.load([('', 'Italy', 1), ('', 'Spain', 5), ('', 'Peru', 7)], 2, [1])
+        self.assertEqual(
+            delta,
+            {'mode': 'delta', 'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1},
+        )
+        self.assertEqual(
+            dict(GeneralData.objects.values_list('country_region', 'confirmed')),
+            {'Italy': 1, 'Spain': 5, 'Peru': 7},
+        )
+        # Unchanged rows keep their DataFile
+        self.assertEqual(GeneralData.objects.get(country_region='Italy').data_file_id, 1)
+        self.assertEqual(GeneralData.objects.get(country_region='Spain').data_file_id, 2)
+
+    def test_duplicated_keys_replace_rows(self):
+        self.load([('', 'Italy', 1)], 1, [])
+        delta = self.load([('', 'Italy', 1), ('', 'Italy', 2)], 2, [1])
+        self.assertEqual(delta['mode'], 'replace')
+        self.assertEqual(delta['deleted'], 1)
+        self.assertEqual(GeneralData.objects.filter(data_file_id=2).count(), 2)
+
+    def test_county_rows_are_matched_by_admin2(self):
+        content = 'admin2,province_state,country_region,last_update,confirmed,data_file_id\n' + ''.join(
+            '{0},South Carolina,US,2020-12-01 05:00:00,{1},{2}\n'.format(admin2, confirmed, data_file_id)
+            for admin2, confirmed, data_file_id in (('Abbeville', 1, 1), ('Aiken', 2, 1), ('', 3, 1))
+        )
+        revision = content.replace(',2,1\n', ',4,2\n').replace(',1,1\n', ',1,2\n').replace(',3,1\n', ',3,2\n')
+        for data_file_id, stream_content, previous_ids in ((1, content, []), (2, revision, [1])):
+            delta = apply_data_file_delta(
+                model=GeneralData,
+                stream=ChunkStream([stream_content.encode('utf-8')]),
+                columns=['admin2'] + self.columns,
+                data_file_id=data_file_id,
+                previous_ids=previous_ids,
+                key_fields=['country_region', 'province_state', 'admin2'],
+            )
+        self.assertEqual(delta, {'mode': 'delta', 'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 2})
+        self.assertEqual(GeneralData.objects.get(admin2='Aiken').confirmed, 4)
+
+
+class LoadRevisionTestCase(TransactionTestCase):
+    """ Revisions are loaded from threads with their own connections, so rows must be committed """
+    columns = ['province_state', 'country_region', 'last_update', 'confirmed', 'data_file_id']
+
+    def create(self, sha):
+        return DataFile.objects.create(
+            origin_file='covid_data/03-21-2020.csv',
+            signature=sha * 40,
+            source_path='csse_covid_19_daily_reports/03-21-2020.csv',
+        )
+
+    def load(self, data_file, confirmed):
+        content = 'province_state,country_region,last_update,confirmed,data_file_id\n' + ''.join(
+            ',{0},2020-03-21 10:00:00,{1},{2}\n'.format(country, confirmed, data_file.id)
+            for country in ('Italy', 'Spain', 'Peru')
+        )
+        return load_revision(data_file=data_file, stream=ChunkStream([content.encode('utf-8')]), columns=self.columns)
+
+    def test_concurrent_revisions_do_not_duplicate_rows(self):
+        self.load(self.create('a'), confirmed=1)
+        revisions = [self.create('b'), self.create('c')]
+        errors = []
+
+        def load(data_file, confirmed):
+            try:
+                self.load(data_file, confirmed)
+            except NewerVersionProcessed as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=load, args=(data_file, index + 2)) for index, data_file in enumerate(revisions)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(GeneralData.objects.count(), 3)
+        self.assertTrue(DataFile.objects.get(id=revisions[1].id).processed)
+        self.assertEqual(set(GeneralData.objects.values_list('confirmed', flat=True)), {3})
+        # Older revision was refused if it got lock after newer one
+        self.assertEqual(len(errors), 0 if DataFile.objects.get(id=revisions[0].id).processed else 1)
+
+
+class DataFileVersionTestCase(TestCase):
+
+    def create(self, sha, processed):
+        return DataFile.objects.create(
+            origin_file='covid_data/03-21-2020.csv',
+            signature=sha * 40,
+            source_path='csse_covid_19_daily_reports/03-21-2020.csv',
+            processed=processed,
+        )
+
+    def test_only_older_revisions_are_previous_versions(self):
+        first = self.create('a', processed=True)
+        second = self.create('b', processed=False)
+        third = self.create('c', processed=True)
+        self.assertEqual(second.get_previous_version_ids(), [first.id])
+        self.assertEqual(third.get_previous_version_ids(), [first.id])
+        self.assertTrue(second.has_newer_version())
+        self.assertFalse(third.has_newer_version())
+
+    def test_older_revision_is_not_loaded_after_newer_one(self):
+        self.create('a', processed=True)
+        older = self.create('b', processed=False)
+        self.create('c', processed=True)
+        self.assertFalse(file_data_importer.apply(kwargs={'data_file_id': older.id}).get())
+        older.refresh_from_db()
+        self.assertFalse(older.processed)
+        self.assertIn('A newer revision', older.process_detail)
+
+
+class CountryDailySummaryTestCase(TestCase):
+    first_day = datetime.date(2020, 3, 21)
+    second_day = datetime.date(2020, 3, 22)
+
+    def setUp(self):
+        get_cache().clear()
+        last_update = timezone.make_aware(datetime.datetime(2020, 3, 21, 10))
+        GeneralData.objects.bulk_create([
+            GeneralData(country_region=country, province_state=province, report_day=day, last_update=last_update,
+                        confirmed=confirmed, deaths=1, recovered=None, data_file_id=data_file_id)
+            for country, province, day, confirmed, data_file_id in [
+                ('China', 'Hubei', self.first_day, 10, 1),
+                ('China', 'Anhui', self.first_day, 5, 1),
+                ('Italy', '', self.first_day, 3, 1),
+                ('China', 'Hubei', self.second_day, 12, 2),
+                ('Italy', '', self.second_day, 4, 2),
+            ]
+        ])
+        CountryDailySummary.objects.refresh_days([self.first_day, self.second_day])
+
+    def assert_summary_match_rows(self):
+        expected = {}
+        expected_totals = {}
+        for row in GeneralData.objects.values('country_region', 'report_day', 'confirmed', 'deaths'):
+            day = row['report_day'].isoformat()
+            for values in (expected.setdefault((row['country_region'], day), [0, 0, 0]),
+                           expected_totals.setdefault(day, [0, 0, 0])):
+                values[0] += row['confirmed']
+                values[1] += row['deaths']
+                values[2] += 1
+        results = self.client.get(reverse('api:countrydailysummary-list')).json()['results']
+        self.assertEqual(
+            {(row['country_region'], row['report_day']): [row['confirmed'], row['deaths'], row['locations']]
+             for row in results},
+            expected,
+        )
+        totals = self.client.get(reverse('api:countrydailysummary-totals')).json()
+        self.assertEqual(
+            {row['report_day']: [row['confirmed'], row['deaths'], row['locations']] for row in totals},
+            expected_totals,
+        )
+
+    def test_rollup_match_rows(self):
+        self.assertEqual(CountryDailySummary.objects.count(), 4)
+        self.assert_summary_match_rows()
+        self.assertIsNone(CountryDailySummary.objects.get(country_region='Italy', report_day=self.first_day).recovered)
+
+    def test_only_refreshed_days_are_rebuilt(self):
+        untouched = set(CountryDailySummary.objects.filter(report_day=self.second_day).values_list('id', flat=True))
+        # A revision of first day: updated, deleted and inserted rows
+        GeneralData.objects.filter(province_state='Hubei', report_day=self.first_day).update(confirmed=20)
+        GeneralData.objects.filter(province_state='Anhui').delete()
+        GeneralData.objects.create(country_region='Peru', report_day=self.first_day, confirmed=7, deaths=0,
+                                   last_update=timezone.now(), data_file_id=3)
+        self.assertEqual(CountryDailySummary.objects.refresh_days([self.first_day, None]), 3)
+        self.assertEqual(
+            set(CountryDailySummary.objects.filter(report_day=self.second_day).values_list('id', flat=True)),
+            untouched,
+        )
+        china = CountryDailySummary.objects.get(country_region='China', report_day=self.first_day)
+        self.assertEqual((china.confirmed, china.locations), (20, 1))
+        self.assert_summary_match_rows()
+
+
+class GetReportDayTestCase(SimpleTestCase):
+
+    def test_report_day_from_file_name(self):
+        self.assertEqual(get_report_day('csse_covid_19_daily_reports/03-21-2020.csv'), datetime.date(2020, 3, 21))
+        # Names renamed by storage keep the day
+        self.assertEqual(get_report_day('covid_data/03-21-2020_x8Yq1Zb.csv'), datetime.date(2020, 3, 21))
+        self.assertIsNone(get_report_day('README.md'))
+
+
+class CsvExportTestCase(TransactionTestCase):
+    """ COPY runs on its own connection, so rows must be committed """
+
+    def setUp(self):
+        last_update = timezone.make_aware(datetime.datetime(2020, 3, 21, 10))
+        GeneralData.objects.bulk_create([
+            GeneralData(country_region=country, report_day=day, last_update=last_update, confirmed=confirmed)
+            for country, day, confirmed in [
+                ('Italy', datetime.date(2020, 3, 21), 1),
+                ('Spain', datetime.date(2020, 3, 21), 2),
+                ('Italy', datetime.date(2020, 3, 22), 3),
+            ]
+        ])
+
+    def read_csv(self, content):
+        return list(csv.reader(io.StringIO(content.decode('utf-8'))))
+
+    def test_header_and_rows(self):
+        queryset = GeneralData.objects.order_by('id')
+        content = b''.join(stream_queryset_csv(queryset, fields=['country_region', 'confirmed'], chunk_size=8))
+        self.assertEqual(
+            self.read_csv(content),
+            [['country_region', 'confirmed'], ['Italy', '1'], ['Spain', '2'], ['Italy', '3']],
+        )
+        compressed = b''.join(stream_queryset_csv(queryset, fields=['country_region', 'confirmed'], compress=True))
+        self.assertEqual(gzip.decompress(compressed), content)
+
+    def test_endpoint_filters(self):
+        response = self.client.get(reverse('api:generaldata-csv'), {
+            'country_region': 'Italy',
+            'report_day_after': '2020-03-22',
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = self.read_csv(b''.join(response.streaming_content))
+        self.assertEqual(rows[0], [field.attname for field in GeneralData._meta.concrete_fields])
+        self.assertEqual([row[rows[0].index('confirmed')] for row in rows[1:]], ['3'])
+        response = self.client.get(reverse('api:generaldata-csv'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz'))
+        self.assertEqual(len(self.read_csv(gzip.decompress(b''.join(response.streaming_content)))), 4)
+        response = self.client.get(reverse('api:generaldata-csv'), {'report_day_after': 'not a date'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_closed_export_stop_copy(self):
+        GeneralData.objects.bulk_create([
+            GeneralData(country_region='Country {0}'.format(index), last_update=timezone.now())
+            for index in range(5000)
+        ])
+        threads = set(threading.enumerate())
+        chunks = stream_queryset_csv(GeneralData.objects.order_by('id'), chunk_size=64)
+        next(chunks)
+        workers = set(threading.enumerate()) - threads
+        self.assertEqual(len(workers), 1)
+        # Client disconnection closes response generator
+        chunks.close()
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+
+class BackfillCommandTestCase(TransactionTestCase):
+    """ Backfill loads files through threads with their own connections, so rows must be committed """
+    row_fields = [field.name for field in GeneralData._meta.concrete_fields if field.name not in ('id', 'data_file_id')]
+    summary_fields = ['country_region', 'report_day', 'confirmed', 'deaths', 'recovered', 'locations']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name, API_MIRROR_ROOT=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.paths = write_dataset(directory=self.directory.name, days=3, rows=20)
+
+    def get_imported(self):
+        return (
+            sorted(GeneralData.objects.values_list(*self.row_fields), key=repr),
+            sorted(CountryDailySummary.objects.values_list(*self.summary_fields), key=repr),
+        )
+
+    def test_same_result_of_celery_importer(self):
+        call_command('backfill_covid_data', self.directory.name, workers=2, db_workers=2, stdout=io.StringIO())
+        self.assertEqual(DataFile.objects.filter(processed=True).count(), len(self.paths))
+        self.assertEqual(GeneralData.objects.count(), 3 * 20)
+        backfilled = self.get_imported()
+
+        for model in (GeneralData, CountryDailySummary, DataFile, LatestReport, HeaderLayout):
+            model.objects.all().delete()
+        for path in self.paths:
+            data_file = DataFile(source_path=os.path.relpath(path, self.directory.name))
+            with open(path, 'rb') as file_:
+                data_file.origin_file.save(os.path.basename(path), File(file_))
+            self.assertTrue(file_data_importer.apply(kwargs={'data_file_id': data_file.id}).get())
+        self.assertEqual(self.get_imported(), backfilled)
+
+
+class FileMirrorTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mirror = FileMirror(root=self.directory.name, max_size=10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, sha, content, commit=True):
+        with self.mirror.writer(sha) as writer:
+            writer.write(content)
+            if commit:
+                writer.commit()
+
+    def test_only_committed_files_are_published(self):
+        self.write('ab12', b'12345')
+        self.write('cd34', b'67890', commit=False)
+        with open(self.mirror.get('ab12'), 'rb') as file_:
+            self.assertEqual(file_.read(), b'12345')
+        self.assertIsNone(self.mirror.get('cd34'))
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['ab'])
+
+    def test_least_recently_used_files_are_evicted(self):
+        self.write('aa01', b'12345')
+        self.write('bb02', b'12345')
+        os.utime(self.mirror.get_path('aa01'), (1, 1))
+        os.utime(self.mirror.get_path('bb02'), (2, 2))
+        # A hit refresh file, so older bb02 is evicted
+        self.mirror.get('aa01')
+        self.write('cc03', b'12345')
+        self.assertIsNotNone(self.mirror.get('aa01'))
+        self.assertIsNone(self.mirror.get('bb02'))
+        self.assertIsNotNone(self.mirror.get('cc03'))
+
+    def test_directory_is_walked_only_over_max_size(self):
+        with mock.patch('api.mirror.os.walk', wraps=os.walk) as walk:
+            self.write('aa01', b'123')
+            self.write('bb02', b'123')
+            self.mirror.discard('aa01')
+            self.write('cc03', b'123')
+            self.assertEqual(walk.call_count, 1)
+            self.write('dd04', b'12345')
+            self.assertEqual(walk.call_count, 2)
+        self.assertIsNone(self.mirror.get('bb02'))
+        self.assertEqual(self.mirror._size, 8)
+
+
+class CopySlotTestCase(TestCase):
+
+    def test_cap_disabled(self):
+        with copy_slot(slots=0) as slot:
+            self.assertIsNone(slot)
+
+    def test_taken_slots_are_unavailable(self):
+        errors = []
+
+        def take_slot():
+            try:
+                with copy_slot(slots=1):
+                    pass
+            except CopySlotUnavailable as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        with copy_slot(slots=1) as slot:
+            self.assertEqual(slot, 0)
+            worker = threading.Thread(target=take_slot)
+            worker.start()
+            worker.join()
+        self.assertEqual(len(errors), 1)
+        # Slot is free again once released
+        with copy_slot(slots=1) as slot:
+            self.assertEqual(slot, 0)
+
+    def test_limited_callers_leave_last_slots(self):
+        results = []
+
+        def take_slots():
+            try:
+                try:
+                    with copy_slot(slots=2, limit=1):
+                        results.append('limited')
+                except CopySlotUnavailable:
+                    results.append('unavailable')
+                with copy_slot(slots=2) as slot:
+                    results.append(slot)
+            finally:
+                connection.close()
+
+        with copy_slot(slots=2, limit=1) as slot:
+            self.assertEqual(slot, 0)
+            worker = threading.Thread(target=take_slots)
+            worker.start()
+            worker.join()
+        self.assertEqual(results, ['unavailable', 1])
+
+    def test_backfill_never_takes_every_slot(self):
+        with self.settings(API_MAX_CONCURRENT_COPY=4, API_BACKFILL_COPY_SLOTS=10):
+            self.assertEqual(get_backfill_copy_slots(), 3)
+        with self.settings(API_MAX_CONCURRENT_COPY=2, API_BACKFILL_COPY_SLOTS=1):
+            self.assertEqual(get_backfill_copy_slots(), 1)
+        # A single slot is shared
+        with self.settings(API_MAX_CONCURRENT_COPY=1):
+            self.assertEqual(get_backfill_copy_slots(), 1)
+        with self.settings(API_MAX_CONCURRENT_COPY=None):
+            self.assertIsNone(get_backfill_copy_slots())
+
+
+class DownloadCsvFileTestCase(TestCase):
+    body = b'Country/Region,Confirmed\nItaly,10\n'
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        os.makedirs(os.path.join(self.media.name, 'covid_data'))
+        with open(os.path.join(self.media.name, 'covid_data', '03-21-2020.csv'), 'wb') as file_:
+            file_.write(self.body)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name, API_FILE_SERVE_MODE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.data_file = DataFile.objects.create(origin_file='covid_data/03-21-2020.csv', signature='a' * 40)
+        self.url = reverse('api:data_file_download', kwargs={'data_file_id': self.data_file.id})
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], '"{0}"'.format('a' * 40))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=03-21-2020.csv')
+
+    def test_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=8-13')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.body[8:14])
+        self.assertEqual(response['Content-Range'], 'bytes 8-13/{0}'.format(len(self.body)))
+        self.assertEqual(response['Content-Length'], '6')
+        # Suffix range gives last bytes
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.body[-3:])
+        response = self.get(HTTP_RANGE='bytes={0}-'.format(len(self.body)))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */{0}'.format(len(self.body)))
+
+    def test_if_range_mismatch_gives_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"{0}"'.format('b' * 40))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"{0}"'.format('b' * 40)).status_code, 200)
+
+    def test_serve_modes(self):
+        with self.settings(API_FILE_SERVE_MODE='x-accel-redirect', API_FILE_ACCEL_PREFIX='/internal/'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/covid_data/03-21-2020.csv')
+        self.assertEqual(response.content, b'')
+        with self.settings(API_FILE_SERVE_MODE='x-sendfile'):
+            response = self.get()
+        self.assertEqual(response['X-Sendfile'], self.data_file.origin_file.path)
+        self.assertEqual(response.content, b'')
+        # Remote storages (without local path) redirect to storage url
+        with self.settings(API_FILE_SERVE_MODE='x-sendfile'), \
+                mock.patch('api.views._get_local_path', return_value=None):
+            response = self.get()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], self.data_file.origin_file.url)
+
+
+class MetricsTestCase(TestCase):
+
+    def test_import_stats_are_aggregated(self):
+        DataFile.objects.create(
+            origin_file='covid_data/03-21-2020.csv',
+            signature='a' * 40,
+            processed=True,
+            process_stats={
+                'download': {'source': 'github', 'seconds': 0.3, 'bytes': 2048},
+                'import': {'stages': {'copy': 0.2, 'read': 0.05}, 'rows': 100, 'rows_per_second': 400.0, 'changes': 3},
+            },
+        )
+        DataFile.objects.create(origin_file='covid_data/03-22-2020.csv', signature='b' * 40)
+        response = self.client.get(reverse('api:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode('utf-8')
+        self.assertIn('covid_import_files{processed="false"} 1', content)
+        self.assertIn('covid_import_stage_seconds_bucket{stage="copy",le="0.25"} 1', content)
+        self.assertIn('covid_import_stage_seconds_count{stage="read"} 1', content)
+        self.assertIn('covid_download_bytes_sum{source="github"} 2048.0', content)
+        self.assertIn('covid_import_rows_total 100', content)
+
+    def test_token_is_required_if_configured(self):
+        with self.settings(API_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('api:metrics')).status_code, 401)
+            response = self.client.get(reverse('api:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(API_REQUEST_PROFILING=True, API_PROFILING_SAMPLE_RATE=1.0)
+class RequestProfilingMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        REQUEST_METRICS.reset()
+        CountryDailySummary.objects.create(
+            country_region='Italy',
+            report_day=datetime.date(2020, 3, 21),
+            confirmed=10,
+            deaths=1,
+            recovered=2,
+            locations=1,
+        )
+
+    def test_request_is_measured_and_profiled(self):
+        with mock.patch.object(PROFILE_SAMPLER, 'slowest', []):
+            response = self.client.get(reverse('api:countrydailysummary-list'))
+            self.assertEqual(response.status_code, 200)
+            histograms = REQUEST_METRICS.histograms[('api:countrydailysummary-list', 'GET')]
+            self.assertEqual(histograms['seconds'].count, 1)
+            self.assertGreaterEqual(histograms['queries'].sum, 1)
+            self.assertEqual(histograms['serializer_seconds'].count, 1)
+            self.assertEqual(histograms['response_bytes'].sum, len(response.content))
+            self.assertEqual(len(PROFILE_SAMPLER.slowest), 1)
+            self.assertIn('cumulative', self.client.get(reverse('api:metrics_profiles')).content.decode('utf-8'))
+        self.assertIn(
+            'covid_request_seconds_count{view="api:countrydailysummary-list",method="GET"} 1',
+            self.client.get(reverse('api:metrics')).content.decode('utf-8'),
+        )
+
+
+class SyntheticDataTestCase(SimpleTestCase):
+
+    def test_every_layout_is_normalized(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_dataset(directory=directory, days=7, rows=50)
+            self.assertEqual(len(paths), 7)
+            date_formats = set()
+            for path in paths:
+                with open(path, 'rb') as file_:
+                    csv_header, delimiter = read_csv_header(file_)
+                normalizer = JHCsvNormalizer(
+                    source=path,
+                    field_mapping=csv_header2model_field_mapper(csv_header=csv_header),
+                    delimiter=delimiter,
+                )
+                self.assertEqual(sum(len(chunk) for chunk in normalizer.iter_chunks()), 50)
+                date_formats.add(normalizer.date_format)
+        self.assertEqual(len(date_formats), 5)
+
+
+class PathStatusHandler(BaseHTTPRequestHandler):
+    """ Handler answering with status code given as path, e.g. /500 """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(int(self.path.strip('/')))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LoadTestTestCase(SimpleTestCase):
+
+    def test_summary_percentiles_and_thresholds(self):
+        result = LoadResult()
+        for milliseconds in range(1, 101):
+            result.record('today', milliseconds / 1000, error=milliseconds > 98, size=10)
+        summary = result.summary(duration=10)
+        self.assertEqual(summary['today']['requests'], 100)
+        self.assertEqual(summary['today']['rps'], 10)
+        self.assertEqual(summary['today']['p50'], 0.05)
+        self.assertEqual(summary['today']['p95'], 0.095)
+        self.assertEqual(summary['today']['p99'], 0.099)
+        self.assertEqual(summary['today']['error_rate'], 0.02)
+        self.assertEqual(summary['total']['bytes'], 1000)
+        violations = check_thresholds(summary, {'*': {'error_rate': 0.01}, 'today': {'p95': 0.1, 'p99': 0.05}})
+        self.assertEqual(len(violations), 2)
+        self.assertTrue(violations[0].startswith('today error_rate'))
+        self.assertTrue(violations[1].startswith('today p99'))
+        self.assertEqual(parse_threshold('today.p95=0.2'), ('today', 'p95', 0.2))
+        with self.assertRaises(ValueError):
+            parse_threshold('today=0.2')
+
+    def test_run_load_counts_errors(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), PathStatusHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            summary = run_load(
+                base_url='http://127.0.0.1:{port}'.format(port=server.server_address[1]),
+                urls={'ok': '/200', 'failing': '/500'},
+                weights={'ok': 1, 'failing': 1, 'missing': 1},
+                concurrency=2,
+                duration=0.3,
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(set(summary), {'ok', 'failing', 'total'})
+        self.assertEqual(summary['ok']['errors'], 0)
+        self.assertEqual(summary['failing']['error_rate'], 1)
+        self.assertGreater(summary['total']['requests'], 0)
+
+
+class VersionedResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        GeneralData.objects.create(country_region='Italy', last_update=timezone.now())
+
+    def test_cached_until_dataset_version_bump(self):
+        url = reverse('api:generaldata-today')
+        content = self.client.get(url).content
+        GeneralData.objects.create(country_region='Spain', last_update=timezone.now())
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.content, content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        # Other query params or media types are cached apart
+        self.assertIn(b'Spain', self.client.get(url, {'format': 'columnar'}).content)
+        bump_dataset_version()
+        self.assertIn(b'Spain', self.client.get(url).content)
+
+    def test_vary_on_date(self):
+        url = reverse('api:generaldata-today')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        with mock.patch('api.cache.timezone.localdate', return_value=tomorrow):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_key_parts_are_hashed(self):
+        key = build_versioned_key('today', '/api/v1/general-data/?country_region=' + 'Korea, South ' * 50, 'json')
+        self.assertLess(len(key), 100)
+        self.assertNotIn(' ', key)
+        self.assertNotEqual(key, build_versioned_key('today', '/api/v1/general-data/', 'json'))
+
+
+class FastJSONTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        last_update = timezone.make_aware(datetime.datetime(2020, 3, 22, 23, 30, 5, 120))
+        GeneralData.objects.bulk_create([
+            GeneralData(
+                country_region='Côte d\'Ivoire',
+                province_state='Line\u2028separator "quoted"',
+                last_update=last_update,
+                report_day=datetime.date(2020, 3, 22),
+                confirmed=1234.5,
+                deaths=0.1,
+                latitude=-12.0464,
+                data_file_id=1,
+            ),
+            GeneralData(country_region='US', last_update=last_update - datetime.timedelta(hours=3)),
+        ])
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_output_is_same_of_model_serializer(self):
+        queryset = GeneralData.objects.order_by('last_update', 'id')
+        expected = JSONRenderer().render(GeneralDataSerializer(queryset, many=True).data)
+        data = GENERAL_DATA_VALUES_SERIALIZER.to_representation(GENERAL_DATA_VALUES_SERIALIZER.get_queryset(queryset))
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+        # Indented output is rendered by json module
+        indented = FastJSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_list_endpoint(self):
+        response = self.client.get(reverse('api:generaldata-list'), {'page_size': 1})
+        expected = GeneralDataSerializer(GeneralData.objects.order_by('last_update', 'id')[:1], many=True).data
+        self.assertIn(b'"results":' + JSONRenderer().render(expected), response.content)
+        self.assertEqual(response.content.count(b'"last_update":"2020-03-22T20:30:05.000120Z"'), 1)
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['results'][0]['country_region'], 'Côte d\'Ivoire')
+
+
+class SparseFieldsetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        last_update = timezone.make_aware(datetime.datetime(2020, 3, 22, 12))
+        GeneralData.objects.bulk_create([
+            GeneralData(
+                country_region=country,
+                last_update=last_update + datetime.timedelta(minutes=index),
+                report_day=datetime.date(2020, 3, 22),
+                confirmed=index,
+                deaths=1,
+            ) for index, country in enumerate(('Italy', 'Spain', 'US'))
+        ])
+        LatestReport.register(last_update=last_update)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_fields_narrow_select_and_output(self):
+        url = reverse('api:generaldata-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'confirmed,country_region', 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('deaths', queries.captured_queries[0]['sql'])
+        self.assertEqual(response.json()['results'], [
+            {'country_region': 'Italy', 'confirmed': 0.0},
+            {'country_region': 'Spain', 'confirmed': 1.0},
+        ])
+        # Cursor keeps working though ordering fields are not given
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['results'], [{'country_region': 'US', 'confirmed': 2.0}])
+        response = self.client.get(url, {'fields': 'confirmed,unknown'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('unknown', response.json()['fields'][0])
+
+    def test_columnar_format(self):
+        response = self.client.get(reverse('api:generaldata-last'), {
+            'fields': 'country_region,report_day,confirmed',
+            'format': 'columnar',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'date': '2020-03-22',
+            'data': {
+                'country_region': ['Italy', 'Spain', 'US'],
+                'report_day': ['2020-03-22'] * 3,
+                'confirmed': [0.0, 1.0, 2.0],
+            },
+        })
+        response = self.client.get(reverse('api:generaldata-list'), {'format': 'columnar', 'country_region': 'Peru'})
+        self.assertEqual(response.json()['results'], {})
+
+
+class AsyncReadViewsTestCase(TransactionTestCase):
+
+    def setUp(self):
+        last_update = timezone.make_aware(datetime.datetime(2020, 3, 22, 12))
+        GeneralData.objects.bulk_create([
+            GeneralData(country_region=country, last_update=last_update, report_day=last_update.date(), confirmed=1)
+            for country in ('Italy', 'Spain')
+        ])
+        LatestReport.register(last_update=last_update)
+        get_cache().clear()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+        # Connection of pool thread would block test database flush/drop
+        self.executor.submit(lambda: connection.close()).result()
+        self.executor.shutdown()
+
+    def test_same_response_of_sync_views(self):
+        factory = RequestFactory()
+        with mock.patch.object(async_views, 'DB_EXECUTOR', self.executor):
+            for view, name, params in (
+                (async_views.general_data_list, 'api:generaldata-list', {'fields': 'country_region'}),
+                (async_views.general_data_last, 'api:generaldata-last', {}),
+                (async_views.summary_totals, 'api:countrydailysummary-totals', {}),
+            ):
+                url = reverse(name)
+                get_cache().clear()
+                response = async_to_sync(view)(factory.get(url, params))
+                get_cache().clear()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.client.get(url, params).content)
+
+    def test_pool_thread_queries_are_counted(self):
+        counter = QueryCounter()
+        token = REQUEST_QUERY_COUNTER.set(counter)
+        try:
+            with mock.patch.object(async_views, 'DB_EXECUTOR', self.executor):
+                response = async_to_sync(async_views.general_data_today)(RequestFactory().get('/'))
+        finally:
+            REQUEST_QUERY_COUNTER.reset(token)
+        self.assertEqual(response.status_code, 404)
+        self.assertGreaterEqual(counter.queries, 1)
+
+    @override_settings(API_REQUEST_PROFILING=True)
+    def test_async_request_is_measured(self):
+        REQUEST_METRICS.reset()
+
+        async def get_response(request):
+            await async_views.run_in_db_thread(lambda: list(GeneralData.objects.all()))
+            return HttpResponse(b'ok')
+
+        middleware = RequestProfilingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with mock.patch.object(async_views, 'DB_EXECUTOR', self.executor):
+            response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'ok')
+        histograms = REQUEST_METRICS.histograms[('unresolved', 'GET')]
+        self.assertEqual(histograms['seconds'].count, 1)
+        self.assertEqual(histograms['queries'].sum, 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        start = timezone.make_aware(datetime.datetime(2020, 3, 1, 12))
+        # Pairs of rows share last_update, so pages have to break ties by id
+        GeneralData.objects.bulk_create([
+            GeneralData(
+                country_region='Country {0}'.format(index),
+                last_update=start + datetime.timedelta(hours=index // 2),
+                report_day=datetime.date(2020, 3, 1),
+            ) for index in range(7)
+        ])
+        cls.expected = list(GeneralData.objects.order_by('last_update', 'id').values_list('id', flat=True))
+
+    def get_page(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [row['id'] for row in data['results']], data['next'], data['previous']
 
-# Create your tests here.
+    def test_walk_forward_and_backward_with_ties(self):
+        url = reverse('api:generaldata-list')
+        ids, next_url, previous_url = self.get_page(url, {'page_size': 3})
+        self.assertEqual(ids, self.expected[:3])
+        self.assertIsNone(previous_url)
+        ids, next_url, previous_url = self.get_page(next_url)
+        self.assertEqual(ids, self.expected[3:6])
+        ids, last_next_url, last_previous_url = self.get_page(next_url)
+        self.assertEqual(ids, self.expected[6:])
+        self.assertIsNone(last_next_url)
+        ids, next_url, previous_url = self.get_page(last_previous_url)
+        self.assertEqual(ids, self.expected[3:6])
+        ids, next_url, previous_url = self.get_page(previous_url)
+        self.assertEqual(ids, self.expected[:3])
+        self.assertIsNone(previous_url)
 
+    def test_tampered_cursor(self):
+        url = reverse('api:generaldata-list')
+        for cursor in ('not-base64!', 'eyJwIjogWyJ4IiwgMV0sICJyIjogMH0=', 'e30='):
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, msg=cursor)
@@ -0,0 +1,75 @@
+""" Module to build derived time series of locations with vectorized operations """
+import numpy as np
+import pandas as pd
+
+from django.db.models import Sum
+
+from api.models import GeneralData
+from api.models import CountryDailySummary
+
+
+TIMESERIES_METRICS = ['confirmed', 'deaths', 'recovered']
+ROLLING_WINDOW_DAYS = 7
+
+
+def get_location_daily_values(country_region, province_state=None):
+    """
+    Util to read cumulative values by report day of a location, country level values are read from rollup.
+    Args:
+        country_region: A str describing country.
+        province_state: A str describing province, None means whole country.
+
+    Returns:
+        A list of tuples (report_day, confirmed, deaths, recovered) sorted by report_day.
+    """
+    if province_state is None:
+        queryset = CountryDailySummary.objects.filter(country_region=country_region).order_by('report_day')
+        return list(queryset.values_list('report_day', *TIMESERIES_METRICS))
+    queryset = GeneralData.objects.filter(
+        country_region=country_region,
+        province_state=province_state,
+        report_day__isnull=False,
+    ).values(
+        'report_day',
+    ).annotate(
+        **{'total_{0}'.format(metric): Sum(metric) for metric in TIMESERIES_METRICS}
+    ).order_by('report_day')
+    return list(queryset.values_list('report_day', *['total_{0}'.format(metric) for metric in TIMESERIES_METRICS]))
+
+
+def _to_json_list(series, decimals=4):
+    """ Inner util to convert a float series to list replacing NaN/inf with None """
+    values = series.replace([np.inf, -np.inf], np.nan).round(decimals)
+    return values.astype(object).where(values.notnull(), None).tolist()
+
+
+def build_timeseries(rows):
+    """
+    Util to compute daily deltas, rolling means and doubling time of cumulative values in one pass.
+    Args:
+        rows: A list of tuples (report_day, confirmed, deaths, recovered).
+
+    Returns:
+        A dict with column oriented arrays.
+    """
+    df = pd.DataFrame.from_records(rows, columns=['report_day'] + TIMESERIES_METRICS)
+    df['report_day'] = pd.to_datetime(df['report_day'])
+    # Missing report days keep last known cumulative value
+    df = df.set_index('report_day').astype(float).asfreq('D').ffill()
+
+    daily = df.diff()
+    rolling = daily.rolling(ROLLING_WINDOW_DAYS, min_periods=1).mean()
+    growth = np.log(df / df.shift(ROLLING_WINDOW_DAYS)).replace([np.inf, -np.inf], np.nan)
+    doubling = (ROLLING_WINDOW_DAYS * np.log(2)) / growth.where(growth > 0)
+
+    data = {
+        'dates': df.index.strftime('%Y-%m-%d').tolist(),
+    }
+    for metric in TIMESERIES_METRICS:
+        data[metric] = {
+            'cumulative': _to_json_list(df[metric]),
+            'daily': _to_json_list(daily[metric]),
+            'rolling_{0}d'.format(ROLLING_WINDOW_DAYS): _to_json_list(rolling[metric]),
+            'doubling_days': _to_json_list(doubling[metric], decimals=2),
+        }
+    return data
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls.conf import path
 from django.urls.conf import include
 
@@ -6,12 +7,16 @@ from django.views.generic import TemplateView
 from rest_framework import routers
 from rest_framework.schemas import get_schema_view
 
+from api.views import metrics
+from api.views import metrics_profiles
 from api.views import download_csv_file
 from api.views import GeneralDataViewSet
+from api.views import CountryDailySummaryViewSet
 
 
 router = routers.DefaultRouter()
 router.register(r'data', GeneralDataViewSet,)
+router.register(r'summary', CountryDailySummaryViewSet,)
 
 schema_view = get_schema_view(
     title='COVID-19 API',
@@ -25,4 +30,19 @@ urlpatterns = [
     ), name='doc'),
     path('', schema_view, name='schema'),
     path('data_file/<int:data_file_id>', download_csv_file, name='data_file_download'),
+    path('metrics', metrics, name='metrics'),
+    path('metrics/profiles', metrics_profiles, name='metrics_profiles'),
 ]
+
+if getattr(settings, 'API_ASYNC_READ_VIEWS', False):
+    from api import async_views
+
+    # Same paths and names of router read endpoints, placed first so they take precedence
+    urlpatterns = [
+        path('v1/data/', async_views.general_data_list, name='generaldata-list'),
+        path('v1/data/today/', async_views.general_data_today, name='generaldata-today'),
+        path('v1/data/last/', async_views.general_data_last, name='generaldata-last'),
+        path('v1/data/timeseries/', async_views.general_data_timeseries, name='generaldata-timeseries'),
+        path('v1/summary/', async_views.summary_list, name='countrydailysummary-list'),
+        path('v1/summary/totals/', async_views.summary_totals, name='countrydailysummary-totals'),
+    ] + urlpatterns
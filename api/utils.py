@@ -1,14 +1,55 @@
 """ Module to define utils """
+import io
 import os
+import csv
 import time
 import logging
 import hashlib
+from contextlib import contextmanager
 
-import requests
 import pandas as pd
+from django.conf import settings
 from django.utils.text import slugify
 
 from api.exceptions import HeaderNotIdentifier, DateFormatNotIdentifier
+from api.http_client import get_http_client
+
+
+NORMALIZE_CHUNK_SIZE = getattr(settings, 'API_NORMALIZE_CHUNK_SIZE', 50000)
+DATE_SNIFF_SAMPLE_SIZE = 200
+REQUIRED_FIELDS = ['country_region', 'last_update']
+DATE_COLUMN_FORMATS = [
+    '%m/%d/%y %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%m/%d/%Y %I%p',
+]
+
+
+# GeneralData field by slug of known csv column names
+HEADER_ALIASES = {
+    slugify(alias): field for field, aliases in {
+        'province_state': ['Province/State', 'Province_State'],
+        'admin2': ['Admin2'],
+        'country_region': ['Country/Region', 'Country_Region'],
+        'last_update': ['Last Update', 'Last_Update'],
+        'confirmed': ['Confirmed'],
+        'deaths': ['Deaths'],
+        'recovered': ['Recovered'],
+        'suspected': ['Suspected'],
+        'latitude': ['Latitude', 'Lat'],
+        'longitude': ['Longitude', 'Long_'],
+        'confn_susp': ['ConfnSusp', 'confn_susp'],
+    }.items() for alias in aliases
+}
+
+
+def get_general_data_fields():
+    """ Util to get GeneralData concrete fields, models can not be imported when utils is loaded """
+    from api.models import GeneralData
+    return GeneralData._meta.concrete_fields
 
 
 def generate_md5_checksum(file_path, chunk_size=4096):
@@ -28,157 +69,368 @@ def generate_md5_checksum(file_path, chunk_size=4096):
     with open(file_path, 'rb') as file_:
         for chunk in iter(lambda: file_.read(chunk_size), b''):
             hash_md5.update(chunk)
-    return hash_md5.hexdigist()
+    return hash_md5.hexdigest()
+
+
+class StageTimer:
+    """ Collector of seconds spent by named stages of a process, repeated stages are added up """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def get(self, name):
+        return self.timings.get(name, 0.0)
+
+
+class ChunkStream(io.RawIOBase):
+    """ Read only stream over an iterable of bytes chunks, e.g. requests.Response.iter_content """
+
+    def __init__(self, chunks, stop_on=()):
+        """
+        Args:
+            chunks: A iterable of bytes.
+            stop_on: A tuple of exception classes ending stream (kept on error attribute) instead of being
+                raised to consumer, e.g. a storage saving a partial file would not give its name.
+        """
+        super().__init__()
+        self.chunks = iter(chunks)
+        self.stop_on = stop_on
+        self.position = 0
+        self.pending = b''
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Storages rewind content before reading, it is allowed while nothing was read
+        if offset == 0 and whence == io.SEEK_SET and self.position == 0:
+            return 0
+        raise io.UnsupportedOperation('ChunkStream can not seek')
 
+    def readinto(self, buffer):
+        while not self.pending:
+            try:
+                self.pending = next(self.chunks)
+            except StopIteration:
+                return 0
+            except self.stop_on as err:
+                self.error = err
+                return 0
+            except Exception as err:
+                # Kept because consumers as psycopg2 COPY replace it with their own error
+                self.error = err
+                raise
+        size = min(len(buffer), len(self.pending))
+        data, self.pending = self.pending[:size], self.pending[size:]
+        buffer[:size] = data
+        self.update(data)
+        self.position += size
+        return size
 
-def request_with_retry(request_kwargs, max_retries=3):
+    def update(self, data):
+        """ Hook receiving every block of data read """
+
+
+class HashingChunkStream(ChunkStream):
+    """
+    ChunkStream computing git blob sha1 and md5 of data while it is read, so a download can be
+    hashed and stored on a single pass.
+    """
+
+    def __init__(self, chunks, size, stop_on=()):
+        """
+        Args:
+            chunks: A iterable of bytes.
+            size: A int describing total bytes expected, needed by git blob header.
+            stop_on: A tuple of exception classes ending stream, see ChunkStream.
+        """
+        super().__init__(chunks, stop_on=stop_on)
+        self.size = size
+        self.git_sha = hashlib.sha1('blob {size}\0'.format(size=size).encode('ascii'))
+        self.md5 = hashlib.md5()
+
+    def update(self, data):
+        self.git_sha.update(data)
+        self.md5.update(data)
+
+
+def hash_local_file(file_path, chunk_size=64 * 1024):
     """
-    Util to do request to server but manage retry system if it is down.
+    Util to get git blob sha1 (github signature) and md5 of a local file.
     Args:
-        request_kwargs: A dict describing kwargs to pass on requests.request method.
-        max_retries: A integer describing max number de retries to do.
+        file_path: A str describing file path on system.
+        chunk_size: A integer describing chunk file bytes when reading.
 
     Returns:
-        A requests.Response object.
+        A tuple (git sha hex str, md5 hex str).
     """
-    retried = 0
-    while retried < max_retries:
-        try:
-            response = requests.request(**request_kwargs)
-            return response
-        except requests.exceptions.Timeout as err:
-            time.sleep(30)
-            retried += 1
-            if retried == max_retries:
-                raise err
-            continue
+    with open(file_path, 'rb') as file_:
+        stream = HashingChunkStream(
+            chunks=iter(lambda: file_.read(chunk_size), b''),
+            size=os.path.getsize(file_path),
+        )
+        while stream.read(chunk_size):
+            pass
+    return stream.git_sha.hexdigest(), stream.md5.hexdigest()
 
 
 def github_api_request(request_kwargs):
     """
-    Util to perform github api v3 request.
+    Util to perform github api v3 request through shared pooled client.
     Args:
-        request_kwargs: A dict describing kwargs to pass on requests.request method.
+        request_kwargs: A dict describing kwargs to pass on HttpClient.request method, headers are merged
+            with github ones (useful to send If-None-Match).
 
     Returns:
         A requests.Response object.
+
+    Raises:
+        RateLimitExceeded: If github rate limit was reached.
     """
     headers = {
         'Accept': 'application/vnd.github.v3+json',
     }
+    headers.update(request_kwargs.get('headers') or {})
     request_kwargs.update({
         'headers': headers,
-        'timeout': 60,
     })
-    return request_with_retry(request_kwargs)
+    return get_http_client().request(**request_kwargs)
 
 
 def csv_header2model_field_mapper(csv_header):
     """
-    Util to help to identify csv header to model fields of api.GeneralData.
+    Util to help to identify csv header to model fields of api.GeneralData, used when a header layout
+    is not registered yet on HeaderLayout.
     Args:
         csv_header: A list with str values of column names of csv file.
 
     Returns:
-        A dict describing GeneralData field = csv header field.
-    """
-    # TODO Change it for a model to dynamic behavior
-    mapping_ = {
-        'province_state': [
-            slugify('Province/State'),
-            slugify('Province_State'),
-        ],
-        'country_region': [
-            slugify('Country/Region'),
-            slugify('Country_Region'),
-        ],
-        'last_update': [
-            slugify('Last Update'),
-            slugify('Last_Update'),
-        ],
-        'confirmed': [
-            slugify('Confirmed'),
-        ],
-        'deaths': [
-            slugify('Deaths'),
-        ],
-        'recovered': [
-            slugify('Recovered'),
-        ],
-        'suspected': [
-            slugify('Suspected'),
-        ],
-        'latitude': [
-            slugify('Latitude'),
-            slugify('Lat'),
-        ],
-        'longitude': [
-            slugify('Longitude'),
-            slugify('Long_'),
-        ],
-        'confn_susp': [
-            slugify('ConfnSusp'),
-        ]
+        A dict describing csv header field = GeneralData field (None if it is not identified).
+    """
+    return {
+        column_name.strip(): HEADER_ALIASES.get(slugify(column_name.strip())) for column_name in csv_header
     }
 
-    def get_field_name(slug_header):
-        """ Inner function to get field name of slug column name """
-        for field, column_values in mapping_.items():
-            if slug_header in column_values:
-                return field
-    header_mapping = {
-        column_name.strip(): get_field_name(slug_header=slugify(column_name.strip())) for column_name in csv_header
-    }
-    return header_mapping
 
+def open_source(source):
+    """
+    Util to open a file given by local path or by storage.
+    Args:
+        source: A str describing file path or a django FieldFile object.
 
-def clean_jh_csv_file(data_file_id):
+    Returns:
+        A binary file object.
     """
-    Util receiving a csv DataFile from jh university and clean its columns allowing import it
-    on GeneralData table
+    if isinstance(source, str):
+        return open(source, 'rb')
+    return source.open('rb')
+
+
+def read_csv_header(file_):
+    """
+    Util to read header row of a csv file detecting its delimiter (normalized files on old versions used ';').
     Args:
-        data_file_id: A int describing DataFile DB ID.
+        file_: A binary file object positioned at the beginning.
 
     Returns:
-        A pandas.DataFrame object manage DataFile.
+        A tuple (list of column names, delimiter).
     """
-    from api.models import DataFile
-    data_file = DataFile.objects.get(id=data_file_id)
-    delimiter = ','
-    if not data_file.header:
-        with open(data_file.origin_file.path, 'r') as file_:
-            csv_header = file_.readline().replace('\ufeff', '').split(',')
-        field_mapping = csv_header2model_field_mapper(csv_header=csv_header)
-    else:
-        delimiter = ';'
-        field_mapping = data_file.header
+    line = file_.readline().decode('utf-8-sig')
+    delimiter = ';' if line.count(';') > line.count(',') else ','
+    columns = next(csv.reader([line], delimiter=delimiter), [])
+    return [column.strip() for column in columns], delimiter
 
-    field_mapping.pop('null', '')
-    if None in field_mapping.keys():
-        raise HeaderNotIdentifier('Incomplete headers => {head}'.format(head=field_mapping))
-
-    columns = list(field_mapping.values())
-    df = pd.read_csv(data_file.origin_file.path, delimiter=delimiter)
-    df.rename(columns=field_mapping, inplace=True)
-    df.drop(df.columns.difference(columns), 1, inplace=True)
-
-    # TODO Change for model to more dynamic
-    date_column_formats = [
-        '%m/%d/%y %H:%M',
-        '%Y-%m-%dT%H:%M:%S',
-        '%m/%d/%Y %H:%M',
-        '%m/%d/%Y %H:%M:%S',
-        '%Y-%m-%d %H:%M:%S',
-        '%m/%d/%Y %I%p',
-    ]
-    for format_ in date_column_formats:
+
+def sniff_date_format(values, formats=None):
+    """
+    Util to identify date format of a sample of string values.
+    Args:
+        values: A pandas.Series object with date str values.
+        formats: A list of str describing formats to try, DATE_COLUMN_FORMATS by default.
+
+    Returns:
+        A str describing first format parsing all values.
+    """
+    sample = values.dropna()
+    for format_ in formats or DATE_COLUMN_FORMATS:
         try:
-            df.last_update = pd.to_datetime(df.last_update, format=format_)
-            break
-        except ValueError:
+            pd.to_datetime(sample, format=format_)
+            return format_
+        except (ValueError, TypeError):
             logging.info(msg='Last Update column no support: {form} format.'.format(form=format_))
-    else:
-        raise DateFormatNotIdentifier('Last update: {value} not support registre formats.')
+    raise DateFormatNotIdentifier('Last update: {value} not support registre formats.'.format(
+        value=sample.iloc[0] if len(sample) else None,
+    ))
+
+
+class JHCsvNormalizer:
+    """
+    Normalizer of jh university csv files, file is read on bounded chunks of rows renaming columns to
+    GeneralData fields and parsing last_update with the format sniffed from a small sample.
+    Normalized chunks are given as csv bytes ready to COPY, so file is never rewritten.
+    """
+
+    def __init__(self, source, field_mapping, delimiter=',', date_format=None, chunk_size=None, layout=None):
+        """
+        Args:
+            source: A str describing file path or a django FieldFile object.
+            field_mapping: A dict describing csv column = GeneralData field (None for ignored columns).
+            delimiter: A str describing csv delimiter.
+            date_format: A str describing last_update format, it is sniffed if it is not given.
+            chunk_size: A int describing rows by chunk.
+            layout: A HeaderLayout object describing registered layout of file.
+        """
+        self.source = source
+        self.layout = layout
+        self.field_mapping = {column: field for column, field in field_mapping.items() if field}
+        self.delimiter = delimiter
+        self.chunk_size = chunk_size or NORMALIZE_CHUNK_SIZE
+        self.rows = 0
+        self.timer = StageTimer()
+        missing = [field for field in REQUIRED_FIELDS if field not in self.field_mapping.values()]
+        if missing:
+            raise HeaderNotIdentifier('Incomplete headers, missing {fields} => {head}'.format(
+                fields=missing,
+                head=field_mapping,
+            ))
+        self.date_format = date_format or self.detect_date_format()
+
+    @property
+    def columns(self):
+        """ GeneralData fields given by file on model order """
+        fields = set(self.field_mapping.values())
+        return [field.name for field in get_general_data_fields() if field.name in fields]
 
-    df.to_csv(data_file.origin_file.path, index=False, sep=';')
-    return df
+    def open(self):
+        return open_source(self.source)
+
+    def read_csv(self, file_, **kwargs):
+        """ Method to read csv only with mapped columns """
+        text_fields = ('province_state', 'admin2', 'country_region', 'last_update')
+        return pd.read_csv(
+            file_,
+            sep=self.delimiter,
+            encoding='utf-8-sig',
+            usecols=lambda name: name.strip() in self.field_mapping,
+            dtype={
+                column: str for column, field in self.field_mapping.items() if field in text_fields
+            },
+            **kwargs
+        )
+
+    def rename(self, df):
+        return df.rename(columns=lambda name: self.field_mapping[name.strip()])
+
+    def detect_date_format(self):
+        with self.timer.stage('date_detection'):
+            with self.open() as file_:
+                sample = self.rename(self.read_csv(file_, nrows=DATE_SNIFF_SAMPLE_SIZE))
+            return sniff_date_format(sample['last_update'])
+
+    def iter_chunks(self):
+        """
+        Method to iterate file normalized.
+        Returns:
+            A generator of pandas.DataFrame objects with GeneralData fields as columns.
+        """
+        with self.open() as file_:
+            reader = iter(self.read_csv(file_, chunksize=self.chunk_size))
+            while True:
+                with self.timer.stage('read'):
+                    chunk = next(reader, None)
+                    if chunk is None:
+                        return
+                    chunk = self.rename(chunk)
+                with self.timer.stage('date_parsing'):
+                    try:
+                        chunk['last_update'] = pd.to_datetime(chunk['last_update'], format=self.date_format)
+                    except ValueError:
+                        # Format changed inside file, sniff again on this chunk
+                        self.date_format = sniff_date_format(chunk['last_update'])
+                        chunk['last_update'] = pd.to_datetime(chunk['last_update'], format=self.date_format)
+                self.rows += len(chunk)
+                yield chunk[self.columns]
+
+    def iter_csv(self, static_columns=None):
+        """
+        Method to iterate normalized file as csv bytes with header on first chunk.
+        Args:
+            static_columns: A dict describing field = value added to every row.
+
+        Returns:
+            A generator of bytes.
+        """
+        static_columns = static_columns or {}
+        for index, chunk in enumerate(self.iter_chunks()):
+            with self.timer.stage('serialize'):
+                data = chunk.assign(**static_columns).to_csv(
+                    index=False,
+                    header=index == 0,
+                    date_format='%Y-%m-%d %H:%M:%S',
+                ).encode('utf-8')
+            yield data
+
+    def as_stream(self, static_columns=None):
+        """
+        Method to get normalized csv as a file object to COPY.
+        Args:
+            static_columns: A dict describing field = value added to every row.
+
+        Returns:
+            A ChunkStream object.
+        """
+        return ChunkStream(self.iter_csv(static_columns=static_columns))
+
+
+def clean_jh_csv_file(data_file_id, chunk_size=None):
+    """
+    Util receiving a csv DataFile from jh university and prepare its normalization allowing import it
+    on GeneralData table, header and date format are identified here so errors are raised before import.
+    Known header layouts take mapping and date format from HeaderLayout registry skipping detection.
+    Raw upstream copy on local mirror is read when it exists instead of stored file.
+    Args:
+        data_file_id: A int describing DataFile DB ID.
+        chunk_size: A int describing rows normalized by chunk.
+
+    Returns:
+        A JHCsvNormalizer object managing DataFile.
+    """
+    from api.models import DataFile
+    from api.header_registry import get_header_layout
+    from api.mirror import get_mirror
+    data_file = DataFile.objects.get(id=data_file_id)
+    mirror = get_mirror()
+    source = (mirror.get(data_file.signature) if mirror else None) or data_file.origin_file
+    with open_source(source) as file_:
+        csv_header, delimiter = read_csv_header(file_)
+    layout = get_header_layout(csv_header=csv_header)
+    # Layout mapping is used even if DataFile has one, so a mapping fixed on admin applies on re-process,
+    # importer saves mapping used on DataFile.header
+    field_mapping = dict(layout.field_mapping)
+    field_mapping.pop('null', '')
+    return JHCsvNormalizer(
+        source=source,
+        field_mapping=field_mapping,
+        delimiter=delimiter,
+        date_format=layout.date_format,
+        chunk_size=chunk_size,
+        layout=layout,
+    )
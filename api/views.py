@@ -1,42 +1,263 @@
 """ Module to define api no rest views """
 import os
-import io
+import re
 import datetime
 import mimetypes
 
+from django.conf import settings
 from django.http.response import Http404
+from django.http.response import FileResponse
 from django.http.response import HttpResponse
+from django.http.response import HttpResponseRedirect
+from django.http.response import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.utils.http import quote_etag
 
+from django.db.models import Sum
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from rest_framework.decorators import action
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+
+from api.cache import versioned_response_cache
+from api.export import stream_queryset_csv
+from api.filters import GeneralDataExportFilter
+from api.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from api.metrics import render_metrics
+from api.middleware import PROFILE_SAMPLER
+from api.pagination import KeysetPagination
+from api.pagination import SummaryKeysetPagination
 
 from api.models import DataFile
 from api.models import GeneralData
+from api.models import LatestReport
+from api.models import CountryDailySummary
 
 from api.serializers import GeneralDataSerializer
+from api.serializers import CountryDailySummarySerializer
+from api.serializers import GENERAL_DATA_VALUES_SERIALIZER
+from api.serializers import COUNTRY_DAILY_SUMMARY_VALUES_SERIALIZER
+
+from api.timeseries import build_timeseries
+from api.timeseries import get_location_daily_values
+
+
+FILE_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+
+def _get_local_path(field_file):
+    """ Inner function to get file path on system, None for remote storages (S3) """
+    try:
+        return field_file.path
+    except NotImplementedError:
+        return None
+
+
+def _parse_range(range_header, size):
+    """
+    Inner function to parse a single range http header.
+    Args:
+        range_header: A str describing Range header value.
+        size: A int describing file size.
+
+    Returns:
+        A tuple (start, end) inclusive, None if header is not supported and
+        False if range is not satisfiable.
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if not match or (not match.group('start') and not match.group('end')):
+        return None
+    if not match.group('start'):
+        # Suffix range, last N bytes
+        length = int(match.group('end'))
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(match.group('start'))
+    end = int(match.group('end')) if match.group('end') else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _iter_file_range(file_, start, end):
+    """ Inner generator reading [start, end] bytes of file and closing it at the end """
+    try:
+        file_.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = file_.read(min(FILE_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file_.close()
 
 
 def download_csv_file(request, data_file_id):
-    """ View to download DataFile """
+    """
+    View to download DataFile, file is streamed supporting conditional (ETag/Last-Modified) and
+    Range requests. If API_FILE_SERVE_MODE is set bytes are served by the web server
+    (x-accel-redirect/x-sendfile) or by storage through a (presigned) redirect for remote storages.
+    """
     data_file = get_object_or_404(DataFile, id=data_file_id, origin_file__isnull=False)
-    if not os.path.exists(data_file.origin_file.path):
+    etag = quote_etag(data_file.signature)
+    last_modified = int(data_file.update_date.timestamp())
+    conditional_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional_response is not None:
+        return conditional_response
+
+    serve_mode = getattr(settings, 'API_FILE_SERVE_MODE', None)
+    field_file = data_file.origin_file
+    filename = os.path.basename(field_file.name)
+    local_path = _get_local_path(field_file)
+    if local_path is None and serve_mode:
+        return HttpResponseRedirect(field_file.url)
+    if local_path is not None and not os.path.exists(local_path):
         raise Http404
-    content_type = mimetypes.guess_type(data_file.origin_file.name)
-    response = HttpResponse(
-        content_type=content_type,
-        status=200,
-    )
-    response.write(open(data_file.origin_file.path, 'rb').read())
-    response['Content-Disposition'] = 'attachment; filename={name}'.format(name=data_file.origin_file.name)
+
+    content_type = mimetypes.guess_type(filename)[0] or 'text/csv'
+    if local_path is not None and serve_mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'API_FILE_ACCEL_PREFIX', '/protected/') + field_file.name
+    elif local_path is not None and serve_mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = local_path
+    else:
+        size = field_file.size
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if range_header and (not if_range or if_range == etag):
+            byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{size}'.format(size=size)
+            return response
+        if byte_range is None:
+            response = FileResponse(field_file.open('rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _iter_file_range(field_file.open('rb'), start, end),
+                content_type=content_type,
+                status=206,
+            )
+            response['Content-Range'] = 'bytes {start}-{end}/{size}'.format(start=start, end=end, size=size)
+            response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = 'attachment; filename={name}'.format(name=filename)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
     return response
 
 
-class GeneralDataViewSet(ReadOnlyModelViewSet):
+def _metrics_authorized(request):
+    """ Inner function to check bearer token of metrics views if API_METRICS_TOKEN is set """
+    token = getattr(settings, 'API_METRICS_TOKEN', None)
+    return not token or constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''),
+        'Bearer {token}'.format(token=token),
+    )
+
+
+def metrics(request):
+    """
+    View to expose api metrics on prometheus text format, a bearer token is required if API_METRICS_TOKEN is set.
+    Args:
+        request: A django.http.request.HttpRequest object.
+
+    Returns:
+        A django.http.response.HttpResponse object.
+    """
+    if not _metrics_authorized(request):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+def metrics_profiles(request):
+    """
+    View to show cProfile stats of the slowest sampled requests of actual process (see RequestProfilingMiddleware).
+    Args:
+        request: A django.http.request.HttpRequest object.
+
+    Returns:
+        A django.http.response.HttpResponse object.
+    """
+    if not _metrics_authorized(request):
+        return HttpResponse(status=401)
+    return HttpResponse(PROFILE_SAMPLER.render(), content_type='text/plain; charset=utf-8')
+
+
+class ValuesListMixin:
+    """
+    Mixin serving list action through a ValuesSerializer instead of model instances and ModelSerializer,
+    fields query param (comma separated) narrows columns read and given.
+    """
+    values_serializer = None
+    fields_query_param = 'fields'
+
+    def get_values_fields(self):
+        """
+        Method to get fields requested by query param.
+        Returns:
+            A list of str describing field names on serializer order or None for every field.
+        """
+        value = self.request.query_params.get(self.fields_query_param)
+        if value is None:
+            return None
+        fields = set(name.strip() for name in value.split(',') if name.strip())
+        unknown = fields.difference(self.values_serializer.field_names)
+        if not fields or unknown:
+            raise ValidationError({self.fields_query_param: [
+                'Unknown fields: {unknown}. Available fields: {available}.'.format(
+                    unknown=', '.join(sorted(unknown)) or '-',
+                    available=', '.join(self.values_serializer.field_names),
+                )
+            ]})
+        return [name for name in self.values_serializer.field_names if name in fields]
+
+    def get_values_data(self, queryset):
+        """
+        Method to serialize a queryset through values_serializer.
+        Args:
+            queryset: A QuerySet object of viewset model.
+
+        Returns:
+            A list of dicts.
+        """
+        fields = self.get_values_fields()
+        return self.values_serializer.to_representation(
+            self.values_serializer.get_queryset(queryset, fields=fields),
+            fields=fields,
+        )
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_values_fields()
+        queryset = self.values_serializer.get_queryset(
+            self.filter_queryset(self.get_queryset()),
+            fields=fields,
+            # Cursor of next/previous links is built from ordering values
+            required_fields=self.paginator.ordering,
+        )
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.values_serializer.to_representation(page, fields=fields))
+
+
+class GeneralDataViewSet(ValuesListMixin, ReadOnlyModelViewSet):
     queryset = GeneralData.objects.order_by('last_update')
     serializer_class = GeneralDataSerializer
+    values_serializer = GENERAL_DATA_VALUES_SERIALIZER
+    pagination_class = KeysetPagination
     allowed_methods = ['GET']
     filterset_fields = [
         'report_day',
@@ -45,19 +266,13 @@ class GeneralDataViewSet(ReadOnlyModelViewSet):
     ]
 
     @action(detail=False, methods=['GET'])
+    @versioned_response_cache(vary_on_date=True)
     def today(self, request):
         """ EndPoint to return actual covid information """
-        today = datetime.date.today()
-        queryset = GeneralData.objects.filter(
-            last_update__year=today.year,
-            last_update__month=today.month,
-            last_update__day=today.day,
-        )
+        queryset = GeneralData.objects.last_update_on(timezone.localdate()).order_by('last_update', 'id')
+        data = self.get_values_data(queryset)
         status_code = 200
-        if queryset.exists():
-            serializer_class = self.get_serializer_class()
-            data = serializer = serializer_class(queryset, many=True).data
-        else:
+        if not data:
             status_code = 404
             data = {
                 'details': 'Information not sync yet.'
@@ -65,32 +280,99 @@ class GeneralDataViewSet(ReadOnlyModelViewSet):
         return Response(data, status=status_code)
 
     @action(detail=False, methods=['GET'])
+    @versioned_response_cache()
     def last(self, request):
         """ Endpoint giving last information update of covid """
-        last_date = GeneralData.objects.order_by('-last_update').first().last_update.date()
-        queryset = GeneralData.objects.filter(
-            last_update__year=last_date.year,
-            last_update__month=last_date.month,
-            last_update__day=last_date.day,
-        )
-        serializer_class = self.get_serializer_class()
-        serializer = serializer_class(queryset, many=True)
+        last_update = LatestReport.get_last_update()
+        if last_update is None:
+            return Response({'details': 'Information not sync yet.'}, status=404)
+        last_date = timezone.localdate(last_update)
+        queryset = GeneralData.objects.last_update_on(last_date).order_by('last_update', 'id')
         data = {
             'date': last_date,
-            'data': serializer.data,
+            'data': self.get_values_data(queryset),
+        }
+        return Response(data, status=200)
+
+    @action(detail=False, methods=['GET'])
+    @versioned_response_cache()
+    def timeseries(self, request):
+        """
+        Endpoint giving column oriented series of a location with cumulative values, daily deltas,
+        7 days rolling means and doubling time. Accept country_region (required) and province_state params.
+        """
+        country_region = request.query_params.get('country_region')
+        province_state = request.query_params.get('province_state')
+        if not country_region:
+            raise ValidationError({'country_region': ['This query param is required.']})
+        rows = get_location_daily_values(country_region=country_region, province_state=province_state)
+        if not rows:
+            return Response({'details': 'Location not found.'}, status=404)
+        data = {
+            'country_region': country_region,
+            'province_state': province_state,
         }
+        data.update(build_timeseries(rows))
         return Response(data, status=200)
 
     @action(detail=False, methods=['GET'])
     def csv(self, request):
-        """ Endpoint to return a csv with all information collected """
-        buffer = io.BytesIO()
+        """
+        Endpoint to return a csv with all information collected, streamed from database.
+        Accept report_day_after, report_day_before, country_region and gzip query params.
+        """
+        filterset = GeneralDataExportFilter(
+            data=request.query_params,
+            queryset=GeneralData.objects.order_by('id'),
+            request=request,
+        )
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
         filename = 'all_covid_history_data_{date}.csv'.format(date=datetime.date.today())
-        GeneralData.objects.to_csv(buffer)
-        response = HttpResponse(
-            content_type='text/csv',
+        content_type = 'text/csv'
+        if compress:
+            filename += '.gz'
+            content_type = 'application/gzip'
+        response = StreamingHttpResponse(
+            stream_queryset_csv(filterset.qs, compress=compress),
+            content_type=content_type,
             status=200,
         )
-        response.write(buffer.getvalue())
         response['Content-Disposition'] = 'attachment; filename={name}'.format(name=filename)
         return response
+
+
+class CountryDailySummaryViewSet(ValuesListMixin, ReadOnlyModelViewSet):
+    queryset = CountryDailySummary.objects.order_by('report_day', 'id')
+    serializer_class = CountryDailySummarySerializer
+    values_serializer = COUNTRY_DAILY_SUMMARY_VALUES_SERIALIZER
+    pagination_class = SummaryKeysetPagination
+    allowed_methods = ['GET']
+    filterset_fields = [
+        'report_day',
+        'country_region',
+    ]
+
+    @action(detail=False, methods=['GET'])
+    @versioned_response_cache()
+    def totals(self, request):
+        """ Endpoint giving global totals by report day """
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            'report_day',
+        ).annotate(
+            total_confirmed=Sum('confirmed'),
+            total_deaths=Sum('deaths'),
+            total_recovered=Sum('recovered'),
+            total_locations=Sum('locations'),
+        ).order_by('report_day')
+        data = [
+            {
+                'report_day': row['report_day'],
+                'confirmed': row['total_confirmed'],
+                'deaths': row['total_deaths'],
+                'recovered': row['total_recovered'],
+                'locations': row['total_locations'],
+            } for row in queryset
+        ]
+        return Response(data, status=200)
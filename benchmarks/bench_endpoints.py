@@ -0,0 +1,48 @@
+""" Benchmarks of read endpoints over the seeded dataset, cold runs clear response cache before every round """
+import pytest
+from django.urls import reverse
+
+from api.cache import get_cache
+
+from conftest import BENCH_ROUNDS
+
+
+ENDPOINTS = {
+    'list': ('api:generaldata-list', '?page_size=500'),
+    'list_sparse': ('api:generaldata-list', '?page_size=500&fields=country_region,report_day,confirmed'),
+    'list_columnar': (
+        'api:generaldata-list',
+        '?page_size=500&fields=country_region,report_day,confirmed&format=columnar',
+    ),
+    'today': ('api:generaldata-today', ''),
+    'last': ('api:generaldata-last', ''),
+    'csv': ('api:generaldata-csv', ''),
+    'summary': ('api:countrydailysummary-list', ''),
+}
+
+
+def get_content(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('endpoint', sorted(ENDPOINTS))
+def bench_endpoint_cold(benchmark, client, endpoint):
+    name, query = ENDPOINTS[endpoint]
+    url = reverse(name) + query
+    content = benchmark.pedantic(get_content, args=(client, url), setup=get_cache().clear, rounds=BENCH_ROUNDS)
+    benchmark.extra_info['bytes'] = len(content)
+    assert content
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('endpoint', ['today', 'last'])
+def bench_endpoint_cached(benchmark, client, endpoint):
+    name, query = ENDPOINTS[endpoint]
+    url = reverse(name) + query
+    get_content(client, url)
+    assert benchmark(get_content, client, url)
@@ -0,0 +1,92 @@
+""" Benchmarks of loading normalized rows into GeneralData and of the whole import task """
+import io
+import os
+import datetime
+
+import pytest
+from django.core.files.base import File
+
+from api.loader import apply_data_file_delta
+from api.models import DataFile
+from api.models import GeneralData
+from api.tasks import DELTA_KEY_FIELDS
+from api.tasks import file_data_importer
+from api.utils import JHCsvNormalizer
+from api.utils import read_csv_header
+from api.utils import csv_header2model_field_mapper
+
+from conftest import BENCH_ROWS
+from conftest import BENCH_ROUNDS
+
+
+BENCH_DATA_FILE_ID = 999999
+
+
+@pytest.fixture
+def normalized_report(synthetic_reports):
+    """ Normalized csv bytes of a report with unique location keys """
+    path = synthetic_reports[('coordinates', '%Y-%m-%dT%H:%M:%S')]
+    with open(path, 'rb') as file_:
+        csv_header, delimiter = read_csv_header(file_)
+    normalizer = JHCsvNormalizer(
+        source=path,
+        field_mapping=csv_header2model_field_mapper(csv_header=csv_header),
+        delimiter=delimiter,
+    )
+    static_columns = {
+        'report_day': datetime.date(2020, 3, 1),
+        'data_file_id': BENCH_DATA_FILE_ID,
+    }
+    content = b''.join(normalizer.iter_csv(static_columns=static_columns))
+    return content, normalizer.columns + list(static_columns.keys())
+
+
+def load(content, columns):
+    return apply_data_file_delta(
+        model=GeneralData,
+        stream=io.BytesIO(content),
+        columns=columns,
+        data_file_id=BENCH_DATA_FILE_ID,
+        previous_ids=[],
+        key_fields=DELTA_KEY_FIELDS,
+    )
+
+
+def clear_rows():
+    GeneralData.objects.filter(data_file_id=BENCH_DATA_FILE_ID).delete()
+
+
+@pytest.mark.django_db
+def bench_load_new_file(benchmark, normalized_report):
+    content, columns = normalized_report
+    delta = benchmark.pedantic(load, args=(content, columns), setup=clear_rows, rounds=BENCH_ROUNDS)
+    assert delta['inserted'] == BENCH_ROWS
+
+
+@pytest.mark.django_db
+def bench_load_unchanged_revision(benchmark, normalized_report):
+    content, columns = normalized_report
+    load(content, columns)
+    delta = benchmark.pedantic(load, args=(content, columns), rounds=BENCH_ROUNDS)
+    assert delta['unchanged'] == BENCH_ROWS
+
+
+@pytest.mark.django_db
+def bench_import_task(benchmark, synthetic_reports):
+    """ Whole file_data_importer: header and date detection, normalization, COPY and rollup """
+    path = synthetic_reports[('counties', '%m/%d/%y %H:%M')]
+    data_file = DataFile(signature='bench-{0}'.format(os.path.basename(path)))
+    with open(path, 'rb') as file_:
+        data_file.origin_file.save(os.path.basename(path), File(file_), save=False)
+    data_file.save()
+
+    def clear_import():
+        GeneralData.objects.filter(data_file_id=data_file.id).delete()
+
+    result = benchmark.pedantic(
+        lambda: file_data_importer.apply(kwargs={'data_file_id': data_file.id}).get(),
+        setup=clear_import,
+        rounds=BENCH_ROUNDS,
+    )
+    assert result is True
+    assert GeneralData.objects.filter(data_file_id=data_file.id).count() == BENCH_ROWS
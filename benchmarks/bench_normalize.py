@@ -0,0 +1,26 @@
+""" Benchmarks of csv normalization by header layout and date format """
+import pytest
+
+from api.utils import JHCsvNormalizer
+from api.utils import read_csv_header
+from api.utils import csv_header2model_field_mapper
+
+from conftest import BENCH_ROWS
+from conftest import LAYOUT_FORMATS
+
+
+@pytest.mark.parametrize('layout,date_format', LAYOUT_FORMATS)
+def bench_normalize(benchmark, synthetic_reports, layout, date_format):
+    path = synthetic_reports[(layout, date_format)]
+    with open(path, 'rb') as file_:
+        csv_header, delimiter = read_csv_header(file_)
+    field_mapping = csv_header2model_field_mapper(csv_header=csv_header)
+
+    def normalize():
+        # Date format is sniffed on every round as it is for a new layout
+        normalizer = JHCsvNormalizer(source=path, field_mapping=field_mapping, delimiter=delimiter)
+        for _ in normalizer.iter_csv(static_columns={'report_day': None, 'data_file_id': 1}):
+            pass
+        return normalizer.rows
+
+    assert benchmark(normalize) == BENCH_ROWS
@@ -0,0 +1,41 @@
+""" Benchmarks comparing ModelSerializer with JSONRenderer against values() fast path with FastJSONRenderer """
+import pytest
+from rest_framework.renderers import JSONRenderer
+
+from api.models import GeneralData
+from api.renderers import FastJSONRenderer
+from api.serializers import GeneralDataSerializer
+from api.serializers import GENERAL_DATA_VALUES_SERIALIZER
+
+from conftest import BENCH_ROWS
+
+
+def get_queryset():
+    return GeneralData.objects.order_by('last_update', 'id')[:BENCH_ROWS]
+
+
+def render_model_serializer():
+    return JSONRenderer().render(GeneralDataSerializer(get_queryset(), many=True).data)
+
+
+def render_values():
+    queryset = GENERAL_DATA_VALUES_SERIALIZER.get_queryset(get_queryset())
+    return FastJSONRenderer().render(GENERAL_DATA_VALUES_SERIALIZER.to_representation(queryset))
+
+
+PATHS = {
+    'model_serializer': render_model_serializer,
+    'values': render_values,
+}
+
+
+@pytest.mark.django_db
+def bench_paths_render_same_bytes():
+    assert render_values() == render_model_serializer()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path', sorted(PATHS))
+def bench_render_rows(benchmark, path):
+    benchmark.group = 'render {rows} rows'.format(rows=BENCH_ROWS)
+    assert benchmark(PATHS[path])
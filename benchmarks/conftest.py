@@ -0,0 +1,68 @@
+""" Fixtures of benchmarks, scale is set by BENCH_ROWS (rows by file) and BENCH_DAYS (files seeded) """
+import os
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api.synthetic import HEADER_LAYOUTS
+from api.synthetic import write_dataset
+from api.synthetic import write_daily_report
+
+
+BENCH_ROWS = int(os.environ.get('BENCH_ROWS', 10000))
+BENCH_DAYS = int(os.environ.get('BENCH_DAYS', 14))
+BENCH_ROUNDS = int(os.environ.get('BENCH_ROUNDS', 5))
+LAYOUT_FORMATS = [
+    (layout, date_format) for layout, definition in HEADER_LAYOUTS.items() for date_format in definition['date_formats']
+]
+
+
+@pytest.fixture(scope='session')
+def bench_directory(tmp_path_factory):
+    return tmp_path_factory.mktemp('bench')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def bench_settings(bench_directory):
+    """ Files stored by imports go to a temporary directory """
+    override = override_settings(MEDIA_ROOT=str(bench_directory / 'media'), API_MIRROR_ROOT=None)
+    override.enable()
+    yield
+    override.disable()
+
+
+@pytest.fixture(scope='session')
+def synthetic_reports(bench_directory):
+    """ A daily report of BENCH_ROWS rows by every layout and date format """
+    directory = bench_directory / 'reports'
+    directory.mkdir()
+    reports = {}
+    for index, (layout, date_format) in enumerate(LAYOUT_FORMATS):
+        path = directory / '03-{day:02d}-2020.csv'.format(day=index + 1)
+        with open(str(path), 'w', newline='', encoding='utf-8') as file_:
+            write_daily_report(
+                file_=file_,
+                report_day=datetime.date(2020, 3, index + 1),
+                rows=BENCH_ROWS,
+                layout=layout,
+                date_format=date_format,
+            )
+        reports[(layout, date_format)] = str(path)
+    return reports
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker, bench_settings, bench_directory):
+    """ Test database seeded once with BENCH_DAYS daily reports ending today, imported by backfill command """
+    directory = str(bench_directory / 'dataset')
+    write_dataset(
+        directory=directory,
+        days=BENCH_DAYS,
+        rows=BENCH_ROWS,
+        start_day=timezone.localdate() - datetime.timedelta(days=BENCH_DAYS - 1),
+    )
+    with django_db_blocker.unblock():
+        call_command('backfill_covid_data', directory, workers=2, db_workers=2)
@@ -0,0 +1,13 @@
+"""
+Settings of servers started by loadtest command, database and media root seeded by the command
+are given by LOADTEST_DATABASE_NAME and LOADTEST_MEDIA_ROOT environment variables, LOADTEST_ASYNC_VIEWS=1 enables
+async read views.
+"""
+from covid_19.settings import *
+
+DATABASES['default']['NAME'] = os.environ.get('LOADTEST_DATABASE_NAME', DATABASES['default']['NAME'])
+MEDIA_ROOT = os.environ.get('LOADTEST_MEDIA_ROOT', MEDIA_ROOT)
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+API_MIRROR_ROOT = None
+API_ASYNC_READ_VIEWS = os.environ.get('LOADTEST_ASYNC_VIEWS') == '1'
+DATABASES['default']['CONN_MAX_AGE'] = 60
@@ -9,6 +9,7 @@ DATABASES = {
         'PASSWORD': '',  # Database passwod
         'HOST': '',  # Database host
         'PORT': '',  # Set to empty string for default.
+        'CONN_MAX_AGE': 60,  # Seconds a connection is reused by requests of same thread, 0 closes it every request
 
     }
 }
@@ -16,3 +17,11 @@ DATABASES = {
 # Specify celery broker more info: https://docs.celeryproject.org/en/latest/getting-started/brokers/
 CELERY_BROKER_URL = ''
 
+
+# Shared cache for versioned api responses, more info: https://docs.djangoproject.com/en/3.1/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}